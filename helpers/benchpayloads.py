@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; grammar-ext: py; mode: python -*-
+
+# ========================================================================
+"""
+Copyright and other protections apply. Please see the accompanying
+:doc:`LICENSE <LICENSE>` and :doc:`CREDITS <CREDITS>` file(s) for rights
+and restrictions governing use of this software. All rights not expressly
+waived or licensed are reserved. If those files are missing or appear to
+be modified from their originals, then please contact the author before
+viewing or using this software in any capacity.
+
+Micro-benchmarks for encoding and decoding Engine.IO v3 binary payloads.
+``loop header`` times the per-octet length decoder the bulk
+:func:`~txsocketio.engineio._decbinpayloadheader` replaced, for
+comparison. Run from the top of the repository::
+
+    python helpers/benchpayloads.py [--number N] [--repeat N]
+"""
+# ========================================================================
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+)
+from builtins import *  # noqa: F401,F403 # pylint: disable=redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-name-in-module,redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+
+# ---- Imports -----------------------------------------------------------
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from txsocketio.engineio import (  # noqa: E402 # pylint: disable=wrong-import-position
+    _decbinpayloadheader,
+    decbinpayloadsgen,
+    encbinpayload,
+)
+
+# ---- Constants ---------------------------------------------------------
+
+_SIZES = (
+    ( '1 B', 1 ),
+    ( '1 KB', 1024 ),
+    ( '1 MB', 1024 * 1024 ),
+)
+
+# ---- Functions ---------------------------------------------------------
+
+# ========================================================================
+def main():
+    parser = argparse.ArgumentParser(description='Time binary payload encoding and decoding.')
+    parser.add_argument('--number', type=int, default=10000, help='calls per timing (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=5, help='timings to take the best of (default: %(default)s)')
+    args = parser.parse_args()
+
+    print('{:<8} {:>14} {:>14} {:>14} {:>18}'.format('size', 'encbinpayload', 'header', 'loop header', 'decbinpayloadsgen'))
+
+    for label, size in _SIZES:
+        packet = bytes(b'4' + b'x' * (size - 1))
+        raw = encbinpayload(packet)
+        number = max(1, args.number * 1024 // max(size, 1024))
+        timings = (
+            lambda: encbinpayload(packet),
+            lambda: _decbinpayloadheader(raw, 0),
+            lambda: _loopheader(raw, 0),
+            lambda: list(decbinpayloadsgen(raw)),
+        )
+        usecs = [ min(timeit.repeat(f, number=number, repeat=args.repeat)) / number * 1e6 for f in timings ]
+        print('{:<8} {:>11.2f} us {:>11.2f} us {:>11.2f} us {:>15.2f} us'.format(label, *usecs))
+
+# ========================================================================
+def _loopheader(raw, pos):
+    payload_type = raw[pos]
+    pos += 1
+    payload_len_str = ''
+
+    while True:
+        byte_int = raw[pos]
+
+        if byte_int == 255:
+            pos += 1
+            break
+
+        pos += 1
+        payload_len_str += str(byte_int)
+
+    return payload_type, int(payload_len_str, 10), pos
+
+# ---- Initialization ----------------------------------------------------
+
+if __name__ == '__main__':
+    main()
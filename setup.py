@@ -39,6 +39,11 @@ INSTALL_REQUIRES = (
     'txrc >= 0.1.0, < 0.3.0',
 )
 
+EXTRAS_REQUIRE = {
+    'http2': ( 'h2', ),
+    'websocket': ( 'autobahn', ),
+}
+
 TESTS_REQUIRE = [
     'pytest',
 ]
@@ -97,6 +102,7 @@ SETUP_ARGS = {
     'packages': setuptools.find_packages(),
     'include_package_data': True,
     'install_requires': INSTALL_REQUIRES,
+    'extras_require': EXTRAS_REQUIRE,
     'setup_requires': ( 'pytest-runner', ),
     'tests_require': TESTS_REQUIRE,
 }
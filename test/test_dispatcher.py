@@ -185,6 +185,66 @@ class DispatcherTestCase(t_unittest.TestCase):
         dispatcher.dispatch('a')
         self.assertEqual(results, expected)
 
+    def test_registration_tokens(self):
+        dispatcher = Dispatcher()
+        handler = mock.Mock(return_value=None)
+        tokens = [ dispatcher.registertoken('a', handler) for _ in range(4) ]
+        once_token = dispatcher.registertoken('a', handler, once=True)
+        dispatcher.dispatch('a')
+        self.assertEqual(handler.call_count, 5)
+        self.assertFalse(dispatcher.unregistertoken(once_token))
+
+        handler.reset_mock()
+        self.assertTrue(dispatcher.unregistertoken(tokens[1]))
+        self.assertFalse(dispatcher.unregistertoken(tokens[1]))
+        dispatcher.dispatch('a')
+        self.assertEqual(handler.call_count, 3)
+
+        for token in tokens[::2]:
+            self.assertTrue(dispatcher.unregistertoken(token))
+
+        handler.reset_mock()
+        dispatcher.dispatch('a')
+        self.assertEqual(handler.call_count, 1)
+        self.assertTrue(dispatcher.unregister('a', handler))
+        self.assertFalse(dispatcher.unregistertoken(tokens[3]))
+        dispatcher.dispatch('a')
+        self.assertEqual(handler.call_count, 1)
+
+        # Nothing is left behind
+        self.assertEqual(dispatcher._callbacks, {})  # pylint: disable=protected-access
+        self.assertEqual(dispatcher._dead_counts, {})  # pylint: disable=protected-access
+        self.assertIsNone(Dispatcher(( 1, )).registertoken(2, handler))
+
+    def test_registration_during_dispatch(self):
+        dispatcher = Dispatcher()
+        calls = []
+
+        def _first(event):
+            calls.append('first')
+            dispatcher.register(event, _added)
+            dispatcher.unregister(event, _second)
+            dispatcher.dispatch(event)
+
+        def _second(event):
+            calls.append('second')
+
+        def _once(event):
+            calls.append('once')
+
+        def _added(event):
+            calls.append('added')
+
+        dispatcher.once('a', _first)
+        dispatcher.register('a', _second)
+        dispatcher.once('a', _once)
+        dispatcher.dispatch('a')
+
+        # _first's nested dispatch calls _once and _added; _once is
+        # already gone and _second was unregistered by the time the outer
+        # dispatch gets to them
+        self.assertEqual(calls, [ 'first', 'once', 'added' ])
+
 # ---- Initialization ----------------------------------------------------
 
 if __name__ == '__main__':
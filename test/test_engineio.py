@@ -20,28 +20,58 @@ from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-n
 
 # ---- Imports -----------------------------------------------------------
 
+import base64
+import hashlib
 import logging
+import re
+import struct
+import zlib
 import hypothesis
 from hypothesis import strategies
+from twisted.internet import (
+    defer as t_defer,
+    error as t_error,
+    task as t_task,
+)
+from twisted.python import failure as t_failure
+from twisted.test import proto_helpers as t_proto_helpers
 from twisted.trial import unittest as t_unittest
-# TODO
-# from twisted.web import (
-#     http_headers as t_http_headers,
-#     iweb as t_iweb,
-# )
-# from zope import interface # pyl#int: disable=import-error
+from twisted.web import (
+    client as t_client,
+    http_headers as t_http_headers,
+    iweb as t_iweb,
+)
+import txrc
+from zope import interface
 
+from txsocketio import engineio
+from txsocketio.endpoint import BaseUrl
 from txsocketio.engineio import (
     EIO_TYPE_CODES_BY_NAME,
     EIO_TYPE_NAMES_BY_CODE,
+    BinPayloadsDecoder,
+    EngineIo,
+    HeartbeatWheel,
     PayloadDecodeError,
     PayloadEncodeError,
+    PollingTransport,
+    ReconnectPolicy,
+    RecordPayloadsDecoder,
+    SharedConnectionPool,
+    TRANSPORT_STATE_CONNECTED,
+    TRANSPORT_STATE_DISCONNECTED,
+    TRANSPORT_STATE_DISCONNECTING,
+    TRANSPORT_STATE_RECEIVING,
     TransportContext,
+    WebSocketTransport,
     decbinpayloadsgen,
     deceiopacket,
+    decrecordpayloadsgen,
+    encbinpayload,
     encbinpayloads,
     encbinpayloadsgen,
     enceiopacket,
+    encrecordpayloads,
 )
 import test  # noqa: F401 # pylint: disable=unused-import
 
@@ -53,38 +83,709 @@ _LOGGER = logging.getLogger(__name__)
 
 # ---- Classes -----------------------------------------------------------
 
-# TODO
-# # ========================================================================
-# @interface.implementer(t_iweb.IResponse)
-# class MockResponse(object):
-#
-#     # ---- Constructor ---------------------------------------------------
-#
-#     def __init__(self, body=b''):
-#         self.version = ( b'HTTP', 1, 1 )
-#         self.code = 200
-#         self.phrase = b'OK'
-#         self.length = t_iweb.UNKNOWN_LENGTH
-#         self.headers = []
-#         self.previousResponse = None
-#         self.setBody(body)
-#
-#     # ---- Public hooks --------------------------------------------------
-#
-#     def deliverBody(self, protocol):
-#         protocol.dataReceived(self.body)
-#         protocol.connectionLost(None)
-#
-#     def setPreviousResponse(self, response):
-#         self.previousResponse = response
-#
-#     # ---- Public methods ------------------------------------------------
-#
-#     def setBody(self, body=b''):
-#         self._body = b''
-#         self.length = t_iweb.UNKNOWN_LENGTH
-#         self.headers = [ h for h in self.headers if h[0] != b'Content-Length' ]
-#         self.headers.append(( b'Content-Length', str(self.length).encode('ascii') ))
+# ========================================================================
+@interface.implementer(t_iweb.IResponse)
+class MockResponse(object):
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, code=200, phrase=b'OK', headers=None):
+        self.version = ( b'HTTP', 1, 1 )
+        self.code = code
+        self.phrase = phrase
+        self.length = t_iweb.UNKNOWN_LENGTH
+        self.headers = t_http_headers.Headers(headers)
+        self.previousResponse = None
+        self.protocol = None
+        self.transport = t_proto_helpers.StringTransport()
+
+    # ---- Public hooks --------------------------------------------------
+
+    def deliverBody(self, protocol):
+        self.protocol = protocol
+        protocol.makeConnection(self.transport)
+
+    def setPreviousResponse(self, response):
+        self.previousResponse = response
+
+    # ---- Public methods ------------------------------------------------
+
+    def finish(self):
+        self.protocol.connectionLost(t_failure.Failure(t_client.ResponseDone()))
+
+    def write(self, data):
+        self.protocol.dataReceived(data)
+
+# ========================================================================
+@interface.implementer(t_iweb.IAgent)
+class MockAgent(object):
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        self.requests = []
+
+    # ---- Public hooks --------------------------------------------------
+
+    def request(self, method, uri, headers=None, bodyProducer=None):
+        d = t_defer.Deferred()
+        self.requests.append(( method, uri, headers, bodyProducer, d ))
+
+        return d
+
+# ========================================================================
+@interface.implementer(t_iweb.IAgentEndpointFactory)
+class MockEndpointFactory(object):
+    """
+    Acts as its own endpoint, connecting each protocol to a
+    :class:`twisted.test.proto_helpers.StringTransport`.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        self.uris = []
+        self.protocols = []
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        protocol.makeConnection(MockTcpTransport())
+        self.protocols.append(protocol)
+
+        return t_defer.succeed(protocol)
+
+    def endpointForURI(self, uri):
+        self.uris.append(uri.toBytes())
+
+        return self
+
+# ========================================================================
+class MockTcpTransport(t_proto_helpers.StringTransport):
+    """
+    Like real TCP transports (but unlike
+    :class:`twisted.test.proto_helpers.StringTransport`), this tolerates
+    :meth:`unregisterProducer` calls without a registered producer.
+    """
+
+    # ---- Public hooks --------------------------------------------------
+
+    def unregisterProducer(self):
+        self.producer = None
+        self.streaming = None
+
+# ========================================================================
+class EngineIoTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    if not engineio._WEBSOCKET_SUPPORTED:  # pylint: disable=protected-access
+        skip = 'autobahn is not available'
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.clock = t_task.Clock()
+        self.agent = MockAgent()
+        self.endpoint_factory = MockEndpointFactory()
+        self.transport_factories = {
+            'polling': PollingTransport.Factory(agent=self.agent),
+            'websocket': WebSocketTransport.Factory(endpoint_factory=self.endpoint_factory),
+        }
+        self.received = []
+        self._mkengineio()
+
+    def test_direct(self):
+        self._mkengineio(direct_transport='websocket')
+        started = []
+        self.engineio.start().addBoth(started.append)
+        self.assertEqual(self.endpoint_factory.uris, [ b'http://dummy.dom/engine.io/?EIO=3&transport=websocket' ])
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}') + _wsframe(b'4a'))
+        self.assertEqual(started, [ None ])
+        self.assertTrue(self.engineio.running)
+        self.assertFalse(self.engineio.upgrading)
+        self.assertEqual(self.received, [ ( 'open', ), ( 'message', 'a' ) ])
+        self.assertEqual(self.agent.requests, [])
+
+        # Pings go out over the direct transport
+        self.clock.advance(25)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'2probe' ) ])
+
+    def test_protocol_4(self):
+        self._mkengineio(direct_transport='websocket', protocol=engineio.EIO_PROTOCOL_4)
+        self.engineio.start()
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}'))
+        self.assertTrue(self.engineio.running)
+
+        # We don't ping; we only answer the server's pings
+        self.clock.advance(25)
+        self.assertEqual(_wsframes(protocol.transport), [])
+        protocol.dataReceived(_wsframe(b'2'))
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'3' ) ])
+        self.assertIsNone(self.engineio.rtt)
+
+        # The server is presumed dead if its pings stop
+        self.clock.advance(29)
+        self.assertTrue(self.engineio.running)
+        self.clock.advance(1)
+        self.assertIsInstance(self.engineio.close_reason, engineio.PingTimeoutError)
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.received, [ ( 'open', ), ( 'close', ) ])
+
+    def test_heartbeat(self):
+        heartbeat = HeartbeatWheel(self.clock, tick=1, slots=16)
+        protocols = []
+
+        for _ in range(2):
+            self._mkengineio(direct_transport='websocket', heartbeat=heartbeat)
+            self.engineio.start()
+            protocol = self.endpoint_factory.protocols[-1]
+            _wshandshake(protocol)
+            protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}'))
+            protocols.append(protocol)
+
+        # Both sessions share the wheel's single delayed call
+        self.assertEqual(len(heartbeat), 2)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(25)
+        self.assertEqual([ _wsframes(p.transport) for p in protocols ], [ [ ( 0x1, b'2probe' ) ] ] * 2)
+
+        # Each session has its next ping and its pong deadline pending
+        self.assertEqual(len(heartbeat), 4)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        protocols[0].dataReceived(_wsframe(b'3probe'))
+        self.assertEqual(len(heartbeat), 3)
+        protocols[0].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(len(heartbeat), 2)
+
+    def test_liveness(self):
+        self._mkengineio(direct_transport='websocket')
+        self.engineio.start()
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}'))
+        self.clock.advance(25)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'2probe' ) ])
+        self.clock.advance(0.25)
+        protocol.dataReceived(_wsframe(b'3probe'))
+        self.assertEqual(self.engineio.rtt, 0.25)
+        self.assertEqual(self.received, [ ( 'open', ) ])
+
+        # The pong deadline was disarmed
+        self.clock.advance(24.75)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'2probe' ) ])
+        self.assertTrue(self.engineio.running)
+        self.assertIsNone(self.engineio.close_reason)
+
+        # No pong this time, so the transport is torn down without a
+        # close packet
+        self.clock.advance(5)
+        self.assertIsInstance(self.engineio.close_reason, engineio.PingTimeoutError)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x8, b'\x03\xe8' ) ])
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.received, [ ( 'open', ), ( 'close', ) ])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_reconnect(self):
+        del self.transport_factories['polling']
+        self._mkengineio(direct_transport='websocket', reconnect=ReconnectPolicy(base_delay=1, max_attempts=3, rand=lambda: 1.0))
+
+        for event in ( 'reconnect', 'reconnect_failed' ):
+            self.engineio.register(event, lambda event, attempt: self.received.append(( event, attempt )))
+
+        self.engineio.start()
+        self._wsopen(0)
+        self.endpoint_factory.protocols[0].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.received, [ ( 'open', ), ( 'close', ) ])
+        self.assertTrue(self.engineio.reconnecting)
+        self.assertFalse(self.engineio.running)
+        self.assertRaises(engineio.TransportStateError, self.engineio.start)
+
+        # The first attempt fails, and the next one waits twice as long
+        self.clock.advance(1)
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        self.endpoint_factory.protocols[1].connectionLost(t_failure.Failure(t_error.ConnectionRefusedError()))
+        self.flushLoggedErrors(t_error.ConnectionLost)
+        self.clock.advance(1.5)
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+        self._wsopen(2)
+        self.assertEqual(self.received[-2:], [ ( 'reconnect', 2 ), ( 'open', ) ])
+        self.assertFalse(self.engineio.reconnecting)
+        self.assertTrue(self.engineio.running)
+
+        # Stopping abandons any pending attempt
+        self.endpoint_factory.protocols[2].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertTrue(self.engineio.reconnecting)
+        self.assertEqual(self.successResultOf(self.engineio.stop()), None)
+        self.assertFalse(self.engineio.reconnecting)
+        self.clock.advance(60)
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+
+    def test_reconnect_exhausted(self):
+        del self.transport_factories['polling']
+        self._mkengineio(direct_transport='websocket', reconnect=ReconnectPolicy(base_delay=1, max_attempts=2, rand=lambda: 1.0))
+        self.engineio.register('reconnect_failed', lambda event, attempt: self.received.append(( event, attempt )))
+        self.engineio.start()
+        self._wsopen(0)
+        self.endpoint_factory.protocols[0].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+
+        for i in range(1, 3):
+            self.clock.advance(60)
+            self.endpoint_factory.protocols[i].connectionLost(t_failure.Failure(t_error.ConnectionRefusedError()))
+
+        self.flushLoggedErrors(t_error.ConnectionLost)
+        self.assertEqual(self.received[-1], ( 'reconnect_failed', 2 ))
+        self.assertFalse(self.engineio.reconnecting)
+        self.clock.advance(60)
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+
+    def test_buffer(self):
+        del self.transport_factories['polling']
+        self._mkengineio(direct_transport='websocket', reconnect=ReconnectPolicy(base_delay=1, rand=lambda: 1.0), max_buffered_packets=2)
+        sent = []
+
+        # Packets sent before the session is open are held
+        self.engineio.start()
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'a').addBoth(sent.append)
+        self.assertEqual(self.engineio.buffered, 1)
+        self._wsopen(0)
+        protocol = self.endpoint_factory.protocols[0]
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'4a' ) ])
+        self.assertEqual(sent, [ None ])
+        self.assertEqual(self.engineio.buffered, 0)
+
+        # So are those sent while reconnecting (up to a point)
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+
+        for data in ( 'b', 'c', 'd' ):
+            self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], data).addBoth(sent.append)
+
+        self.assertEqual(self.engineio.buffered, 2)
+        self.assertTrue(self.engineio.buffer_full)
+        self.assertEqual(len(sent), 2)
+        self.assertTrue(sent[1].check(engineio.BufferOverflowError))
+        self.clock.advance(1)
+        self._wsopen(1)
+        self.assertFalse(self.engineio.buffer_full)
+        self.assertEqual(_wsframes(self.endpoint_factory.protocols[1].transport), [ ( 0x1, b'4c' ), ( 0x1, b'4d' ) ])
+        self.assertEqual(sent[2:], [ None, None ])
+
+        # Held packets fail if we give up
+        self.endpoint_factory.protocols[1].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'e').addBoth(sent.append)
+        self.engineio.stop()
+        self.assertTrue(sent[-1].check(engineio.TransportStateError))
+        self.assertRaises(engineio.TransportStateError, self.engineio.sendeiopacket, EIO_TYPE_CODES_BY_NAME['message'], 'f')
+
+    def test_no_reconnect_after_stop(self):
+        self._mkengineio(direct_transport='websocket', reconnect=ReconnectPolicy(rand=lambda: 1.0))
+        self.engineio.start()
+        self._wsopen(0)
+        self.engineio.stop()
+        self.endpoint_factory.protocols[0].connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.received, [ ( 'open', ), ( 'close', ) ])
+        self.assertFalse(self.engineio.reconnecting)
+
+    def test_direct_fallback(self):
+        self._mkengineio(direct_transport='websocket')
+        started = []
+        self.engineio.start().addBoth(started.append)
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionRefusedError()))
+        self.assertEqual(started, [])
+        self.assertEqual(self._methods(), [ b'GET' ])
+        self._respond(0, '0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}')
+        self.assertEqual(started, [ None ])
+        self.assertTrue(self.engineio.running)
+
+        # The failed attempt doesn't look like a closed session
+        self.assertEqual(self.received, [ ( 'open', ) ])
+
+    def test_direct_no_fallback(self):
+        del self.transport_factories['polling']
+        self.assertRaises(ValueError, self._mkengineio)
+        self._mkengineio(direct_transport='websocket')
+        started = []
+        self.engineio.start().addBoth(started.append)
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionRefusedError()))
+        self.assertEqual(len(started), 1)
+        self.assertTrue(started[0].check(t_error.ConnectionLost))
+        self.assertRaises(engineio.TransportStateError, self.engineio.stop)
+
+    def test_upgrade(self):
+        started = []
+        self.engineio.start().addBoth(started.append)
+        self._respond(0, '0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":["websocket"]}')
+
+        # We're up without waiting for the upgrade
+        self.assertEqual(started, [ None ])
+        self.assertTrue(self.engineio.running)
+        self.assertTrue(self.engineio.upgrading)
+        self.assertEqual(self.received, [ ( 'open', ) ])
+        self.assertEqual(self.endpoint_factory.uris, [ b'http://dummy.dom/engine.io/?EIO=3&transport=websocket&sid=abc' ])
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'2probe' ) ])
+
+        # Polling carries on while probing
+        self.assertEqual(self._methods(), [ b'GET', b'GET' ])
+        self._respond(1, '4a')
+        self.assertEqual(self.received[-1], ( 'message', 'a' ))
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'x')
+        self.assertEqual(self._methods(), [ b'GET', b'GET', b'GET', b'POST' ])
+        self._respond(3, b'ok')
+
+        # Once the probe succeeds, packets are held while the in-flight
+        # poll completes instead of being canceled
+        protocol.dataReceived(_wsframe(b'3probe'))
+        sent = []
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'y').addBoth(sent.append)
+        self.assertTrue(self.engineio.running)
+        self.assertEqual(_wsframes(protocol.transport), [])
+        self.assertEqual(len(self.agent.requests), 4)
+        self._respond(2, '4b', '6')
+        self.assertEqual(len(self.agent.requests), 4)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'5' ), ( 0x1, b'4y' ) ])
+        self.assertEqual(sent, [ None ])
+        self.assertEqual(self.received[-2:], [ ( 'message', 'b' ), ( 'upgrade', ) ])
+        self.assertFalse(self.engineio.upgrading)
+
+        protocol.dataReceived(_wsframe(b'4c'))
+        self.assertEqual(self.received[-1], ( 'message', 'c' ))
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'z')
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'4z' ) ])
+
+    def test_upgrade_failed(self):
+        self.engineio.start()
+        self._respond(0, '0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":["websocket"]}')
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'4nope'))
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertFalse(self.engineio.upgrading)
+        self.assertTrue(self.engineio.running)
+        self.flushLoggedErrors(engineio.TransportStateError)
+
+        # Polling is none the wiser
+        self.engineio.sendeiopacket(EIO_TYPE_CODES_BY_NAME['message'], 'x')
+        self.assertEqual(self._methods(), [ b'GET', b'GET', b'POST' ])
+        self._respond(1, '4a')
+        self.assertEqual(self.received, [ ( 'open', ), ( 'message', 'a' ) ])
+
+    def test_stop_while_upgrading(self):
+        self.engineio.start()
+        self._respond(0, '0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":["websocket"]}')
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        stopped = []
+        self.engineio.stop().addBoth(stopped.append)
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionAborted()))
+        self.assertFalse(self.engineio.upgrading)
+
+        # The close packet goes out over polling
+        self.assertEqual(self._methods(), [ b'GET', b'GET', b'POST' ])
+        _, _, _, body_producer, _ = self.agent.requests[2]
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '1' ])  # pylint: disable=protected-access
+        self._respond(2, b'ok')
+        self.assertEqual(stopped, [ None ])
+        self.assertEqual(self.received, [ ( 'open', ), ( 'close', ) ])
+
+    # ---- Private methods -----------------------------------------------
+
+    def _methods(self):
+        return [ method for method, _, _, _, _ in self.agent.requests ]
+
+    def _mkengineio(self, **kw):
+        self.engineio = EngineIo(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'), transport_factories=self.transport_factories, reactor=self.clock, **kw)
+
+        for event in ( 'close', 'open', 'upgrade' ):
+            self.engineio.register(event, lambda event: self.received.append(( event, )))
+
+        self.engineio.register('message', lambda event, data: self.received.append(( event, data )))
+
+    def _wsopen(self, i):
+        protocol = self.endpoint_factory.protocols[i]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}'))
+
+    def _respond(self, i, *packets):
+        response = MockResponse()
+        self.agent.requests[i][-1].callback(response)
+
+        if len(packets) == 1 \
+                and isinstance(packets[0], bytes):
+            response.write(packets[0])
+        else:
+            response.write(encbinpayloads(packets))
+
+        response.finish()
+
+# ========================================================================
+class HeartbeatWheelTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.clock = t_task.Clock()
+        self.heartbeat = HeartbeatWheel(self.clock, tick=1, slots=4)
+
+    def test_schedule(self):
+        fired = []
+        self.heartbeat.schedule(2, fired.append, 'a').addCallback(fired.append)
+        self.heartbeat.schedule(2.5, fired.append, 'b')
+        self.heartbeat.schedule(9, fired.append, 'c')
+        self.assertEqual(len(self.heartbeat), 3)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(2)
+        self.assertEqual(fired, [ 'a', None ])
+        self.clock.advance(1)
+        self.assertEqual(fired, [ 'a', None, 'b' ])
+
+        # Longer delays go around the wheel more than once
+        self.clock.advance(5)
+        self.assertEqual(fired, [ 'a', None, 'b' ])
+        self.clock.advance(1)
+        self.assertEqual(fired, [ 'a', None, 'b', 'c' ])
+
+        # Nothing is scheduled when the wheel is empty
+        self.assertEqual(len(self.heartbeat), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_batch(self):
+        fired = []
+
+        for i in range(100):
+            self.heartbeat.schedule(3, fired.append, i)
+
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(3)
+        self.assertEqual(fired, list(range(100)))
+
+    def test_cancel(self):
+        fired = []
+        d = self.heartbeat.schedule(1, fired.append, 'a')
+        d.addErrback(lambda f: f.trap(t_defer.CancelledError))
+        d.cancel()
+        self.assertEqual(len(self.heartbeat), 0)
+        self.clock.advance(1)
+        self.assertEqual(fired, [])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_skipped_ticks(self):
+        fired = []
+        self.heartbeat.schedule(1, fired.append, 'a')
+        self.heartbeat.schedule(3, fired.append, 'b')
+        self.clock.advance(10)
+        self.assertEqual(fired, [ 'a', 'b' ])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, HeartbeatWheel, self.clock, tick=0)
+        self.assertRaises(ValueError, HeartbeatWheel, self.clock, slots=0)
+
+# ========================================================================
+class SendBufferTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    def test_drop_oldest(self):
+        send_buffer = engineio._SendBuffer(max_packets=2, max_bytes=4)  # pylint: disable=protected-access
+        ds = [ send_buffer.append(( ( EIO_TYPE_CODES_BY_NAME['message'], data ), ))[0] for data in ( 'a', 'bb', 'c', 'dddd', 'eeeee' ) ]
+        self.failureResultOf(ds[0], engineio.BufferOverflowError)
+        self.failureResultOf(ds[1], engineio.BufferOverflowError)
+        self.failureResultOf(ds[2], engineio.BufferOverflowError)
+        self.failureResultOf(ds[4], engineio.BufferOverflowError)
+        self.assertEqual(( len(send_buffer), send_buffer.nbytes ), ( 1, 4 ))
+        self.assertTrue(send_buffer.full)
+        self.assertEqual([ packet_data for _, packet_data, _ in send_buffer.drain() ], [ 'dddd' ])
+        self.assertEqual(( len(send_buffer), send_buffer.nbytes ), ( 0, 0 ))
+        self.assertFalse(send_buffer.full)
+
+    def test_drop_oldest_groups(self):
+        message = EIO_TYPE_CODES_BY_NAME['message']
+        send_buffer = engineio._SendBuffer(max_packets=3)  # pylint: disable=protected-access
+        group_ds = send_buffer.append(( ( message, '51-["bin",{"_placeholder":true,"num":0}]' ), ( message, bytes(b'\x00') ) ))
+        d = send_buffer.append(( ( message, 'a' ), ))[0]
+
+        # Making room for one packet drops the whole (oldest) group
+        send_buffer.append(( ( message, 'b' ), ))
+
+        for group_d in group_ds:
+            self.failureResultOf(group_d, engineio.BufferOverflowError)
+
+        self.assertNoResult(d)
+        self.assertEqual([ packet_data for _, packet_data, _ in send_buffer.drain() ], [ 'a', 'b' ])
+
+        # A group that can never fit is refused outright
+        ds = send_buffer.append(( ( message, 'c' ), ) * 4)
+
+        for d in ds:
+            self.failureResultOf(d, engineio.BufferOverflowError)
+
+        self.assertEqual(len(send_buffer), 0)
+
+    def test_drop_newest(self):
+        send_buffer = engineio._SendBuffer(max_packets=2, overflow=engineio.BUFFER_DROP_NEWEST)  # pylint: disable=protected-access
+        ds = [ send_buffer.append(( ( EIO_TYPE_CODES_BY_NAME['message'], data ), ))[0] for data in ( 'a', 'b', 'c' ) ]
+        self.assertNoResult(ds[0])
+        self.assertNoResult(ds[1])
+        self.failureResultOf(ds[2], engineio.BufferOverflowError)
+        self.assertEqual([ packet_data for _, packet_data, _ in send_buffer.drain() ], [ 'a', 'b' ])
+
+    def test_block(self):
+        send_buffer = engineio._SendBuffer(max_bytes=2, overflow=engineio.BUFFER_BLOCK)  # pylint: disable=protected-access
+        ds = [ send_buffer.append(( ( EIO_TYPE_CODES_BY_NAME['message'], data ), ))[0] for data in ( 'aa', 'b', 'c' ) ]
+
+        for d in ds:
+            self.assertNoResult(d)
+
+        # Waiting packets don't count against the limits
+        self.assertEqual(( len(send_buffer), send_buffer.nbytes, send_buffer.waiting ), ( 1, 2, 2 ))
+        self.assertTrue(send_buffer.full)
+        self.assertEqual([ packet_data for _, packet_data, _ in send_buffer.drain() ], [ 'aa', 'b', 'c' ])
+        self.assertEqual(( len(send_buffer), send_buffer.nbytes, send_buffer.waiting ), ( 0, 0, 0 ))
+        self.assertFalse(send_buffer.full)
+
+        # A packet that could never fit doesn't wait
+        self.failureResultOf(send_buffer.append(( ( EIO_TYPE_CODES_BY_NAME['message'], 'ddd' ), ))[0], engineio.BufferOverflowError)
+
+    def test_block_cancel(self):
+        message = EIO_TYPE_CODES_BY_NAME['message']
+        send_buffer = engineio._SendBuffer(max_packets=2, overflow=engineio.BUFFER_BLOCK)  # pylint: disable=protected-access
+        held_ds = send_buffer.append(( ( message, 'a' ), ( message, 'b' ) ))
+        waiting_d = send_buffer.append(( ( message, 'c' ), ))[0]
+        other_d = send_buffer.append(( ( message, 'd' ), ))[0]
+        self.assertEqual(( len(send_buffer), send_buffer.waiting ), ( 2, 2 ))
+
+        # Canceling a waiting packet just withdraws it
+        waiting_d.cancel()
+        self.failureResultOf(waiting_d, t_defer.CancelledError)
+        self.assertEqual(( len(send_buffer), send_buffer.waiting ), ( 2, 1 ))
+
+        # Canceling a held one withdraws its group and makes room
+        held_ds[1].cancel()
+
+        for d in held_ds:
+            self.failureResultOf(d, t_defer.CancelledError)
+
+        self.assertEqual(( len(send_buffer), send_buffer.waiting ), ( 1, 0 ))
+        self.assertFalse(send_buffer.full)
+        self.assertEqual([ ( packet_data, d ) for _, packet_data, d in send_buffer.drain() ], [ ( 'd', other_d ) ])
+
+    def test_bad_overflow(self):
+        self.assertRaises(ValueError, engineio._SendBuffer, overflow='nope')  # pylint: disable=protected-access
+
+# ========================================================================
+class ReconnectPolicyTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    def test_delay(self):
+        policy = ReconnectPolicy(base_delay=1, max_delay=5, rand=lambda: 1.0)
+        self.assertEqual([ policy.delay(i) for i in range(5) ], [ 1, 2, 4, 5, 5 ])
+        self.assertEqual(policy.delay(10000), 5)
+        policy = ReconnectPolicy(base_delay=1, max_delay=5, rand=lambda: 0.5)
+        self.assertEqual([ policy.delay(i) for i in range(4) ], [ 0.5, 1, 2, 2.5 ])
+
+        # Full jitter
+        policy = ReconnectPolicy(base_delay=1, max_delay=5)
+        delays = [ policy.delay(3) for _ in range(100) ]
+        self.assertTrue(all(( 0 <= d < 5 for d in delays )))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_exhausted(self):
+        self.assertFalse(ReconnectPolicy().exhausted(1000))
+        policy = ReconnectPolicy(max_attempts=2)
+        self.assertEqual([ policy.exhausted(i) for i in range(4) ], [ False, False, True, True ])
+
+    def test_bad_args(self):
+        self.assertRaises(ValueError, ReconnectPolicy, base_delay=-1)
+        self.assertRaises(ValueError, ReconnectPolicy, factor=0.5)
+        self.assertRaises(ValueError, ReconnectPolicy, max_attempts=0)
+
+# ========================================================================
+class SharedConnectionPoolTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.clock = t_task.Clock()
+        self.pool = SharedConnectionPool(self.clock)
+        self.endpoint = MockEndpointFactory()
+        self.key = ( b'https', b'dummy.dom', 443 )
+
+    def test_reuse(self):
+        lease_a = self.pool.lease()
+        lease_b = self.pool.lease()
+        self.assertEqual(self.pool.leases, 2)
+        self.assertEqual(self.pool.reuse_rate, 0.0)
+
+        connections = []
+        lease_a.getConnection(self.key, self.endpoint).addCallback(connections.append)
+        self.assertEqual(len(self.endpoint.protocols), 1)
+        self.pool._putConnection(self.key, self.endpoint.protocols[0])  # pylint: disable=protected-access
+        self.assertEqual(self.pool.idle, 1)
+
+        # Another session gets the warm connection
+        lease_b.getConnection(self.key, self.endpoint).addCallback(connections.append)
+        self.assertEqual(len(self.endpoint.protocols), 1)
+        self.assertEqual(self.pool.idle, 0)
+        self.assertEqual(self.pool.checkouts, 2)
+        self.assertEqual(self.pool.reused, 1)
+        self.assertEqual(self.pool.reuse_rate, 0.5)
+        self.assertEqual(( lease_a.checkouts, lease_a.reused ), ( 1, 0 ))
+        self.assertEqual(( lease_b.checkouts, lease_b.reused ), ( 1, 1 ))
+
+    def test_affinity(self):
+        lease_a = self.pool.lease()
+        lease_b = self.pool.lease()
+        lease_a.getConnection(self.key, self.endpoint)
+        lease_b.getConnection(self.key, self.endpoint)
+        protocol_a, protocol_b = self.endpoint.protocols
+        self.pool._putConnection(self.key, protocol_a)  # pylint: disable=protected-access
+        self.pool._putConnection(self.key, protocol_b)  # pylint: disable=protected-access
+
+        # Each session prefers the connection it last used
+        connections = []
+        lease_b.getConnection(self.key, self.endpoint).addCallback(connections.append)
+        lease_a.getConnection(self.key, self.endpoint).addCallback(connections.append)
+        self.assertEqual([ connection._clientProtocol for connection in connections ], [ protocol_b, protocol_a ])  # pylint: disable=protected-access
+
+    def test_release(self):
+        self.pool.maxPersistentPerHost = 8
+        transport = PollingTransport(self.clock, pool=self.pool)
+        self.assertEqual(self.pool.maxPersistentPerHost, 8)
+        self.assertEqual(self.pool.leases, 1)
+
+        lease = transport._pool  # pylint: disable=protected-access
+        lease.getConnection(self.key, self.endpoint)
+        protocol = self.endpoint.protocols[0]
+        self.pool._putConnection(self.key, protocol)  # pylint: disable=protected-access
+
+        # Releasing a lease leaves idle connections for other sessions
+        lease.closeCachedConnections()
+        lease.closeCachedConnections()
+        self.assertEqual(self.pool.leases, 0)
+        self.assertEqual(self.pool.idle, 1)
+        self.assertFalse(protocol.transport.disconnecting)
+
+        self.pool.closeCachedConnections()
+        self.assertEqual(self.pool.idle, 0)
+        self.assertTrue(protocol.transport.disconnecting)
 
 # ========================================================================
 class PacketsTestCase(t_unittest.TestCase):
@@ -248,6 +949,29 @@ class PayloadsTestCase(t_unittest.TestCase):
         actual = list(decbinpayloadsgen(raw))
         self.assertEqual(expected, actual)
 
+    def test_payload_dec_zerocopy(self):
+        raw = PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD
+        expected = list(decbinpayloadsgen(raw))
+        actual = list(decbinpayloadsgen(raw, zerocopy=True))
+        self.assertEqual(len(expected), len(actual))
+
+        for i, zipped in enumerate(zip(expected, actual)):
+            expected_packet, actual_packet = zipped
+
+            if isinstance(expected_packet, bytes):
+                self.assertIsInstance(actual_packet, memoryview)
+                self.assertIs(actual_packet.obj, raw)
+                self.assertEqual(expected_packet, actual_packet.tobytes(), msg='packet[{}]'.format(i))
+                self.assertEqual(deceiopacket(expected_packet), tuple(( p if isinstance(p, bytes) else p.tobytes() for p in deceiopacket(actual_packet) )), msg='packet[{}]'.format(i))
+            else:
+                self.assertEqual(expected_packet, actual_packet, msg='packet[{}]'.format(i))
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^payload data truncated \(received only 1 of 3 expected octets\) at 17$'):
+            list(decbinpayloadsgen(PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.BAD_TRUNC_PAYLOAD, zerocopy=True))
+
     def test_payload_enc(self):
         packets = (
             PayloadsTestCase.GOOD_STR_PACKET,
@@ -358,6 +1082,27 @@ class PayloadsTestCase(t_unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_payload_dec_unterminated_len(self):
+        decoder = BinPayloadsDecoder()
+        self.assertEqual(list(decoder.feed(bytes(b'\x00' + b'\x09' * 310))), [])
+
+        # The terminator isn't looked for past the longest valid field
+        with self.assertRaisesRegex(PayloadDecodeError, r'^9{311} exceeds max bytes for length field at 1$'):
+            list(decoder.feed(bytes(b'\x09' * 1000)))
+
+    def test_payload_dec_zerocopy_multidigit_len(self):
+        packet = bytes(b'4' + b'x' * 11)
+        raw = encbinpayload(packet) + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD
+        actual = [ bytes(payload) for payload in decbinpayloadsgen(memoryview(raw), zerocopy=True) ]
+        self.assertEqual(actual, [ packet, PayloadsTestCase.GOOD_BIN_PACKET ])
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^9{311} exceeds max bytes for length field at 1$'):
+            list(decbinpayloadsgen(memoryview(PayloadsTestCase.BAD_LEN_VALUE_PAYLOAD), zerocopy=True))
+
+    def test_payload_dec_empty_len(self):
+        with self.assertRaisesRegex(PayloadDecodeError, r'^empty length field at 15$'):
+            list(decbinpayloadsgen(PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + bytes(b'\x00\xff')))
+
     def test_payload_dec_bad_payload(self):
         raw = PayloadsTestCase.BAD_TRUNC_PAYLOAD
         expected = []
@@ -476,6 +1221,76 @@ class PayloadsTestCase(t_unittest.TestCase):
         raw = encbinpayloads(packets)
         self.assertEqual(packets, list(decbinpayloadsgen(raw)))
 
+    def test_payload_dec_streaming(self):
+        raw = PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD \
+            + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD
+        expected = list(decbinpayloadsgen(raw))
+
+        for chunk_len in range(1, len(raw) + 1):
+            decoder = BinPayloadsDecoder()
+            actual = []
+
+            for i in range(0, len(raw), chunk_len):
+                actual.extend(decoder.feed(raw[i:i + chunk_len]))
+
+            decoder.finish()
+            self.assertEqual(expected, actual, msg='chunk_len: {}'.format(chunk_len))
+
+    def test_payload_dec_streaming_large(self):
+        data = bytes(bytearray(( i % 256 for i in range(100000) )))
+        raw = encbinpayload(data) + encbinpayload('4x')
+        decoder = BinPayloadsDecoder()
+        actual = list(decoder.feed(raw[:1000]))
+        buf = decoder._buf  # pylint: disable=protected-access
+
+        for i in range(1000, len(raw), 1000):
+            actual.extend(decoder.feed(raw[i:i + 1000]))
+
+            if i + 1000 < len(data):
+                # Pending octets are accumulated in place
+                self.assertIs(decoder._buf, buf)  # pylint: disable=protected-access
+
+        decoder.finish()
+        self.assertEqual(actual, [ data, '4x' ])
+
+    def test_payload_dec_streaming_zerocopy(self):
+        raw = PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD
+        decoder = BinPayloadsDecoder(zerocopy=True)
+        actual = []
+
+        for payload in decoder.feed(raw[:-1]):
+            actual.append(payload)
+
+        for payload in decoder.feed(raw[-1:]):
+            self.assertIsInstance(payload, memoryview)
+            actual.append(payload.tobytes())
+
+        # Views are released once the decoder moves on
+        self.assertEqual(actual, [ PayloadsTestCase.GOOD_STR_PACKET, PayloadsTestCase.GOOD_BIN_PACKET ])
+        self.assertEqual(decoder._buf, bytearray())  # pylint: disable=protected-access
+
+    def test_payload_dec_streaming_bad(self):
+        raws_and_errors = (
+            ( PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.BAD_LEN_OCTET_PAYLOAD, r'^unrecognized length byte 10 at 15$' ),
+            ( PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.BAD_TYPE_PAYLOAD, r'^unrecognized payload type 2 at 14$' ),
+            ( PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.BAD_LEN_TRUNC_PAYLOAD, r'^payload length field truncated at 17$' ),
+            ( PayloadsTestCase.GOOD_STR_PACKET_PAYLOAD + PayloadsTestCase.GOOD_BIN_PACKET_PAYLOAD + PayloadsTestCase.BAD_TRUNC_PAYLOAD, r'^payload data truncated \(received only 1 of 3 expected octets\) at 17$' ),
+        )
+
+        for raw, error_re in raws_and_errors:
+            with self.assertRaisesRegex(PayloadDecodeError, error_re):
+                list(decbinpayloadsgen(raw))
+
+            decoder = BinPayloadsDecoder()
+
+            with self.assertRaisesRegex(PayloadDecodeError, error_re):
+                for i in range(len(raw)):
+                    list(decoder.feed(raw[i:i + 1]))
+
+                decoder.finish()
+
     def test_regression_long_payload(self):
         # This is raw data from Insight API (on or about 2015-11-05) that
         # we choked on because we (erroneously) didn't allow for payloads
@@ -496,6 +1311,48 @@ class PayloadsTestCase(t_unittest.TestCase):
         actual = [ deceiopacket(pckt) for pckt in decbinpayloadsgen(raw) ]
         self.assertEqual(expected, actual)
 
+    def test_record_payload_enc_dec(self):
+        packets = [ PayloadsTestCase.GOOD_STR_PACKET, PayloadsTestCase.GOOD_BIN_PACKET, str('6'), str('4\u00e9') ]
+        raw = encrecordpayloads(packets)
+        self.assertEqual(raw, bytes(b'4{}\x1ebAAECAw==\x1e6\x1e4\xc3\xa9'))
+        self.assertEqual(list(decrecordpayloadsgen(raw)), packets)
+        self.assertEqual(list(decrecordpayloadsgen(b'')), [])
+
+        with self.assertRaisesRegex(PayloadEncodeError, r'^binary packet type .* for packet\[1\]$'):
+            encrecordpayloads(( PayloadsTestCase.GOOD_STR_PACKET, bytes(b'3\x00') ))
+
+    def test_record_payload_dec_streaming(self):
+        raw = encrecordpayloads(( PayloadsTestCase.GOOD_STR_PACKET, PayloadsTestCase.GOOD_BIN_PACKET, str('4\u00e9') ))
+
+        for chunk_len in range(1, len(raw) + 1):
+            decoder = RecordPayloadsDecoder()
+            actual = []
+
+            for i in range(0, len(raw), chunk_len):
+                actual.extend(decoder.feed(raw[i:i + chunk_len]))
+
+            actual.extend(decoder.finish())
+            self.assertEqual(actual, [ PayloadsTestCase.GOOD_STR_PACKET, PayloadsTestCase.GOOD_BIN_PACKET, str('4\u00e9') ], 'chunk_len: {}'.format(chunk_len))
+
+    def test_record_payload_dec_streaming_large(self):
+        data = str('4' + 'x' * 100000)
+        raw = encrecordpayloads(( data, str('6') ))
+        decoder = RecordPayloadsDecoder()
+        actual = []
+
+        for i in range(0, len(raw), 1000):
+            actual.extend(decoder.feed(raw[i:i + 1000]))
+
+        actual.extend(decoder.finish())
+        self.assertEqual(actual, [ data, str('6') ])
+
+    def test_record_payload_dec_bad(self):
+        with self.assertRaisesRegex(PayloadDecodeError, r'^invalid UTF-8 data at 5: '):
+            list(decrecordpayloadsgen(b'4{}\x1e4\xff'))
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^invalid base64 data at 5: '):
+            list(decrecordpayloadsgen(b'4{}\x1ebAAE'))
+
 # ========================================================================
 class TransportContextTestCase(t_unittest.TestCase):
 
@@ -507,6 +1364,9 @@ class TransportContextTestCase(t_unittest.TestCase):
         base_url = b'http://dummy.dom/engine.io/'
         tc = TransportContext(base_url)
         self.assertEqual(tc.base_url, base_url)
+        self.assertEqual(tc.protocol, engineio.EIO_PROTOCOL_3)
+        self.assertEqual(TransportContext(base_url, engineio.EIO_PROTOCOL_4).protocol, engineio.EIO_PROTOCOL_4)
+        self.assertRaises(ValueError, TransportContext, base_url, 5)
 
         ping_interval = 4321
         ping_timeout = 1234
@@ -524,6 +1384,524 @@ class TransportContextTestCase(t_unittest.TestCase):
         self.assertIsNone(tc.session_id)
         self.assertIsNone(tc.upgrades)
 
+# ========================================================================
+class PollingTransportTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.clock = t_task.Clock()
+        self.agent = MockAgent()
+        self.transport = PollingTransport(self.clock, agent=self.agent)
+        self.transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'))
+
+    def test_streaming_dispatch(self):
+        received = []
+        self.transport.register('open', lambda event: received.append(( event, )))
+        self.transport.register('message', lambda event, data: received.append(( event, data )))
+        connecting_d = self.transport.connect(self.transport_context)
+        connected = []
+        connecting_d.addCallback(connected.append)
+        self.assertEqual(len(self.agent.requests), 1)
+
+        response = MockResponse()
+        self.agent.requests[0][-1].callback(response)
+        open_payload = encbinpayload('0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}')
+        message_payload = encbinpayload('4hello')
+        raw = open_payload + message_payload
+        split = len(open_payload) + 3
+        response.write(raw[:split])
+        self.assertEqual(received, [ ( 'open', ) ])
+        self.assertFalse(connected)
+        response.write(raw[split:])
+        self.assertEqual(received, [ ( 'open', ), ( 'message', 'hello' ) ])
+        self.assertFalse(connected)
+        response.finish()
+        self.assertEqual(connected, [ None ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_CONNECTED)
+        self.assertEqual(self.transport_context.session_id, 'abc')
+
+    def test_binary_packets(self):
+        self.transport_context.set('abc', 5000, 25000, [])
+        received = []
+        self.transport.register('message', lambda event, data: received.append(data))
+        self.transport.connect(self.transport_context)
+
+        # Binary packet types are numbers, not ASCII digits
+        response = MockResponse()
+        self.agent.requests[0][-1].callback(response)
+        response.write(encbinpayload(bytes(b'\x04\x00\xff')) + encbinpayload('4hi'))
+        self.assertEqual(received, [ bytes(b'\x00\xff'), 'hi' ])
+        self.assertIsInstance(received[0], bytes)
+
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], bytes(b'\x01'))
+        _, _, _, body_producer, _ = self.agent.requests[1]
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ bytes(b'\x04\x01') ])  # pylint: disable=protected-access
+
+    def test_protocol_4(self):
+        self.transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'), engineio.EIO_PROTOCOL_4)
+        received = []
+        self.transport.register('open', lambda event: received.append(( event, )))
+        self.transport.register('message', lambda event, data: received.append(( event, data )))
+        self.transport.connect(self.transport_context)
+        self.assertEqual(self.agent.requests[0][1], b'http://dummy.dom/engine.io/?transport=polling&EIO=4')
+
+        response = MockResponse()
+        self.agent.requests[0][-1].callback(response)
+        response.write(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}\x1e4hel')
+        self.assertEqual(received, [ ( 'open', ) ])
+        response.write(b'lo\x1ebAP8=')
+        self.assertEqual(received, [ ( 'open', ), ( 'message', 'hello' ) ])
+        response.finish()
+        self.assertEqual(received, [ ( 'open', ), ( 'message', 'hello' ), ( 'message', b'\x00\xff' ) ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_CONNECTED)
+
+        self.transport = PollingTransport(self.clock, agent=self.agent, coalesce=True)
+        self.transport.connect(self.transport_context)
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'hi')
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], b'\x01')
+        method, _, headers, body_producer, request_d = self.agent.requests[2]
+        self.assertEqual(method, b'POST')
+        self.assertEqual(headers.getRawHeaders(b'Content-Type'), [ b'text/plain; charset=UTF-8' ])
+        self.assertEqual(body_producer._inputFile.getvalue(), b'4hi')  # pylint: disable=protected-access
+        response = MockResponse()
+        request_d.callback(response)
+        response.write(b'ok')
+        response.finish()
+        _, _, _, body_producer, _ = self.agent.requests[3]
+        self.assertEqual(body_producer._inputFile.getvalue(), b'bAQ==')  # pylint: disable=protected-access
+
+    def test_coalesce(self):
+        self.transport = PollingTransport(self.clock, agent=self.agent, coalesce=True)
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+        self.assertEqual(len(self.agent.requests), 1)
+        sent = []
+        ds = []
+
+        for i in range(4):
+            d = self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], str(i))
+            d.addCallback(lambda _, i=i: sent.append(i))
+            ds.append(d)
+
+        # The first packet goes out immediately; the rest wait for it
+        self.assertEqual(len(self.agent.requests), 2)
+        method, _, _, body_producer, request_d = self.agent.requests[1]
+        self.assertEqual(method, b'POST')
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '40' ])  # pylint: disable=protected-access
+
+        response = MockResponse()
+        request_d.callback(response)
+        response.write(b'ok')
+        response.finish()
+        self.assertEqual(sent, [ 0 ])
+        self.assertEqual(len(self.agent.requests), 3)
+        method, _, _, body_producer, request_d = self.agent.requests[2]
+        self.assertEqual(method, b'POST')
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '41', '42', '43' ])  # pylint: disable=protected-access
+
+        response = MockResponse()
+        request_d.callback(response)
+        response.write(b'ok')
+        response.finish()
+        self.assertEqual(sent, [ 0, 1, 2, 3 ])
+        self.assertEqual(len(self.agent.requests), 3)
+
+    def test_coalesce_cancel_in_flight(self):
+        self.transport = PollingTransport(self.clock, agent=self.agent, coalesce=True)
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+        sent = []
+        failed = []
+        ds = []
+
+        for i in range(2):
+            d = self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], str(i))
+            d.addCallbacks(lambda _, i=i: sent.append(i), lambda f, i=i: failed.append(( i, f.trap(t_defer.CancelledError) )))
+            ds.append(d)
+
+        self.assertEqual(len(self.agent.requests), 2)
+        _, _, _, _, request_d = self.agent.requests[1]
+
+        # A late cancel only stops that caller waiting; the POST carries on
+        ds[0].cancel()
+        self.assertEqual(failed, [ ( 0, t_defer.CancelledError ) ])
+        self.assertFalse(request_d.called)
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_RECEIVING)
+
+        response = MockResponse()
+        request_d.callback(response)
+        response.write(b'ok')
+        response.finish()
+        self.assertEqual(sent, [])
+        self.assertEqual(len(self.agent.requests), 3)
+        _, _, _, body_producer, request_d = self.agent.requests[2]
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '41' ])  # pylint: disable=protected-access
+
+        response = MockResponse()
+        request_d.callback(response)
+        response.write(b'ok')
+        response.finish()
+        self.assertEqual(sent, [ 1 ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_RECEIVING)
+
+    def test_coalesce_window(self):
+        self.transport = PollingTransport(self.clock, agent=self.agent, coalesce=True, coalesce_window=0.01)
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+
+        for i in range(3):
+            self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], str(i))
+
+        self.assertEqual(len(self.agent.requests), 1)
+        self.clock.advance(0.01)
+        self.assertEqual(len(self.agent.requests), 2)
+        _, _, _, body_producer, _ = self.agent.requests[1]
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '40', '41', '42' ])  # pylint: disable=protected-access
+
+    def test_request_templates(self):
+        self.transport.connect(self.transport_context)
+        response = MockResponse()
+        self.agent.requests[0][-1].callback(response)
+        response.write(encbinpayload('0{"sid":"a b","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}'))
+        response.finish()
+        self.transport.startreceiving()
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'x')
+        self.assertEqual(self._methods(), [ b'GET', b'GET', b'POST' ])
+        uris = [ uri for _, uri, _, _, _ in self.agent.requests ]
+        self.assertEqual(uris[0], b'http://dummy.dom/engine.io/?transport=polling&EIO=3')
+
+        for i, uri in enumerate(uris[1:], 1):
+            self.assertRegex(uri, br'^http://dummy\.dom/engine\.io/\?transport=polling&EIO=3&sid=a\+b&t=\d+-' + str(i).encode('ascii') + b'$')
+
+        # Headers are built once and shared between requests
+        get_headers, post_headers = self.agent.requests[1][2], self.agent.requests[2][2]
+        self.assertIs(self.agent.requests[0][2], get_headers)
+        self.assertFalse(get_headers.hasHeader(b'Content-Type'))
+        self.assertEqual(post_headers.getRawHeaders(b'Content-Type'), [ b'application/octet-stream' ])
+
+    def test_request_templates_marker(self):
+        # The template marker showing up elsewhere doesn't confuse things
+        self.transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/__T__/engine.io/'))
+        self.transport_context.set('__T__', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'x')
+        uris = [ uri for _, uri, _, _, _ in self.agent.requests ]
+        self.assertEqual(len(uris), 2)
+
+        for i, uri in enumerate(uris):
+            self.assertRegex(uri, br'^http://dummy\.dom/__T__/engine\.io/\?transport=polling&EIO=3&sid=__T__&t=\d+-' + str(i).encode('ascii') + b'$')
+
+    def test_priority_lanes(self):
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+
+        for i in range(3):
+            self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], str(i))
+
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['ping'], 'probe')
+        self.assertEqual(self.transport.queue_depths, { engineio.SEND_LANE_CONTROL: 1, engineio.SEND_LANE_DATA: 2 })
+
+        # The ping jumps ahead of the queued messages
+        bodies = []
+
+        for i in range(1, 5):
+            _, _, _, body_producer, request_d = self.agent.requests[i]
+            bodies.extend(decbinpayloadsgen(body_producer._inputFile.getvalue()))  # pylint: disable=protected-access
+            response = MockResponse()
+            request_d.callback(response)
+            response.write(b'ok')
+            response.finish()
+
+        self.assertEqual(bodies, [ '40', '2probe', '41', '42' ])
+        self.assertEqual(self.transport.queue_depths, { engineio.SEND_LANE_CONTROL: 0, engineio.SEND_LANE_DATA: 0 })
+
+    def test_priority_lanes_coalesce_window(self):
+        self.transport = PollingTransport(self.clock, agent=self.agent, coalesce=True, coalesce_window=0.01)
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'a')
+        self.assertEqual(len(self.agent.requests), 1)
+
+        # Control packets don't wait out the window
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['pong'], '')
+        self.assertEqual(len(self.agent.requests), 2)
+        _, _, _, body_producer, _ = self.agent.requests[1]
+        self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '3', '4a' ])  # pylint: disable=protected-access
+
+    def test_no_coalesce(self):
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+
+        for i in range(2):
+            self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], str(i))
+
+        for i in range(2):
+            self.assertEqual(len(self.agent.requests), i + 2)
+            _, _, _, body_producer, request_d = self.agent.requests[-1]
+            self.assertEqual(list(decbinpayloadsgen(body_producer._inputFile.getvalue())), [ '4' + str(i) ])  # pylint: disable=protected-access
+            response = MockResponse()
+            request_d.callback(response)
+            response.write(b'ok')
+            response.finish()
+
+    def test_compression(self):
+        stats = engineio.CompressionStats()
+        factory = PollingTransport.Factory(agent=self.agent, compression=engineio.COMPRESSION_GZIP, compression_threshold=64, compression_stats=stats)
+        self.transport = factory.buildTransport(self.clock)
+        self.assertIs(self.transport.compression_stats, stats)
+        self.transport_context.set('abc', 5000, 25000, [])
+        self.transport.connect(self.transport_context)
+        big = 'x' * 1000
+
+        for data in ( big, 'small', bytes(bytearray(range(256))) ):
+            self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], data)
+            _, _, _, _, request_d = self.agent.requests[-1]
+            response = MockResponse()
+            request_d.callback(response)
+            response.write(b'ok')
+            response.finish()
+
+        _, _, headers, body_producer, _ = self.agent.requests[1]
+        self.assertEqual(headers.getRawHeaders(b'Content-Encoding'), [ b'gzip' ])
+        body = body_producer._inputFile.getvalue()  # pylint: disable=protected-access
+        self.assertEqual(list(decbinpayloadsgen(zlib.decompress(body, 16 + zlib.MAX_WBITS))), [ '4' + big ])
+
+        # Small and incompressible bodies are sent as-is
+        for i in ( 2, 3 ):
+            _, _, headers, _, _ = self.agent.requests[i]
+            self.assertFalse(headers.hasHeader(b'Content-Encoding'))
+
+        # The shared template isn't modified
+        self.assertFalse(self.transport._requestheaders(True).hasHeader(b'Content-Encoding'))  # pylint: disable=protected-access
+        self.assertEqual(( stats.compressed, stats.skipped, stats.incompressible ), ( 1, 1, 1 ))
+        self.assertEqual(stats.bytes_out, len(body))
+        self.assertLess(stats.ratio, 0.1)
+        self.assertGreaterEqual(stats.cpu_time, 0)
+
+        self.transport = PollingTransport(self.clock, agent=self.agent, compression=engineio.COMPRESSION_DEFLATE, compression_threshold=0)
+        self.transport.connect(self.transport_context)
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], big)
+        _, _, headers, body_producer, _ = self.agent.requests[-1]
+        self.assertEqual(headers.getRawHeaders(b'Content-Encoding'), [ b'deflate' ])
+        self.assertEqual(list(decbinpayloadsgen(zlib.decompress(body_producer._inputFile.getvalue()))), [ '4' + big ])  # pylint: disable=protected-access
+
+        self.assertRaises(ValueError, PollingTransport, self.clock, agent=self.agent, compression='br')
+
+    def test_deflate_responses(self):
+        data = b'hello, hello, hello, hello'
+
+        for wbits in ( zlib.MAX_WBITS, -zlib.MAX_WBITS ):
+            compressobj = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, wbits)
+            body = compressobj.compress(data) + compressobj.flush()
+            response = MockResponse(headers={ b'Content-Encoding': [ b'deflate' ] })
+            bodies = []
+            t_client.readBody(engineio._DeflateDecoder(response)).addCallback(bodies.append)  # pylint: disable=protected-access
+
+            for i in range(0, len(body), 3):
+                response.write(body[i:i + 3])
+
+            response.finish()
+            self.assertEqual(bodies, [ data ], msg='wbits={}'.format(wbits))
+
+    def test_streaming_decode_error(self):
+        self.transport_context.set('abc', 5000, 25000, [])
+        received = []
+        self.transport.register('message', lambda event, data: received.append(data))
+        self.transport.connect(self.transport_context)
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_RECEIVING)
+        self.assertEqual(len(self.agent.requests), 1)
+
+        response = MockResponse()
+        self.agent.requests[0][-1].callback(response)
+        response.write(encbinpayload('4hello') + PayloadsTestCase.BAD_TYPE_PAYLOAD)
+        self.assertEqual(received, [ 'hello' ])
+        self.assertTrue(response.transport.disconnecting or response.transport.disconnected)
+
+    # ---- Private methods -----------------------------------------------
+
+    def _methods(self):
+        return [ method for method, _, _, _, _ in self.agent.requests ]
+
+# ========================================================================
+class WebSocketTransportTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    if not engineio._WEBSOCKET_SUPPORTED:  # pylint: disable=protected-access
+        skip = 'autobahn is not available'
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.clock = t_task.Clock()
+        self.endpoint_factory = MockEndpointFactory()
+        self.transport = WebSocketTransport(self.clock, endpoint_factory=self.endpoint_factory)
+        self.transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'))
+        self.received = []
+
+        for event in ( 'close', 'noop', 'open', 'upgrade' ):
+            self.transport.register(event, lambda event: self.received.append(( event, )))
+
+        for event in ( 'message', 'ping', 'pong' ):
+            self.transport.register(event, lambda event, data: self.received.append(( event, data )))
+
+    def test_missing_autobahn(self):
+        self.patch(engineio, '_WEBSOCKET_SUPPORTED', False)
+
+        with self.assertRaisesRegex(ImportError, r'pip install txsocketio\[websocket\]'):
+            WebSocketTransport(self.clock)
+
+    def test_new_session(self):
+        connected = []
+        self.transport.connect(self.transport_context).addBoth(connected.append)
+        self.assertEqual(self.endpoint_factory.uris, [ b'http://dummy.dom/engine.io/?EIO=3&transport=websocket' ])
+        protocol = self.endpoint_factory.protocols[0]
+        self.assertIn(b'GET /engine.io/?EIO=3&transport=websocket HTTP/1.1\r\n', protocol.transport.value())
+        _wshandshake(protocol)
+        self.assertEqual(connected, [])
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}') + _wsframe(b'4hello') + _wsframe(b'\x04\x00\xff', True))
+        self.assertEqual(connected, [ None ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_RECEIVING)
+        self.assertEqual(self.transport_context.session_id, 'abc')
+        self.assertEqual(self.received, [ ( 'open', ), ( 'message', 'hello' ), ( 'message', b'\x00\xff' ) ])
+
+        # One frame per packet
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'hi')
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], b'\x01')
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['ping'])
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'4hi' ), ( 0x2, b'\x04\x01' ), ( 0x1, b'2' ) ])
+
+        # The server closes the session
+        del self.received[:]
+        protocol.dataReceived(_wsframe(b'1'))
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTING)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x8, b'\x03\xe8' ) ])
+        protocol.dataReceived(b'\x88\x02\x03\xe8')
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTED)
+        self.assertIsNone(self.transport_context.session_id)
+        self.assertEqual(self.received, [ ( 'close', ) ])
+
+    def test_protocol_4(self):
+        self.transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'), engineio.EIO_PROTOCOL_4)
+        self.transport.connect(self.transport_context)
+        self.assertEqual(self.endpoint_factory.uris, [ b'http://dummy.dom/engine.io/?EIO=4&transport=websocket' ])
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}') + _wsframe(b'\x00\xff', True))
+        self.assertEqual(self.received, [ ( 'open', ), ( 'message', b'\x00\xff' ) ])
+
+        # Binary frames carry message data without a type
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], b'\x01')
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x2, b'\x01' ) ])
+        d = self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['ping'], b'\x01')
+        self.failureResultOf(d, PayloadEncodeError)
+
+    def test_upgrade_session(self):
+        self.transport_context.set('abc', 5000, 25000, [ 'websocket' ])
+        connected = []
+        self.transport.connect(self.transport_context).addBoth(connected.append)
+        self.assertEqual(self.endpoint_factory.uris, [ b'http://dummy.dom/engine.io/?EIO=3&transport=websocket&sid=abc' ])
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'2probe' ) ])
+        self.assertEqual(connected, [])
+        protocol.dataReceived(_wsframe(b'3probe'))
+        self.assertEqual(connected, [ None ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_RECEIVING)
+        self.assertEqual(self.received, [])
+
+        # Sending the upgrade packet is up to the caller
+        self.assertEqual(_wsframes(protocol.transport), [])
+        self.transport.sendpacket(EIO_TYPE_CODES_BY_NAME['upgrade'])
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'5' ) ])
+
+        disconnected = []
+        self.transport.disconnect().addBoth(disconnected.append)
+        self.assertEqual(_wsframes(protocol.transport), [ ( 0x1, b'1' ), ( 0x8, b'\x03\xe8' ) ])
+        self.assertEqual(disconnected, [])
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(disconnected, [ None ])
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTED)
+        self.assertIsNone(self.transport_context.session_id)
+        self.assertEqual(self.received, [ ( 'close', ) ])
+
+    def test_upgrade_session_failed(self):
+        self.transport_context.set('abc', 5000, 25000, [ 'websocket' ])
+        connected = []
+        self.transport.connect(self.transport_context).addBoth(connected.append)
+        protocol = self.endpoint_factory.protocols[0]
+        _wshandshake(protocol)
+        protocol.dataReceived(_wsframe(b'4nope'))
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTING)
+        self.assertEqual(connected, [])
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTED)
+        self.assertEqual(len(connected), 1)
+        self.assertTrue(connected[0].check(engineio.TransportStateError))
+
+        # The session survives a failed probe (no close packet, either)
+        self.assertEqual(self.transport_context.session_id, 'abc')
+        self.assertNotIn(( 0x1, b'1' ), _wsframes(protocol.transport))
+        self.assertEqual(self.received, [])
+
+    def test_connect_timeout(self):
+        connected = []
+        self.transport.connect(self.transport_context).addBoth(connected.append)
+        protocol = self.endpoint_factory.protocols[0]
+        self.clock.advance(self.transport.default_timeout)
+        self.assertTrue(protocol.transport.disconnected)
+        self.assertEqual(connected, [])
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionAborted()))
+        self.assertEqual(len(connected), 1)
+        self.assertTrue(connected[0].check(txrc.DeferredTimeoutError))
+        self.assertEqual(self.transport.state, TRANSPORT_STATE_DISCONNECTED)
+        self.assertEqual(self.received, [ ( 'close', ) ])
+
+# ---- Functions ---------------------------------------------------------
+
+# ========================================================================
+def _wsframe(payload, is_binary=False):
+    # Server frames are unmasked
+    header = struct.pack('!BB', 0x82 if is_binary else 0x81, len(payload)) if len(payload) < 126 else struct.pack('!BBH', 0x82 if is_binary else 0x81, 126, len(payload))
+
+    return header + payload
+
+# ========================================================================
+def _wsframes(transport):
+    data = transport.value()
+    transport.clear()
+    frames = []
+
+    while data:
+        opcode, payload_len = data[0] & 0x0f, data[1] & 0x7f
+        pos = 2
+
+        if payload_len == 126:
+            payload_len, = struct.unpack('!H', data[2:4])
+            pos = 4
+
+        mask = data[pos:pos + 4]
+        pos += 4
+        payload = bytes(bytearray(( b ^ mask[i % 4] for i, b in enumerate(data[pos:pos + payload_len]) )))
+        frames.append(( opcode, payload ))
+        data = data[pos + payload_len:]
+
+    return frames
+
+# ========================================================================
+def _wshandshake(protocol):
+    request = protocol.transport.value()
+    protocol.transport.clear()
+    key = re.search(br'Sec-WebSocket-Key: (\S+)', request).group(1)
+    accept = base64.b64encode(hashlib.sha1(key + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+    protocol.dataReceived(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+
 # ---- Initialization ----------------------------------------------------
 
 if __name__ == '__main__':
@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8; grammar-ext: py; mode: python -*-
+
+# ========================================================================
+"""
+Copyright and other protections apply. Please see the accompanying
+:doc:`LICENSE <LICENSE>` and :doc:`CREDITS <CREDITS>` file(s) for rights
+and restrictions governing use of this software. All rights not expressly
+waived or licensed are reserved. If those files are missing or appear to
+be modified from their originals, then please contact the author before
+viewing or using this software in any capacity.
+"""
+# ========================================================================
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+)
+from builtins import *  # noqa: F401,F403 # pylint: disable=redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-name-in-module,redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+
+# ---- Imports -----------------------------------------------------------
+
+import collections
+import logging
+from twisted.internet import (
+    defer as t_defer,
+    error as t_error,
+    protocol as t_protocol,
+    task as t_task,
+)
+from twisted.python import failure as t_failure
+from twisted.test import iosim as t_iosim
+from twisted.trial import unittest as t_unittest
+from twisted.web import (
+    client as t_client,
+    http_headers as t_http_headers,
+)
+
+from txsocketio.endpoint import BaseUrl
+from txsocketio.engineio import (
+    EIO_TYPE_CODES_BY_NAME,
+    PollingTransport,
+    TRANSPORT_STATE_CONNECTED,
+    TransportContext,
+    encbinpayload,
+)
+from txsocketio import longpoll
+from txsocketio.longpoll import (
+    H2LongPollAgent,
+    LongPollAgent,
+)
+import test  # noqa: F401 # pylint: disable=unused-import
+from test.test_engineio import MockEndpointFactory
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.events
+except ImportError:
+    pass
+
+# ---- Constants ---------------------------------------------------------
+
+__all__ = ()
+
+_LOGGER = logging.getLogger(__name__)
+
+# ---- Classes -----------------------------------------------------------
+
+# ========================================================================
+class LongPollAgentTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.endpoint_factory = MockEndpointFactory()
+        self.agent = LongPollAgent(endpoint_factory=self.endpoint_factory)
+
+    def test_content_length(self):
+        headers = t_http_headers.Headers({ b'Accept': [ b'*/*' ] })
+        d = self.agent.request(b'GET', b'http://dummy.dom/engine.io/?t=1', headers)
+        responses = []
+        d.addCallback(responses.append)
+        self.assertEqual(len(self.endpoint_factory.protocols), 1)
+        transport = self.endpoint_factory.protocols[0].transport
+        self.assertEqual(transport.value(), b'GET /engine.io/?t=1 HTTP/1.1\r\nHost: dummy.dom\r\nAccept: */*\r\n\r\n')
+
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\nContent-Type: text/plain\r\n\r\nhe')
+        self.assertEqual(len(responses), 1)
+        response = responses[0]
+        self.assertEqual(response.version, ( b'HTTP', 1, 1 ))
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.phrase, b'OK')
+        self.assertEqual(response.length, 5)
+        self.assertEqual(response.headers.getRawHeaders(b'Content-Type'), [ b'text/plain' ])
+
+        bodies = []
+        t_client.readBody(response).addCallback(bodies.append)
+        self.assertEqual(bodies, [])
+        protocol.dataReceived(b'llo')
+        self.assertEqual(bodies, [ b'hello' ])
+
+        # The connection is reused
+        transport.clear()
+        d = self.agent.request(b'GET', b'http://dummy.dom/engine.io/?t=2')
+        d.addCallback(responses.append)
+        self.assertEqual(len(self.endpoint_factory.protocols), 1)
+        self.assertEqual(transport.value(), b'GET /engine.io/?t=2 HTTP/1.1\r\nHost: dummy.dom\r\n\r\n')
+
+    def test_chunked(self):
+        d = self.agent.request(b'GET', b'http://dummy.dom/engine.io/')
+        responses = []
+        d.addCallback(responses.append)
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5;x=y\r\nhel')
+        self.assertEqual(len(responses), 1)
+
+        received = []
+        finished = []
+        body_protocol = _RecordingProtocol(received, finished)
+        responses[0].deliverBody(body_protocol)
+        self.assertIs(body_protocol.transport, protocol.transport)
+        self.assertEqual(received, [ b'hel' ])
+        protocol.dataReceived(b'lo\r')
+        protocol.dataReceived(b'\nb\r\n world, etc\r\n0\r\nX-Trailer: 1\r\n')
+        self.assertEqual(b''.join(received), b'hello world, etc')
+        self.assertEqual(finished, [])
+        protocol.dataReceived(b'\r\n')
+        self.assertEqual(len(finished), 1)
+        finished[0].trap(t_client.ResponseDone)
+        self.assertFalse(protocol.transport.disconnecting)
+
+    def test_lanes(self):
+        get_d = self.agent.request(b'GET', b'http://dummy.dom/engine.io/')
+        post_d = self.agent.request(b'POST', b'http://dummy.dom/engine.io/', None, b'1:4')
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        get_protocol, post_protocol = self.endpoint_factory.protocols
+        self.assertEqual(post_protocol.transport.value(), b'POST /engine.io/ HTTP/1.1\r\nHost: dummy.dom\r\nContent-Length: 3\r\n\r\n1:4')
+
+        # Requests on the same lane wait their turn
+        queued_d = self.agent.request(b'POST', b'http://dummy.dom/engine.io/', None, b'1:6')
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        post_protocol.transport.clear()
+        responses = []
+        post_d.addCallback(responses.append)
+        queued_d.addCallback(responses.append)
+        post_protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+        self.assertEqual(len(responses), 1)
+        self.assertEqual(post_protocol.transport.value(), b'POST /engine.io/ HTTP/1.1\r\nHost: dummy.dom\r\nContent-Length: 3\r\n\r\n1:6')
+        self.assertFalse(get_d.called)
+
+        # Other servers get their own connections
+        self.agent.request(b'GET', b'http://other.dom/engine.io/')
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+
+    def test_body_producer(self):
+        self.agent.request(b'POST', b'http://dummy.dom/', None, _ImmediateProducer(b'abc'))
+        self.assertEqual(self.endpoint_factory.protocols[0].transport.value(), b'POST / HTTP/1.1\r\nHost: dummy.dom\r\nContent-Length: 3\r\n\r\nabc')
+
+    def test_connection_close(self):
+        d = self.agent.request(b'GET', b'http://dummy.dom/')
+        responses = []
+        d.addCallback(responses.append)
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nConnection: close\r\nContent-Length: 0\r\n\r\n')
+        self.assertEqual(len(responses), 1)
+        self.assertTrue(protocol.transport.disconnecting)
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.agent.request(b'GET', b'http://dummy.dom/').addCallback(responses.append)
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+
+        # Without any framing, the body ends with the connection
+        protocol = self.endpoint_factory.protocols[1]
+        protocol.dataReceived(b'HTTP/1.0 200 OK\r\n\r\nabc')
+        self.agent.request(b'GET', b'http://dummy.dom/?again')
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        received = []
+        finished = []
+        responses[1].deliverBody(_RecordingProtocol(received, finished))
+        protocol.dataReceived(b'def')
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(b''.join(received), b'abcdef')
+        finished[0].trap(t_client.ResponseDone)
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+
+    def test_response_failed(self):
+        d = self.agent.request(b'GET', b'http://dummy.dom/')
+        responses = []
+        d.addCallback(responses.append)
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nabc')
+        received = []
+        finished = []
+        responses[0].deliverBody(_RecordingProtocol(received, finished))
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionLost()))
+        finished[0].trap(t_client.ResponseFailed)
+
+        # Malformed responses are failures, too
+        d = self.agent.request(b'GET', b'http://dummy.dom/')
+        protocol = self.endpoint_factory.protocols[1]
+        protocol.dataReceived(b'SPDY/9 200 OK\r\n\r\n')
+        self.assertTrue(protocol.transport.disconnecting)
+        self.assertFailure(d, t_client.ResponseFailed)
+
+        return d
+
+    def test_retry_stale(self):
+        d = self.agent.request(b'GET', b'http://dummy.dom/')
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+
+        # The server closed the idle connection just as it was reused
+        d = self.agent.request(b'GET', b'http://dummy.dom/?t=2')
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        self.assertFalse(d.called)
+        self.assertEqual(self.endpoint_factory.protocols[1].transport.value(), b'GET /?t=2 HTTP/1.1\r\nHost: dummy.dom\r\n\r\n')
+
+        # POSTs aren't retried
+        d = self.agent.request(b'POST', b'http://dummy.dom/', None, b'')
+        protocol = self.endpoint_factory.protocols[2]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n')
+        d = self.agent.request(b'POST', b'http://dummy.dom/', None, b'')
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionDone()))
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+        self.assertFailure(d, t_client.ResponseNeverReceived)
+
+        return d
+
+    def test_cancel(self):
+        active_d = self.agent.request(b'GET', b'http://dummy.dom/?t=1')
+        queued_d = self.agent.request(b'GET', b'http://dummy.dom/?t=2')
+        protocol = self.endpoint_factory.protocols[0]
+        queued_d.cancel()
+        self.assertFailure(queued_d, t_defer.CancelledError)
+        self.assertFalse(protocol.transport.disconnecting)
+        active_d.cancel()
+        self.assertFailure(active_d, t_defer.CancelledError)
+        self.assertTrue(protocol.transport.disconnecting)
+        protocol.connectionLost(t_failure.Failure(t_error.ConnectionAborted()))
+        self.assertEqual(len(self.endpoint_factory.protocols), 1)
+
+        return t_defer.gatherResults([ active_d, queued_d ])
+
+    def test_cookies(self):
+        self.agent.request(b'GET', b'http://dummy.dom/')
+        protocol = self.endpoint_factory.protocols[0]
+        protocol.dataReceived(b'HTTP/1.1 200 OK\r\nSet-Cookie: io=abc; Path=/; HttpOnly\r\nSet-Cookie: lb=1\r\nContent-Length: 0\r\n\r\n')
+        protocol.transport.clear()
+        self.agent.request(b'GET', b'http://dummy.dom/')
+        self.assertEqual(protocol.transport.value(), b'GET / HTTP/1.1\r\nHost: dummy.dom\r\nCookie: io=abc; lb=1\r\n\r\n')
+
+        # Cookies aren't shared across servers
+        self.agent.request(b'GET', b'http://other.dom/')
+        self.assertEqual(self.endpoint_factory.protocols[1].transport.value(), b'GET / HTTP/1.1\r\nHost: other.dom\r\n\r\n')
+
+    def test_polling_transport(self):
+        clock = t_task.Clock()
+        transport = PollingTransport(clock, agent=self.agent)
+        transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'))
+        received = []
+        transport.register('message', lambda event, data: received.append(data))
+        transport.connect(transport_context)
+        get_protocol = self.endpoint_factory.protocols[0]
+        self.assertTrue(get_protocol.transport.value().startswith(b'GET /engine.io/?'))
+
+        payload = encbinpayload('0{"sid":"abc","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}') + encbinpayload('4hello')
+        get_protocol.dataReceived(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nContent-Length: ' + str(len(payload)).encode('ascii') + b'\r\n\r\n')
+        get_protocol.dataReceived(payload)
+        self.assertEqual(received, [ 'hello' ])
+        self.assertEqual(transport.state, TRANSPORT_STATE_CONNECTED)
+
+        transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'hi')
+        post_protocol = self.endpoint_factory.protocols[-1]
+        self.assertIsNot(post_protocol, get_protocol)
+        request = post_protocol.transport.value()
+        self.assertTrue(request.startswith(b'POST /engine.io/?'))
+        self.assertIn(b'\r\nContent-Length: 6\r\n', request)
+        self.assertTrue(request.endswith(b'\r\n\r\n' + encbinpayload('4hi')))
+
+    def test_polling_transport_sessions(self):
+        clock = t_task.Clock()
+        transports = []
+
+        for sid in ( 'a', 'b' ):
+            transport = PollingTransport(clock, agent=self.agent)
+            transport_context = TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/'))
+            transport_context.set(sid, 5000, 25000, [])
+            transport.connect(transport_context)
+            transports.append(transport)
+
+        # Each session's long-poll goes out on its own connection
+        self.assertEqual(len(self.endpoint_factory.protocols), 2)
+        a_protocol, b_protocol = self.endpoint_factory.protocols
+        self.assertIn(b'&sid=a&', a_protocol.transport.value())
+        self.assertIn(b'&sid=b&', b_protocol.transport.value())
+
+        # Cookies stay with the session that received them
+        payload = encbinpayload('6')
+        a_protocol.transport.clear()
+        a_protocol.dataReceived(b'HTTP/1.1 200 OK\r\nSet-Cookie: lb=1\r\nContent-Type: application/octet-stream\r\nContent-Length: ' + str(len(payload)).encode('ascii') + b'\r\n\r\n' + payload)
+        self.assertIn(b'\r\nCookie: lb=1\r\n', a_protocol.transport.value())
+        transports[1].sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'hi')
+        self.assertEqual(len(self.endpoint_factory.protocols), 3)
+        self.assertNotIn(b'Cookie', self.endpoint_factory.protocols[2].transport.value())
+
+        # Closing the agent closes every session's connections
+        self.agent.closeconnections()
+
+        for protocol in self.endpoint_factory.protocols:
+            self.assertTrue(protocol.transport.disconnecting or protocol.transport.disconnected)
+
+# ========================================================================
+class H2LongPollAgentTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    if not longpoll._H2_SUPPORTED:  # pylint: disable=protected-access
+        skip = 'h2 is not available'
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.endpoint_factory = _H2EndpointFactory()
+        self.agent = H2LongPollAgent(endpoint_factory=self.endpoint_factory)
+
+    def test_multiplexing(self):
+        get_ds = [ self.agent.request(b'GET', 'http://dummy.dom/engine.io/?t={}'.format(i).encode('ascii')) for i in range(3) ]
+        post_d = self.agent.request(b'POST', b'http://dummy.dom/engine.io/', t_http_headers.Headers({ b'Content-Type': [ b'text/plain' ], b'Connection': [ b'keep-alive' ] }), b'4hi')
+        self.endpoint_factory.flush()
+        self.assertEqual(len(self.endpoint_factory.servers), 1)
+        self.assertEqual(self.agent.connections, 1)
+        self.assertEqual(self.agent.streams, 4)
+
+        server = self.endpoint_factory.servers[0]
+        self.assertEqual([ headers[b':path'] for headers, _, _ in server.requests.values() ], [ b'/engine.io/?t=0', b'/engine.io/?t=1', b'/engine.io/?t=2', b'/engine.io/' ])
+        post_headers, post_body, post_ended = list(server.requests.values())[-1]
+        self.assertEqual(post_headers[b':method'], b'POST')
+        self.assertEqual(post_headers[b':authority'], b'dummy.dom')
+        self.assertEqual(post_headers[b'content-type'], b'text/plain')
+        self.assertEqual(post_headers[b'content-length'], b'3')
+        self.assertNotIn(b'connection', post_headers)
+        self.assertEqual(post_body, b'4hi')
+        self.assertTrue(post_ended)
+
+        # Responses are delivered per stream, in any order
+        stream_ids = list(server.requests)
+        bodies = []
+        post_d.addCallback(t_client.readBody)
+        post_d.addCallback(bodies.append)
+        get_ds[1].addCallback(t_client.readBody)
+        get_ds[1].addCallback(bodies.append)
+        server.respond(stream_ids[3], b'ok', headers=[ ( b'set-cookie', b'io=abc; Path=/' ) ])
+        server.respond(stream_ids[1], b'1:6', end_stream=False)
+        self.endpoint_factory.flush()
+        self.assertEqual(bodies, [ b'ok' ])
+        server.senddata(stream_ids[1], b'1:2', end_stream=True)
+        self.endpoint_factory.flush()
+        self.assertEqual(bodies, [ b'ok', b'1:61:2' ])
+        self.assertEqual(self.agent.streams, 2)
+        self.assertFalse(get_ds[0].called)
+
+        # The connection is reused (and cookies are remembered)
+        self.agent.request(b'GET', b'http://dummy.dom/engine.io/?t=3')
+        self.endpoint_factory.flush()
+        self.assertEqual(len(self.endpoint_factory.servers), 1)
+        headers, _, _ = list(server.requests.values())[-1]
+        self.assertEqual(headers[b'cookie'], b'io=abc')
+
+    def test_polling_transports(self):
+        clock = t_task.Clock()
+        factory = PollingTransport.Factory(agent=self.agent)
+        transports = [ factory.buildTransport(clock) for _ in range(3) ]
+        received = []
+
+        for i, transport in enumerate(transports):
+            transport.register('message', lambda event, data, i=i: received.append(( i, data )))
+            transport.connect(TransportContext(BaseUrl.fromBytes(b'http://dummy.dom/engine.io/')))
+
+        self.endpoint_factory.flush()
+        self.assertEqual(len(self.endpoint_factory.servers), 1)
+        server = self.endpoint_factory.servers[0]
+        self.assertEqual(len(server.requests), 3)
+
+        for i, stream_id in enumerate(list(server.requests)):
+            payload = encbinpayload('0{{"sid":"s{}","pingInterval":25000,"pingTimeout":5000,"upgrades":[]}}'.format(i)) + encbinpayload('4hello')
+            server.respond(stream_id, payload, headers=[ ( b'content-type', b'application/octet-stream' ), ( b'set-cookie', 'lb={}'.format(i).encode('ascii') ) ])
+
+        self.endpoint_factory.flush()
+        self.assertEqual(sorted(received), [ ( 0, 'hello' ), ( 1, 'hello' ), ( 2, 'hello' ) ])
+
+        for transport in transports:
+            self.assertEqual(transport.state, TRANSPORT_STATE_CONNECTED)
+            transport.sendpacket(EIO_TYPE_CODES_BY_NAME['message'], 'hi')
+
+        self.endpoint_factory.flush()
+        posts = [ ( headers[b':path'], headers.get(b'cookie'), body ) for headers, body, _ in server.requests.values() if headers[b':method'] == b'POST' ]
+        self.assertEqual(len(posts), 3)
+
+        # Each session only sends its own cookies over the shared connection
+        for i, ( path, cookie, body ) in enumerate(sorted(posts)):
+            self.assertIn('sid=s{}'.format(i).encode('ascii'), path)
+            self.assertEqual(cookie, 'lb={}'.format(i).encode('ascii'))
+            self.assertEqual(body, encbinpayload('4hi'))
+
+        self.assertEqual(len(self.endpoint_factory.servers), 1)
+        self.assertEqual(self.agent.connections, 1)
+
+    def test_missing_h2(self):
+        self.patch(longpoll, '_H2_SUPPORTED', False)
+
+        with self.assertRaisesRegex(ImportError, r'pip install txsocketio\[http2\]'):
+            H2LongPollAgent()
+
+    def test_stream_limits(self):
+        self.agent = H2LongPollAgent(endpoint_factory=self.endpoint_factory, max_connections_per_host=2, max_streams_per_connection=2)
+        ds = [ self.agent.request(b'GET', 'http://dummy.dom/?t={}'.format(i).encode('ascii')) for i in range(5) ]
+        self.endpoint_factory.flush()
+        self.assertEqual(len(self.endpoint_factory.servers), 2)
+        self.assertEqual(self.agent.streams, 4)
+        self.assertEqual([ len(server.requests) for server in self.endpoint_factory.servers ], [ 2, 2 ])
+
+        # The last waits for a free stream
+        server = self.endpoint_factory.servers[1]
+        server.respond(list(server.requests)[0])
+        self.endpoint_factory.flush()
+        self.assertTrue(ds[2].called)
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(list(server.requests.values())[-1][0][b':path'], b'/?t=4')
+
+    def test_cancel(self):
+        get_d = self.agent.request(b'GET', b'http://dummy.dom/?t=1')
+        other_d = self.agent.request(b'GET', b'http://dummy.dom/?t=2')
+        self.endpoint_factory.flush()
+        server = self.endpoint_factory.servers[0]
+        stream_ids = list(server.requests)
+        get_d.cancel()
+        self.assertFailure(get_d, t_defer.CancelledError)
+        self.endpoint_factory.flush()
+        self.assertEqual(server.resets, [ stream_ids[0] ])
+        self.assertEqual(self.agent.streams, 1)
+
+        # Only the stream was reset
+        bodies = []
+        other_d.addCallback(t_client.readBody)
+        other_d.addCallback(bodies.append)
+        server.respond(stream_ids[1], b'ok')
+        self.endpoint_factory.flush()
+        self.assertEqual(bodies, [ b'ok' ])
+        self.assertEqual(self.agent.connections, 1)
+
+        # Aborting a response body resets its stream, too
+        get_d = self.agent.request(b'GET', b'http://dummy.dom/?t=3')
+        self.endpoint_factory.flush()
+        stream_id = list(server.requests)[-1]
+        server.respond(stream_id, b'partial', end_stream=False)
+        self.endpoint_factory.flush()
+        received = []
+        finished = []
+        body_protocol = _RecordingProtocol(received, finished)
+        get_d.addCallback(lambda response: response.deliverBody(body_protocol))
+        self.assertEqual(received, [ b'partial' ])
+        body_protocol.transport.abortConnection()
+        self.endpoint_factory.flush()
+        self.assertEqual(len(finished), 1)
+        finished[0].trap(t_client.ResponseFailed)
+        self.assertEqual(server.resets, [ stream_ids[0], stream_id ])
+        self.assertEqual(self.agent.streams, 0)
+        self.assertEqual(self.agent.connections, 1)
+
+    def test_connection_lost(self):
+        d = self.agent.request(b'GET', b'http://dummy.dom/')
+        self.endpoint_factory.flush()
+        self.endpoint_factory.servers[0].transport.loseConnection()
+        self.endpoint_factory.flush()
+        self.assertFailure(d, t_client.ResponseNeverReceived)
+        self.assertEqual(self.agent.connections, 0)
+
+        self.agent.request(b'GET', b'http://dummy.dom/')
+        self.endpoint_factory.flush()
+        self.assertEqual(len(self.endpoint_factory.servers), 2)
+        self.assertEqual(self.agent.connections, 1)
+
+        return d
+
+    def test_flow_control(self):
+        body = bytes(bytearray(( i % 256 for i in range(200000) )))
+        d = self.agent.request(b'POST', b'http://dummy.dom/', None, body)
+        self.endpoint_factory.flush()
+        server = self.endpoint_factory.servers[0]
+        stream_id = list(server.requests)[0]
+        _, received_body, ended = server.requests[stream_id]
+        self.assertEqual(received_body, body)
+        self.assertTrue(ended)
+
+        bodies = []
+        d.addCallback(t_client.readBody)
+        d.addCallback(bodies.append)
+        server.respond(stream_id, body)
+        self.endpoint_factory.flush()
+        self.assertEqual(bodies, [ body ])
+
+# ========================================================================
+class _H2EndpointFactory(object):
+    """
+    Acts as its own endpoint, connecting each protocol to a new in-process
+    :class:`_H2Server` via :mod:`twisted.test.iosim`.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        self.uris = []
+        self.servers = []
+        self._pumps = []
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connect(self, factory):
+        protocol = factory.buildProtocol(None)
+        server = _H2Server()
+        self._pumps.append(t_iosim.connect(server, t_iosim.makeFakeServer(server), protocol, t_iosim.makeFakeClient(protocol), greet=False))
+        self.servers.append(server)
+
+        return t_defer.succeed(protocol)
+
+    def endpointForURI(self, uri):
+        self.uris.append(uri.toBytes())
+
+        return self
+
+    # ---- Public methods ------------------------------------------------
+
+    def flush(self):
+        while any([ pump.pump() for pump in list(self._pumps) ]):
+            pass
+
+# ========================================================================
+class _H2Server(t_protocol.Protocol):
+    """
+    A minimal HTTP/2 server that records requests and sends whatever
+    responses it's told to.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False, header_encoding=None))
+        # Maps stream IDs to [ headers, body, ended ]
+        self.requests = collections.OrderedDict()
+        self.resets = []
+        # Maps stream IDs to [ data, end_stream ] awaiting flow control
+        # window updates
+        self._pending = collections.OrderedDict()
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionMade(self):  # noqa: N802 # pylint: disable=invalid-name
+        self.conn.initiate_connection()
+        self._flush()
+
+    def dataReceived(self, data):  # noqa: N802 # pylint: disable=invalid-name
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.RequestReceived):
+                self.requests[event.stream_id] = [ dict(event.headers), b'', False ]
+            elif isinstance(event, h2.events.DataReceived):
+                self.requests[event.stream_id][1] += event.data
+                self.conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+            elif isinstance(event, h2.events.StreamEnded):
+                self.requests[event.stream_id][2] = True
+            elif isinstance(event, h2.events.StreamReset):
+                self.resets.append(event.stream_id)
+                self._pending.pop(event.stream_id, None)
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._sendpending()
+
+        self._flush()
+
+    # ---- Public methods ------------------------------------------------
+
+    def respond(self, stream_id, body=b'', code=200, headers=(), end_stream=True):
+        self.conn.send_headers(stream_id, [ ( b':status', str(code).encode('ascii') ) ] + list(headers))
+        self.senddata(stream_id, body, end_stream)
+
+    def senddata(self, stream_id, data, end_stream=True):
+        self._pending[stream_id] = [ data, end_stream ]
+        self._sendpending()
+
+    # ---- Private methods -----------------------------------------------
+
+    def _flush(self):
+        data = self.conn.data_to_send()
+
+        if data:
+            self.transport.write(data)
+
+    def _sendpending(self):
+        for stream_id, ( data, end_stream ) in list(self._pending.items()):
+            while data:
+                n = min(len(data), self.conn.local_flow_control_window(stream_id), self.conn.max_outbound_frame_size)
+
+                if n <= 0:
+                    break
+
+                self.conn.send_data(stream_id, data[:n])
+                data = data[n:]
+
+            if data:
+                self._pending[stream_id][0] = data
+            else:
+                del self._pending[stream_id]
+
+                if end_stream:
+                    self.conn.end_stream(stream_id)
+
+        self._flush()
+
+# ========================================================================
+class _ImmediateProducer(object):
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, body):
+        self.body = body
+        self.length = len(body)
+
+    # ---- Public hooks --------------------------------------------------
+
+    def startProducing(self, consumer):  # noqa: N802 # pylint: disable=invalid-name
+        consumer.write(self.body)
+
+        return t_defer.succeed(None)
+
+# ========================================================================
+class _RecordingProtocol(object):
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, received, finished):
+        self.received = received
+        self.finished = finished
+        self.transport = None
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionLost(self, reason):  # noqa: N802 # pylint: disable=invalid-name
+        self.finished.append(reason)
+
+    def dataReceived(self, data):  # noqa: N802 # pylint: disable=invalid-name
+        self.received.append(data)
+
+    def makeConnection(self, transport):  # noqa: N802 # pylint: disable=invalid-name
+        self.transport = transport
+
+# ---- Initialization ----------------------------------------------------
+
+if __name__ == '__main__':
+    from unittest import main
+    main()
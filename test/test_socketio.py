@@ -20,23 +20,50 @@ from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-n
 
 # ---- Imports -----------------------------------------------------------
 
+import decimal
 import logging
+import re
 import string
 import hypothesis
 from hypothesis import strategies
+from twisted.internet import (
+    defer as t_defer,
+    error as t_error,
+    task as t_task,
+)
 from twisted.trial import unittest as t_unittest
 
+from txsocketio import engineio
+from txsocketio.endpoint import BaseUrl
 from txsocketio.engineio import (
+    EIO_TYPE_CLOSE,
+    EIO_TYPE_MESSAGE,
+    EIO_TYPE_NAMES_BY_CODE,
+    JSON_CODEC_DECIMAL,
+    JSON_CODEC_JSON,
+    JSON_CODEC_SIMPLEJSON,
+    JsonCodec,
     PayloadDecodeError,
     PayloadEncodeError,
+    jsoncodec,
+    jsondumps,
+    jsonloads,
+    registerjsoncodec,
 )
 from txsocketio.socketio import (
+    AckTimeoutError,
+    SIO_TYPE_ACK,
     SIO_TYPE_BIN_ACK,
     SIO_TYPE_BIN_EVENT,
     SIO_TYPE_EVENT,
     SIO_TYPE_NAMES_BY_CODE,
+    LazyEvent,
+    SioPacketsDecoder,
+    SocketIo,
+    deconstructsiopacket,
     decsiopacket,
     encsiopacket,
+    reconstructsiopacket,
 )
 import test  # noqa: F401 # pylint: disable=unused-import
 
@@ -54,6 +81,21 @@ _LOGGER = logging.getLogger(__name__)
 _JSON_CHILDREN = strategies.recursive(strategies.decimals().filter(lambda x: not x.is_nan()) | strategies.booleans() | strategies.text() | strategies.none(), lambda children: strategies.lists(children) | strategies.dictionaries(strategies.text(), children), max_leaves=5)
 _JSON = strategies.one_of(strategies.booleans(), strategies.text(), strategies.lists(_JSON_CHILDREN), strategies.dictionaries(strategies.text(), _JSON_CHILDREN))
 
+# The regex cascade decsiopacket used to use to split packet data, kept
+# as a reference implementation for differential testing
+_OLD_PACKET_RES = (
+    r'^ (?P<path>/[^,]*) (?:, (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)?)? $',
+    r'^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))  (?P<data>[^0-9].*)?   $',
+    r'^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)    $',
+    r'^ (?P<path>)            (?P<id>)                   (?P<data>)            $',
+)
+
+_OLD_PACKET_RE_FLAGS = re.DOTALL | re.VERBOSE
+
+# Characters that are significant to the packet format (plus a few that
+# look significant, but aren't)
+_PACKET_DATA_ALPHABET = '/,0123456789[]{}"\\ \n\u0663a'
+
 # ---- Classes -----------------------------------------------------------
 
 # ========================================================================
@@ -96,26 +138,77 @@ class PacketsTestCase(t_unittest.TestCase):
             actual = decsiopacket(packet)
             self.assertEqual(expected, actual, msg='packet[{}]: {!r}'.format(i, packet))
 
+    def test_packet_bin_enc_dec(self):
+        blob0 = bytes(b'\x00\x01')
+        blob1 = bytes(b'\xff')
+        packet_obj = [ 'upload', { 'name': 'x', 'data': blob0, 'parts': ( blob1, 1 ) }, 'plain' ]
+        deconstructed, attachments = deconstructsiopacket(packet_obj)
+        self.assertEqual(deconstructed, [ 'upload', { 'name': 'x', 'data': { '_placeholder': True, 'num': 0 }, 'parts': [ { '_placeholder': True, 'num': 1 }, 1 ] }, 'plain' ])
+        self.assertIs(attachments[0], blob0)
+        self.assertIs(attachments[1], blob1)
+        self.assertEqual(len(attachments), 2)
+
+        # Nothing binary, nothing copied
+        plain = [ 'plain', { 'a': [ 1, 2 ] } ]
+        self.assertIs(deconstructsiopacket(plain)[0], plain)
+        self.assertEqual(deconstructsiopacket(plain)[1], [])
+
+        packet = encsiopacket(SIO_TYPE_BIN_EVENT, deconstructed, '/nsp', 7, attachments=len(attachments))
+        self.assertTrue(packet.startswith('52-/nsp,7['), packet)
+        received = [ bytes(b'\x00\x01'), memoryview(b'\xff') ]
+        packet_type, decoded, packet_path, packet_id = decsiopacket(packet, attachments=received)
+        self.assertEqual(( packet_type, packet_path, packet_id ), ( SIO_TYPE_BIN_EVENT, '/nsp', 7 ))
+        self.assertEqual(decoded, [ 'upload', { 'name': 'x', 'data': blob0, 'parts': [ received[1], 1 ] }, 'plain' ])
+        self.assertIs(decoded[1]['data'], received[0])
+        self.assertIs(decoded[1]['parts'][0], received[1])
+
+        self.assertEqual(decsiopacket(encsiopacket(SIO_TYPE_BIN_ACK, [ 'x' ], '/', 3)), ( SIO_TYPE_BIN_ACK, [ 'x' ], '/', 3 ))
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^packet has 2 binary attachment\(s\), but 1 were provided$'):
+            decsiopacket(packet, attachments=received[:1])
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^placeholder refers to nonexistent attachment 1$'):
+            reconstructsiopacket([ { '_placeholder': True, 'num': 1 } ], [ blob0 ])
+
+        with self.assertRaisesRegex(PayloadEncodeError, r'^packet type "event" cannot have binary attachments$'):
+            encsiopacket(SIO_TYPE_EVENT, deconstructed, attachments=2)
+
+    def test_packets_decoder(self):
+        decoder = SioPacketsDecoder()
+        self.assertEqual(decoder.feed('2["a"]'), ( SIO_TYPE_EVENT, [ 'a' ], '/', None ))
+        self.assertIsNone(decoder.feed('52-["b",{"_placeholder":true,"num":0},{"_placeholder":true,"num":1}]'))
+        self.assertEqual(decoder.pending_attachments, 2)
+        blob = bytes(b'\x00')
+        self.assertIsNone(decoder.feed(blob))
+        self.assertEqual(decoder.pending_attachments, 1)
+        self.assertEqual(decoder.feed(bytes(b'\x01')), ( SIO_TYPE_BIN_EVENT, [ 'b', blob, bytes(b'\x01') ], '/', None ))
+        self.assertEqual(decoder.pending_attachments, 0)
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^received unexpected binary attachment$'):
+            decoder.feed(blob)
+
+        self.assertIsNone(decoder.feed('61-/nsp,4[{"_placeholder":true,"num":0}]'))
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^received packet while still expecting 1 binary attachment\(s\)$'):
+            decoder.feed('2["a"]')
+
+        self.assertEqual(decoder.pending_attachments, 0)
+        self.assertEqual(decoder.feed('2["a"]'), ( SIO_TYPE_EVENT, [ 'a' ], '/', None ))
+
     def test_packet_dec_bad_len(self):
         with self.assertRaisesRegex(PayloadDecodeError, r'^packet truncated$'):
             decsiopacket(PacketsTestCase.BAD_TRUNC_PACKET)
 
     def test_packet_dec_bad_type(self):
+        # Only attachments are sent as binary
         packets = [
             SIO_TYPE_BIN_ACK,
             SIO_TYPE_BIN_EVENT,
-        ]
-
-        for i, packet in enumerate(packets):
-            with self.assertRaisesRegex(NotImplementedError, r'^binary Socket\.IO packets are currently unsupported$', msg='packet[{}]: {!r}'.format(i, packet)):
-                decsiopacket(packet)
-
-        packets = [
             SIO_TYPE_EVENT,
         ]
 
         for i, packet in enumerate(packets):
-            with self.assertRaisesRegex(PayloadDecodeError, r'^packet type is ".*", but payload is binary$', msg='packet[{}]: {!r}'.format(i, packet)):
+            with self.assertRaisesRegex(PayloadDecodeError, r'^payload is binary', msg='packet[{}]: {!r}'.format(i, packet)):
                 decsiopacket(packet)
 
         packets = [
@@ -132,7 +225,7 @@ class PacketsTestCase(t_unittest.TestCase):
         ]
 
         for i, packet in enumerate(packets):
-            with self.assertRaisesRegex(PayloadDecodeError, r'^packet type is ".*", but payload is not binary$', msg='packet[{}]: {!r}'.format(i, packet)):
+            with self.assertRaisesRegex(PayloadDecodeError, r'^packet type is ".*", but attachment count is missing$', msg='packet[{}]: {!r}'.format(i, packet)):
                 decsiopacket(packet)
 
         packets = [
@@ -147,6 +240,72 @@ class PacketsTestCase(t_unittest.TestCase):
             with self.assertRaisesRegex(TypeError, r'^packet type must be one of bytes or str, not .*', msg='packet[{}]: {!r}'.format(i, packet)):
                 decsiopacket(packet)
 
+    @hypothesis.given(packet_data=strategies.text(alphabet=_PACKET_DATA_ALPHABET) | strategies.builds(lambda *parts: ''.join(parts), strategies.sampled_from(( '', '/', '/nsp', '/nsp,' )), strategies.sampled_from(( '', '0', '00', '01', '42' )), _JSON.map(lambda obj: jsondumps(obj, allow_nan=True))))
+    @hypothesis.example(packet_data='/nsp,01[]')
+    @hypothesis.example(packet_data='/nsp,0\n')
+    @hypothesis.example(packet_data='/nsp\n,')
+    @hypothesis.example(packet_data='01[]')
+    @hypothesis.example(packet_data='\n')
+    @hypothesis.example(packet_data='\u0663')
+    def test_packet_dec_differential(self, packet_data):
+        packet = SIO_TYPE_EVENT.decode('ascii') + packet_data
+
+        try:
+            expected = _olddecsiopacket(packet)
+        except PayloadDecodeError as exc:
+            expected = ( type(exc), str(exc) )
+
+        try:
+            actual = decsiopacket(packet)
+        except PayloadDecodeError as exc:
+            actual = ( type(exc), str(exc) )
+
+        self.assertEqual(expected, actual, msg='packet: {!r}'.format(packet))
+
+    def test_packet_dec_lazy(self):
+        packets = (
+            '2["ev"]',
+            '2["ev",1,{"a":[2]}]',
+            '2/nsp,7[ "e\\"v\\\\" , null]',
+            '2[["ev"],1]',
+            '2[]',
+        )
+
+        for i, packet in enumerate(packets):
+            expected = decsiopacket(packet)
+            actual = decsiopacket(packet, lazy=True)
+            self.assertIsInstance(actual[1], LazyEvent)
+            self.assertEqual(expected, actual, msg='packet[{}]: {!r}'.format(i, packet))
+            self.assertEqual(expected[1][1:], actual[1].args, msg='packet[{}]: {!r}'.format(i, packet))
+
+        loads_calls = []
+
+        def _loads(packet_json):
+            loads_calls.append(packet_json)
+
+            return jsonloads(packet_json)
+
+        codec = registerjsoncodec('test-lazy', jsondumps, _loads)
+        self.addCleanup(engineio._JSON_CODECS.pop, 'test-lazy')  # pylint: disable=protected-access
+        packet_obj = decsiopacket('2["ev",1]', codec, lazy=True)[1]
+        self.assertEqual('ev', packet_obj.name)
+        self.assertEqual('ev', packet_obj[0])
+        self.assertFalse(packet_obj.decoded)
+        self.assertEqual([], loads_calls)
+        self.assertEqual([ 1 ], packet_obj.args)
+        self.assertEqual([ 1 ], packet_obj.args)
+        self.assertEqual([ '["ev",1]' ], loads_calls)
+
+        # Only event packets whose data is an array are lazy
+        self.assertEqual(( SIO_TYPE_EVENT, 'ev', '/', None ), decsiopacket('2"ev"', lazy=True))
+        self.assertEqual(( SIO_TYPE_ACK, [ 1 ], '/', 3 ), decsiopacket('33[1]', lazy=True))
+
+        packet_obj = decsiopacket('2["ev",', lazy=True)[1]
+        self.assertEqual('ev', packet_obj.name)
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^unparsable JSON data$'):
+            packet_obj.args  # pylint: disable=pointless-statement
+
     def test_packet_enc_bad_type(self):
         packets_type_data = [
             ( PacketsTestCase.BAD_TYPE, {} ),
@@ -156,6 +315,345 @@ class PacketsTestCase(t_unittest.TestCase):
             with self.assertRaisesRegex(PayloadEncodeError, r'^unrecognized packet type "', msg='packet_type_data[{}]: {!r}'.format(i, packet_type_data)):
                 encsiopacket(*packet_type_data)
 
+    def test_packet_json_codecs(self):
+        packet = '2["num",1.5,2,[0.25]]'
+        self.assertEqual(( SIO_TYPE_EVENT, [ 'num', decimal.Decimal('1.5'), 2, [ decimal.Decimal('0.25') ] ], '/', None ), decsiopacket(packet))
+
+        for name in ( JSON_CODEC_JSON, JSON_CODEC_SIMPLEJSON ):
+            codec = jsoncodec(name)
+            packet_type, packet_obj, packet_path, packet_id = decsiopacket(packet, codec)
+            self.assertEqual([ 'num', 1.5, 2, [ 0.25 ] ], packet_obj, msg=name)
+            self.assertIsInstance(packet_obj[1], float)
+            self.assertEqual('2/,["num", 1.5, 2, [0.25]]', encsiopacket(packet_type, packet_obj, packet_path, packet_id, codec), msg=name)
+
+        codec = jsoncodec(JSON_CODEC_DECIMAL)
+        self.assertEqual(decsiopacket(packet), decsiopacket(packet, codec))
+
+        with self.assertRaisesRegex(PayloadDecodeError, r'^unparsable JSON data$'):
+            decsiopacket('2["num",', jsoncodec(JSON_CODEC_JSON))
+
+    def test_packet_json_codec_bad_name(self):
+        with self.assertRaisesRegex(ValueError, r'^unrecognized JSON codec "nonesuch"'):
+            jsoncodec('nonesuch')
+
+# ========================================================================
+class SocketIoTestCase(t_unittest.TestCase):
+
+    longMessage = True
+
+    # ---- Public hooks --------------------------------------------------
+
+    def setUp(self):
+        super().setUp()
+        self.base_url = BaseUrl.fromBytes(b'http://dummy.dom/socket.io/')
+        self.clock = t_task.Clock()
+
+    def test_json_codec(self):
+        payload = '2["num",1.5]'
+        expected_by_codec = (
+            ( None, ( '/', [ 'num', 1.5 ] ) ),
+            ( JSON_CODEC_DECIMAL, ( '/', [ 'num', decimal.Decimal('1.5') ] ) ),
+            ( jsoncodec(JSON_CODEC_JSON), ( '/', [ 'num', 1.5 ] ) ),
+        )
+
+        for json_codec, expected in expected_by_codec:
+            kw = {} if json_codec is None else { 'json_codec': json_codec }
+            socketio = SocketIo(self.base_url, reactor=self.clock, **kw)
+            events = []
+            socketio.register(SIO_TYPE_NAMES_BY_CODE[SIO_TYPE_EVENT], lambda event, *args: events.append(args))
+            socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], payload)
+            self.assertEqual([ expected ], events, msg=json_codec)
+            self.assertIs(type(events[0][1][1]), type(expected[1][1]), msg=json_codec)
+
+    def test_json_codec_registered(self):
+        dumps_calls = []
+        self.addCleanup(engineio._JSON_CODECS.pop, 'test-counting')  # pylint: disable=protected-access
+        codec = registerjsoncodec('test-counting', lambda obj: dumps_calls.append(obj) or jsoncodec(JSON_CODEC_JSON).dumps(obj), jsoncodec(JSON_CODEC_JSON).loads)
+        self.assertIs(codec, jsoncodec('test-counting'))
+        socketio = SocketIo(self.base_url, reactor=self.clock, json_codec='test-counting')
+        sent = []
+        socketio.sendeiopacket = lambda packet_type, packet_data: sent.append(( packet_type, packet_data ))
+        socketio.emit('num', 1.5)
+        self.assertEqual([ [ 'num', 1.5 ] ], dumps_calls)
+        self.assertEqual([ ( EIO_TYPE_MESSAGE, '2/,["num", 1.5]' ) ], sent)
+
+    def test_positional_args(self):
+        # Engine.IO options come after the Socket.IO ones, so existing
+        # positional calls keep working
+        socketio = SocketIo(self.base_url, None, self.clock, JSON_CODEC_JSON, True, 5)
+        self.assertIs(socketio._json_codec, jsoncodec(JSON_CODEC_JSON))  # pylint: disable=protected-access
+        self.assertTrue(socketio._lazy_events)  # pylint: disable=protected-access
+        self.assertEqual(socketio._ack_timeout, 5)  # pylint: disable=protected-access
+
+    def test_lazy_events(self):
+        loads_calls = []
+
+        def _loads(packet_json):
+            loads_calls.append(packet_json)
+
+            return jsonloads(packet_json)
+
+        socketio = SocketIo(self.base_url, reactor=self.clock, json_codec=JsonCodec(jsondumps, _loads), lazy_events=True)
+        seen = []
+
+        def _onevent(event, path, packet_obj):
+            if packet_obj.name == 'wanted':
+                seen.append(( path, packet_obj.args ))
+
+        socketio.register(SIO_TYPE_NAMES_BY_CODE[SIO_TYPE_EVENT], _onevent)
+        socketio.register(SIO_TYPE_NAMES_BY_CODE[SIO_TYPE_EVENT], _onevent)
+
+        for payload in ( '2["unwanted",1]', '2/nsp,["wanted",2]', '2["unwanted",3]' ):
+            socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], payload)
+
+        self.assertEqual([ ( '/nsp', [ 2 ] ) ] * 2, seen)
+        self.assertEqual([ '["wanted",2]' ], loads_calls)
+
+    def test_on_event(self):
+        socketio = SocketIo(self.base_url, reactor=self.clock)
+        calls = []
+        feed_trade = lambda *args: calls.append(( 'feed_trade', args ))
+        root_trade = lambda *args: calls.append(( 'root_trade', args ))
+        feed_quote_once = lambda *args: calls.append(( 'feed_quote_once', args ))
+        self.assertTrue(socketio.on_event('/feed', 'trade', feed_trade))
+        self.assertTrue(socketio.on_event('/', 'trade', root_trade))
+        self.assertTrue(socketio.once_event('/feed', 'quote', feed_quote_once))
+
+        for payload in ( '2/feed,["trade",1,{"px":2}]', '2["trade"]', '2/feed,["quote",3]', '2/feed,["quote",4]', '2/other,["trade",5]', '2/feed,"trade"', '2/feed,[]', '2/feed,[["trade"]]', '32/feed,["trade"]' ):
+            socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], payload)
+
+        self.assertEqual([
+            ( 'feed_trade', ( 1, { 'px': 2 } ) ),
+            ( 'root_trade', () ),
+            ( 'feed_quote_once', ( 3, ) ),
+        ], calls)
+
+        del calls[:]
+        self.assertTrue(socketio.off_event('/feed', 'trade', feed_trade))
+        self.assertFalse(socketio.off_event('/feed', 'trade', feed_trade))
+        self.assertFalse(socketio.off_event('/feed', 'quote', feed_quote_once, once=True))
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '2/feed,["trade",6]')
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '2["trade",7]')
+        self.assertEqual([ ( 'root_trade', ( 7, ) ) ], calls)
+
+    def test_on_event_lazy(self):
+        loads_calls = []
+
+        def _loads(packet_json):
+            loads_calls.append(packet_json)
+
+            return jsonloads(packet_json)
+
+        socketio = SocketIo(self.base_url, reactor=self.clock, json_codec=JsonCodec(jsondumps, _loads), lazy_events=True)
+        calls = []
+        socketio.on_event('/feed', 'trade', lambda *args: calls.append(args))
+
+        for payload in ( '2/feed,["quote",1]', '2/feed,["trade",2]', '2["trade",3]' ):
+            socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], payload)
+
+        self.assertEqual([ ( 2, ) ], calls)
+        self.assertEqual([ '["trade",2]' ], loads_calls)
+
+    def test_ack_callback(self):
+        socketio, sent = self._mksocketio(ack_timeout=10)
+        acks = []
+        socketio.emit('rpc', 1, callback=lambda *args: acks.append(args))
+        socketio.emit('rpc', 2, callback=lambda *args: acks.append(args))
+        self.assertEqual([ '2/,1["rpc", 1]', '2/,2["rpc", 2]' ], sent)
+        self.assertEqual(2, socketio.pending_acks)
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '32["two"]')
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '32["again"]')
+        self.assertEqual([ ( '/', [ 'two' ] ) ], acks)
+        self.assertEqual(1, socketio.pending_acks)
+
+        # Unanswered acks are forgotten
+        self.clock.advance(11)
+        self.assertEqual(0, socketio.pending_acks)
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '31["one"]')
+        self.assertEqual([ ( '/', [ 'two' ] ) ], acks)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_deferredemit(self):
+        socketio, sent = self._mksocketio()
+        results = []
+        d = socketio.deferredemit('rpc', { 'a': 1 }, path='/nsp')
+        d.addBoth(results.append)
+        self.assertEqual([ '2/nsp,1["rpc", {"a": 1}]' ], sent)
+        self.assertEqual([], results)
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '3/nsp,1[true,"x"]')
+        self.assertEqual([ [ True, 'x' ] ], results)
+        self.assertEqual(0, socketio.pending_acks)
+
+        with self.assertRaisesRegex(TypeError, r'^unexpected keyword argument'):
+            socketio.deferredemit('rpc', callback=None)
+
+    def test_deferredemit_timeout(self):
+        socketio, _ = self._mksocketio(ack_timeout=30)
+        results = []
+        socketio.deferredemit('rpc').addBoth(results.append)
+        self.clock.advance(5)
+        socketio.deferredemit('rpc', timeout=10).addBoth(results.append)
+
+        # Lots of acks share a single delayed call
+        for _ in range(1000):
+            socketio.deferredemit('rpc').addBoth(results.append)
+
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(11)
+        self.assertEqual(1, len(results))
+        self.assertIsInstance(results[0].value, AckTimeoutError)
+        self.assertEqual(1001, socketio.pending_acks)
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '32["late"]')
+        self.assertEqual(1, len(results))
+        self.clock.advance(14)
+        self.assertEqual(1, len(results))
+        self.clock.advance(10)
+        self.assertEqual(1002, len(results))
+        self.assertTrue(all(r.check(AckTimeoutError) for r in results))
+        self.assertEqual(0, socketio.pending_acks)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_deferredemit_cancel_close(self):
+        socketio, _ = self._mksocketio()
+        results = []
+        d = socketio.deferredemit('rpc')
+        d.addBoth(results.append)
+        socketio.deferredemit('rpc').addBoth(results.append)
+        d.cancel()
+        self.assertTrue(results[0].check(t_defer.CancelledError))
+        self.assertEqual(1, socketio.pending_acks)
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE])
+        self.assertTrue(results[1].check(t_error.ConnectionDone))
+        self.assertEqual(0, socketio.pending_acks)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_deferredemit_send_failed(self):
+        socketio, _ = self._mksocketio()
+        socketio.sendeiopacket = lambda packet_type, packet_data: t_defer.fail(t_error.ConnectionLost())
+        results = []
+        socketio.deferredemit('rpc').addBoth(results.append)
+        self.assertTrue(results[0].check(t_error.ConnectionLost))
+        self.assertEqual(0, socketio.pending_acks)
+
+    def test_json_codec_bad_name(self):
+        with self.assertRaisesRegex(ValueError, r'^unrecognized JSON codec "nonesuch"'):
+            SocketIo(self.base_url, reactor=self.clock, json_codec='nonesuch')
+
+    # ---- Private methods -----------------------------------------------
+
+    def test_binary_events(self):
+        socketio, sent = self._mksocketio()
+        blob = bytes(b'\x00\xff')
+        socketio.emit('upload', { 'data': blob }, path='/nsp')
+        self.assertEqual(sent, [ '51-/nsp,["upload", {"data": {"_placeholder": true, "num": 0}}]', blob ])
+        self.assertIs(sent[1], blob)
+
+        del sent[:]
+        acks = []
+        socketio.emit('upload', blob, blob, callback=lambda path, obj: acks.append(obj))
+        self.assertEqual(sent, [ '52-/,1["upload", {"_placeholder": true, "num": 0}, {"_placeholder": true, "num": 1}]', blob, blob ])
+
+        # Binary acks and events are reassembled before being dispatched
+        received = []
+        socketio.on_event('/', 'download', lambda *args: received.append(args))
+        socketio.register(SIO_TYPE_NAMES_BY_CODE[SIO_TYPE_BIN_EVENT], lambda event, path, obj: received.append(( event, path, obj )))
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '61-/,1[{"_placeholder":true,"num":0}]')
+        self.assertEqual(acks, [])
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], blob)
+        self.assertEqual(acks, [ [ blob ] ])
+        self.assertIs(acks[0][0], blob)
+
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '51-["download",{"_placeholder":true,"num":0}]')
+        self.assertEqual(received, [])
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], blob)
+        self.assertEqual(received, [ ( 'binary_event', '/', [ 'download', blob ] ), ( blob, ) ])
+
+    def test_binary_send_failed(self):
+        socketio = SocketIo(self.base_url, reactor=self.clock)
+        ds = [ t_defer.Deferred(), t_defer.Deferred() ]
+        ds_iter = iter(ds)
+        socketio.sendeiopacket = lambda packet_type, packet_data: next(ds_iter)  # pylint: disable=unused-argument
+        ack_d = socketio.deferredemit('upload', bytes(b'\x00'))
+        ds[0].callback(None)
+        self.assertNoResult(ack_d)
+        ds[1].errback(t_error.ConnectionLost())
+        self.failureResultOf(ack_d, t_error.ConnectionLost)
+        self.assertEqual(socketio.pending_acks, 0)
+
+    def test_binary_buffered(self):
+        socketio = SocketIo(self.base_url, reactor=self.clock, max_buffered_packets=3)
+        socketio._send_buffer = socketio._newsendbuffer()  # pylint: disable=protected-access
+        bin_d = socketio.emit('upload', bytes(b'\x00'))
+        d = socketio.emit('a')
+
+        # Attachments are dropped along with their packet
+        socketio.emit('b')
+        self.failureResultOf(bin_d, engineio.BufferOverflowError)
+        self.assertNoResult(d)
+        self.assertEqual(socketio.buffered, 2)
+
+    def test_rejoin_on_reconnect(self):
+        socketio, sent = self._mksocketio()
+        calls = []
+        socketio.on_event('/feed', 'trade', lambda *args: calls.append(args))
+
+        for path in ( '/feed', '/chat', '/gone' ):
+            socketio.connect(path)
+
+        socketio.disconnect('/chat')
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '1/gone')
+        del sent[:]
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE])
+        socketio.dispatch('reconnect', 1)
+        self.assertEqual(sent, [ '0/feed,' ])
+
+        # Event handlers don't need to be registered again
+        socketio.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], '2/feed,["trade",1]')
+        self.assertEqual(calls, [ ( 1, ) ])
+
+    def _mksocketio(self, **kw):
+        socketio = SocketIo(self.base_url, reactor=self.clock, **kw)
+        sent = []
+
+        def _sendeiopacket(packet_type, packet_data):
+            self.assertEqual(EIO_TYPE_MESSAGE, packet_type)
+            sent.append(packet_data)
+
+            return t_defer.succeed(None)
+
+        socketio.sendeiopacket = _sendeiopacket
+
+        return socketio, sent
+
+# ---- Functions ---------------------------------------------------------
+
+# ========================================================================
+def _olddecsiopacket(packet):
+    packet_type = bytes(packet[0:1].encode('ascii'))
+    packet_data = str(packet[1:])
+
+    for packet_re in _OLD_PACKET_RES:
+        matches = re.search(packet_re, packet_data, _OLD_PACKET_RE_FLAGS)
+
+        if matches:
+            break
+
+    if not matches:
+        raise PayloadDecodeError('unrecognized Socket.IO packet format')
+
+    packet_path = matches.group('path')
+    packet_path = packet_path if packet_path else '/'
+    packet_id = matches.group('id')
+    packet_id = int(packet_id, 10) if packet_id else None
+    packet_json = matches.group('data')
+
+    try:
+        packet_obj = jsonloads(packet_json) if packet_json else ''
+    except ValueError:
+        raise PayloadDecodeError('unparsable JSON data')
+
+    return packet_type, packet_obj, packet_path, packet_id
+
 # ---- Initialization ----------------------------------------------------
 
 if __name__ == '__main__':
@@ -19,7 +19,6 @@ from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-n
 
 # ---- Imports -----------------------------------------------------------
 
-import collections
 import logging
 import os
 from twisted.internet import defer as t_defer
@@ -53,6 +52,13 @@ class Dispatcher(object):
     registered, leaving the concurrence model up to the registrant. Errors
     raised by callbacks are logged, but otherwise ignored.
 
+    The callbacks for each event are kept in an immutable snapshot that is
+    only replaced when callbacks are registered, so dispatching neither
+    copies nor allocates. Unregistering marks a callback's registration
+    dead in constant time (with :meth:`~Dispatcher.unregistertoken`), and
+    dead registrations are purged from the snapshot once they account
+    for half of it.
+
     :param iterable events: if non-empty, this restricts the events for
         which callbacks can be registered
     """
@@ -61,7 +67,10 @@ class Dispatcher(object):
 
     def __init__(self, events=()):
         self._events = frozenset(events)
-        self._callbacks = dict(( ( e, collections.deque() ) for e in self._events ))
+        # Maps events to tuples of _Registrations in the order in which
+        # they were registered (some of which may be dead)
+        self._callbacks = {}
+        self._dead_counts = {}
 
     # ---- Public methods ------------------------------------------------
 
@@ -107,20 +116,29 @@ class Dispatcher(object):
         log and ignore any failure. If this behavior is undesirable,
         consider decorating callbacks such that unhandled errors are
         adequately treated.
+
+        Callbacks registered while dispatching are not called until the
+        next dispatch. Callbacks unregistered while dispatching (e.g., by
+        an earlier callback) are not called.
         """
         try:
-            # We copy the callbacks because we (or they) might modify the
-            # deque during processing
-            callbacks = tuple(reversed(self._callbacks[event]))
+            # This is a snapshot, so we (or callbacks) are free to register
+            # or unregister during processing
+            registrations = self._callbacks[event]
         except KeyError:
             return
 
-        for callback, once in callbacks:
-            if once:
-                self.unregister(event, callback, once)
+        for registration in registrations:
+            if registration.dead:
+                continue
+
+            callback = registration.callback
+
+            if registration.once:
+                self._kill(registration)
 
             try:
-                retval = callback(event, *args, **kw)
+                retval = self._callcallback(callback, event, args, kw)
 
                 if isinstance(retval, t_defer.Deferred):
                     retval.addErrback(self._logerror, 'failure raised from deferred event callback {!r} (ignored)'.format(callback))
@@ -183,18 +201,37 @@ class Dispatcher(object):
             this should always be `True` unless a non-empty ``events``
             parameter was passed to :meth:`~Dispatcher.__init__`
         """
+        return self.registertoken(event, callback, once) is not None
+
+    def registertoken(self, event, callback, once=False):
+        """
+        Like :meth:`~Dispatcher.register`, but returns an opaque token
+        that can be passed to :meth:`~Dispatcher.unregistertoken`.
+
+        .. code-block:: python
+            :linenos:
+
+            >>> d = Dispatcher()
+            >>> def handler(event):
+            ...   print('handler({})'.format(event))
+            >>> token = d.registertoken('event', handler)
+            >>> d.dispatch('event')
+            handler(event)
+            >>> d.unregistertoken(token)
+            True
+            >>> d.dispatch('event')
+
+        :returns: the token if ``callback`` was added, `None` otherwise
+            (see :meth:`~Dispatcher.register`)
+        """
         if self._events \
                 and event not in self._events:
-            return False
-
-        try:
-            event_callbacks = self._callbacks[event]
-        except KeyError:
-            event_callbacks = self._callbacks[event] = collections.deque()
+            return None
 
-        event_callbacks.appendleft(( callback, once ))
+        registration = _Registration(event, callback, once)
+        self._callbacks[event] = self._callbacks.get(event, ()) + ( registration, )
 
-        return True
+        return registration
 
     def unregister(self, event, callback, once=False):
         """
@@ -234,17 +271,74 @@ class Dispatcher(object):
 
         :returns: `True` if ``callback`` was found, `False` if it wasn't
         """
-        try:
-            self._callbacks[event].remove(( callback, once ))
-        except ( KeyError, ValueError ):
+        # If the callback was registered more than once, the most recent
+        # registration is the one that goes
+        for registration in reversed(self._callbacks.get(event, ())):
+            if not registration.dead \
+                    and registration.once == once \
+                    and registration.callback == callback:
+                self._kill(registration)
+
+                return True
+
+        return False
+
+    def unregistertoken(self, token):
+        """
+        Unregisters the callback associated with ``token`` (as returned
+        by :meth:`~Dispatcher.registertoken`) in constant time.
+
+        :returns: `True` if the callback was registered, `False` if it
+            was already unregistered (or, if it was registered once, was
+            already called)
+        """
+        if token.dead:
             return False
 
+        self._kill(token)
+
         return True
 
     # ---- Private methods -----------------------------------------------
 
+    def _callcallback(self, callback, event, args, kw):  # pylint: disable=no-self-use
+        return callback(event, *args, **kw)
+
+    def _kill(self, registration):
+        registration.dead = True
+        event = registration.event
+        registrations = self._callbacks[event]
+        dead_count = self._dead_counts.get(event, 0) + 1
+
+        if dead_count * 2 < len(registrations):
+            self._dead_counts[event] = dead_count
+
+            return
+
+        # Purge the dead
+        self._dead_counts.pop(event, None)
+        registrations = tuple(r for r in registrations if not r.dead)
+
+        if registrations:
+            self._callbacks[event] = registrations
+        else:
+            del self._callbacks[event]
+
     def _logerror(self, e, msg=''):
         if isinstance(e, t_failure.Failure):
             _LOGGER.warning(msg + os.linesep + e.getTraceback(detail='verbose'))
         else:
             _LOGGER.warning(msg, exc_info=True)
+
+# ========================================================================
+class _Registration(object):
+
+    __slots__ = ( 'callback', 'dead', 'event', 'once' )
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, event, callback, once):
+        self.event = event
+        self.callback = callback
+        self.once = once
+        self.dead = False
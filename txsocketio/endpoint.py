@@ -298,12 +298,16 @@ class ClientEndpointFactory(object):
     ``./tests/node/http.sock`` would be
     ``unix://.%2Ftests%2Fnode%2Fhttp.sock/<...>``. ``<...>`` is just as it
     would be with a ``http(s)://`` or ``ws(s)://`` URL.
+
+    If provided, ``acceptable_protocols`` is a sequence of protocol names
+    (e.g., ``( b'h2', )``) offered via ALPN when connecting with TLS.
     """
 
     # ---- Constructor ---------------------------------------------------
 
-    def __init__(self, reactor):
+    def __init__(self, reactor, acceptable_protocols=None):
         self.reactor = reactor
+        self.acceptable_protocols = acceptable_protocols
 
     # ---- Public hooks --------------------------------------------------
 
@@ -317,7 +321,10 @@ class ClientEndpointFactory(object):
                 if not _SSL_SUPPORTED:
                     raise t_error.SchemeNotSupported('{} not supported (OpenSSL is not available)'.format(uri.scheme.decode('utf_8')))
 
-                options = t_ssl.optionsForClientTLS(host.decode('utf_8'))
+                if self.acceptable_protocols is None:
+                    options = t_ssl.optionsForClientTLS(host.decode('utf_8'))
+                else:
+                    options = t_ssl.optionsForClientTLS(host.decode('utf_8'), acceptableProtocols=list(self.acceptable_protocols))
                 endpoint = t_endpoints.wrapClientTLS(options, endpoint)
 
             return endpoint
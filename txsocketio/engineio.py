@@ -20,25 +20,39 @@ from future.moves.urllib import parse as url_parse
 from future.utils import (
     iteritems,
     iterkeys,
+    itervalues,
 )
 
 # ---- Imports -----------------------------------------------------------
 
+import base64
+import binascii
+import codecs
 import collections
 import decimal
 import functools
 from http import cookiejar
 import io
+import json
 import logging
+import math
+import random
 # import pprint
 import time
+import zlib
 import simplejson
 from twisted.internet import (
     defer as t_defer,
     error as t_error,
+    interfaces as t_interfaces,
+    protocol as t_protocol,
     task as t_task,
 )
-from twisted.python import urlpath as t_urlpath
+from twisted.python import (
+    components as t_components,
+    failure as t_failure,
+    urlpath as t_urlpath,
+)
 from twisted.web import (
     client as t_client,
     http_headers as t_http_headers,
@@ -52,9 +66,35 @@ from .endpoint import (
     ClientEndpointFactory,
 )
 
+try:
+    from autobahn.twisted import websocket as ab_websocket
+except ImportError:
+    _WEBSOCKET_SUPPORTED = False
+else:
+    _WEBSOCKET_SUPPORTED = True
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
 # ---- Constants ---------------------------------------------------------
 
 __all__ = (
+    'BUFFER_BLOCK',
+    'BUFFER_DROP_NEWEST',
+    'BUFFER_DROP_OLDEST',
+    'BufferOverflowError',
+    'COMPRESSION_DEFLATE',
+    'COMPRESSION_GZIP',
+    'CompressionStats',
+    'EIO_PROTOCOL_3',
+    'EIO_PROTOCOL_4',
     'EIO_TYPE_CLOSE',
     'EIO_TYPE_CODES_BY_NAME',
     'EIO_TYPE_MESSAGE',
@@ -67,18 +107,63 @@ __all__ = (
     'EngineIo',
     'EngineIoException',
     'EngineIoServerError',
+    'HeartbeatWheel',
+    'JSON_CODEC_DECIMAL',
+    'JSON_CODEC_JSON',
+    'JSON_CODEC_ORJSON',
+    'JSON_CODEC_SIMPLEJSON',
+    'JSON_CODEC_UJSON',
+    'JsonCodec',
     'MethodMismatchError',
     'PayloadDecodeError',
     'PayloadEncodeError',
+    'PingTimeoutError',
     'ReceivedClosePacket',
+    'ReconnectPolicy',
+    'RecordPayloadsDecoder',
+    'SharedConnectionPool',
     'TransportMismatchError',
     'TransportStateError',
     'UnexpectedServerError',
     'UnknownSessionIdError',
     'UnrecognizedTransportError',
+    'jsoncodec',
+    'registerjsoncodec',
+)
+
+BUFFER_BLOCK = 'block'
+BUFFER_DROP_NEWEST = 'drop_newest'
+BUFFER_DROP_OLDEST = 'drop_oldest'
+
+_BUFFER_OVERFLOWS = (
+    BUFFER_BLOCK,
+    BUFFER_DROP_NEWEST,
+    BUFFER_DROP_OLDEST,
+)
+
+COMPRESSION_DEFLATE = 'deflate'
+COMPRESSION_GZIP = 'gzip'
+
+# Maps request body compressions to zlib window bits
+_COMPRESSION_WBITS = {
+    COMPRESSION_DEFLATE: zlib.MAX_WBITS,
+    COMPRESSION_GZIP: 16 + zlib.MAX_WBITS,
+}
+
+EIO_PROTOCOL_3 = 3
+EIO_PROTOCOL_4 = 4
+EIO_PROTOCOL = EIO_PROTOCOL_3
+
+_EIO_PROTOCOLS = (
+    EIO_PROTOCOL_3,
+    EIO_PROTOCOL_4,
 )
 
-EIO_PROTOCOL = 3
+JSON_CODEC_DECIMAL = 'decimal'
+JSON_CODEC_JSON = 'json'
+JSON_CODEC_ORJSON = 'orjson'
+JSON_CODEC_SIMPLEJSON = 'simplejson'
+JSON_CODEC_UJSON = 'ujson'
 
 TRANSPORT_POLLING = 'polling'
 TRANSPORT_WEBSOCKETS = 'websocket'
@@ -110,13 +195,32 @@ TRANSPORT_STATE_DISCONNECTING = 'disconnecting'
 TRANSPORT_STATE_RECEIVING = 'receiving'
 
 _TRANSPORT_STATES = {
-    TRANSPORT_STATE_CONNECTED: ( TRANSPORT_STATE_DISCONNECTING, ),
+    TRANSPORT_STATE_CONNECTED: ( TRANSPORT_STATE_DISCONNECTING, TRANSPORT_STATE_RECEIVING ),
     TRANSPORT_STATE_CONNECTING: ( TRANSPORT_STATE_CONNECTED, TRANSPORT_STATE_DISCONNECTING, TRANSPORT_STATE_RECEIVING ),
     TRANSPORT_STATE_DISCONNECTED: ( TRANSPORT_STATE_CONNECTING, ),
     TRANSPORT_STATE_DISCONNECTING: ( TRANSPORT_STATE_DISCONNECTED, ),
     TRANSPORT_STATE_RECEIVING: ( TRANSPORT_STATE_DISCONNECTING, ),
 }
 
+# Outbound packets queued by PollingTransport are sent from the control
+# lane ahead of the data lane
+SEND_LANE_CONTROL = 'control'
+SEND_LANE_DATA = 'data'
+
+_SEND_LANES = (
+    SEND_LANE_CONTROL,
+    SEND_LANE_DATA,
+)
+
+_SEND_LANES_BY_TYPE = dict(( ( packet_type, SEND_LANE_DATA if packet_type == EIO_TYPE_MESSAGE else SEND_LANE_CONTROL ) for packet_type in EIO_TYPE_NAMES_BY_CODE ))
+
+# Measures CPU (rather than wall clock) time where available
+_cputime = getattr(time, 'process_time', None) or time.clock  # pylint: disable=no-member
+
+# Stands in for the cache buster in PollingTransport's URL templates (it
+# survives URL encoding intact)
+_URL_TEMPLATE_MARKER = bytes(b'__T__')
+
 _PAYLOAD_TYPE_STR = 0
 _PAYLOAD_TYPE_BIN = 1
 _PAYLOAD_TYPES = (
@@ -124,6 +228,46 @@ _PAYLOAD_TYPES = (
     _PAYLOAD_TYPE_BIN,
 )
 
+_PAYLOAD_TYPE_OCTETS = {
+    _PAYLOAD_TYPE_STR: bytes(b'\x00'),
+    _PAYLOAD_TYPE_BIN: bytes(b'\x01'),
+}
+
+# Binary payload lengths are encoded as one octet (0x00-0x09) per decimal
+# digit followed by 0xff; these translate between those octets and ASCII
+# digits in bulk
+_LEN_OCTETS = bytes(bytearray(range(10)))
+_LEN_TERMINATOR = bytes(b'\xff')
+_LEN_OCTETS_TO_DIGITS = bytes(bytearray(( i + 0x30 if i < 10 else 0x78 for i in range(256) )))
+_DIGITS_TO_LEN_OCTETS = bytes(bytearray(( i - 0x30 if 0x30 <= i < 0x3a else i for i in range(256) )))
+
+# Number.MAX_VALUE ~ 1 * 10 ** 308 or 310 characters; the terminator is
+# never looked for past this many digits
+_MAX_LEN_DIGITS = 310
+
+# Engine.IO v4 polling payloads are packets separated by this, with
+# binary packets base64-encoded and prefixed with "b"
+_RECORD_SEPARATOR = bytes(b'\x1e')
+_RECORD_BIN_PREFIX = bytes(b'b')
+
+#: A pair of callables for encoding (``dumps``) and decoding (``loads``)
+#: JSON; see :func:`jsoncodec` and :func:`registerjsoncodec`
+JsonCodec = collections.namedtuple('JsonCodec', ( 'dumps', 'loads' ))
+
+# Codecs other than JSON_CODEC_DECIMAL parse non-integral numbers as
+# floats, which is several times faster than parsing them as Decimals
+_JSON_CODECS = {
+    JSON_CODEC_DECIMAL: JsonCodec(functools.partial(simplejson.dumps, use_decimal=True), functools.partial(simplejson.loads, parse_constant=decimal.Decimal, use_decimal=True)),
+    JSON_CODEC_JSON: JsonCodec(json.dumps, json.loads),
+    JSON_CODEC_SIMPLEJSON: JsonCodec(functools.partial(simplejson.dumps, use_decimal=False), simplejson.loads),
+}
+
+if orjson is not None:
+    _JSON_CODECS[JSON_CODEC_ORJSON] = JsonCodec(orjson.dumps, orjson.loads)
+
+if ujson is not None:
+    _JSON_CODECS[JSON_CODEC_UJSON] = JsonCodec(ujson.dumps, ujson.loads)
+
 _LOGGER = logging.getLogger(__name__)
 
 # ---- Exceptions --------------------------------------------------------
@@ -142,6 +286,10 @@ class EngineIoException(Exception):
 
         self.wrapped_exc = kw.get('wrapped_exc')
 
+# ========================================================================
+class BufferOverflowError(EngineIoException):
+    ""
+
 # ========================================================================
 class PayloadDecodeError(EngineIoException):
     ""
@@ -158,6 +306,10 @@ class EngineIoServerError(EngineIoException):
 class MethodMismatchError(EngineIoServerError):
     ""
 
+# ========================================================================
+class PingTimeoutError(EngineIoException):
+    ""
+
 # ========================================================================
 class ReceivedClosePacket(EngineIoException):
     ""
@@ -219,7 +371,7 @@ class ITransport(interface.Interface):  # pylint: disable=inherit-non-class
         +-------------------+------------------------------+-------------------+
         | ``connecting``    | ``connected``, ``receiving`` | ``disconnecting`` |
         +-------------------+------------------------------+-------------------+
-        | ``connected``     | ``disconnecting``                                |
+        | ``connected``     | ``receiving``, ``disconnecting``                 |
         +-------------------+--------------------------------------------------+
         | ``receiving``     | ``disconnecting``                                |
         +-------------------+--------------------------------------------------+
@@ -228,7 +380,15 @@ class ITransport(interface.Interface):  # pylint: disable=inherit-non-class
 
         Note that ``connecting`` can go to either ``connected`` or
         ``receiving``, although not all providers will necessarily
-        implement all paths (see :meth:`~ITransport.connect`).
+        implement all paths (see :meth:`~ITransport.connect`). Likewise,
+        not all providers can go from ``connected`` to ``receiving``
+        (see :meth:`PollingTransport.startreceiving`).
+        """)
+
+    queue_depths = interface.Attribute('queue_depths', """
+        A mapping of each send lane (:const:`SEND_LANE_CONTROL` and
+        :const:`SEND_LANE_DATA`) to the number of packets waiting in it to
+        be sent.
         """)
 
     # ---- Hooks ---------------------------------------------------------
@@ -326,6 +486,509 @@ class ITransportFactory(interface.Interface):  # pylint: disable=inherit-non-cla
 
 # ---- Classes -----------------------------------------------------------
 
+# ========================================================================
+class BinPayloadsDecoder(object):
+    """
+    A resumable, push-style counterpart to :func:`decbinpayloadsgen`. Raw
+    data can be fed in arbitrarily-sized chunks (e.g., as they arrive from
+    an HTTP response body), and each payload is returned as soon as all
+    of its octets have been fed. Only the octets of a trailing incomplete
+    payload are retained between calls to :meth:`feed`.
+
+    .. code-block:: python
+        :linenos:
+
+        >>> decoder = BinPayloadsDecoder()
+        >>> list(decoder.feed(b'\\x00\\x03\\xff4{}\\x00\\x02'))
+        ['4{}']
+        >>> list(decoder.feed(b'\\xff6'))
+        []
+        >>> list(decoder.feed(b'x'))
+        ['6x']
+        >>> decoder.finish()
+
+    If ``zerocopy`` is `True`, binary packets are yielded as
+    :class:`memoryview` slices of the decoder's buffer rather than copies
+    (see :func:`decbinpayloadsgen`). Each slice is released when the
+    generator is resumed, so anything that needs to outlive that has to be
+    copied first.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, zerocopy=False):
+        super().__init__()
+        self._buf = bytearray()
+        self._offset = 0
+        self._zerocopy = zerocopy
+
+    # ---- Public methods ------------------------------------------------
+
+    def feed(self, data):
+        """
+        Feeds ``data`` to the decoder. The returned :class:`generator`
+        must be exhausted before the decoder is fed again or finished.
+
+        :param bytes data: the next chunk of the raw Engine.IO message
+
+        :returns: a :class:`generator` that yields each packet completed
+            by ``data`` (see :func:`decbinpayloadsgen` for their types)
+
+        :raises: :exc:`PayloadDecodeError` if there was a problem decoding
+            ``data``; positions in error messages are relative to the
+            first octet ever fed to the decoder
+        """
+        if self._buf:
+            self._buf.extend(data)
+            raw = self._buf
+        else:
+            # Nothing is pending, so we can decode straight out of data
+            # and only buffer whatever is left over
+            raw = bytes(data)
+
+        pos = 0
+
+        try:
+            while True:
+                header = _decbinpayloadheader(raw, pos, self._offset)
+
+                if header is None:
+                    break
+
+                payload_type, payload_len, data_pos = header
+                end_pos = data_pos + payload_len
+
+                if end_pos > len(raw):
+                    break
+
+                # Outstanding views (including the one sliced here) would
+                # prevent resizing self._buf, and not every interpreter
+                # frees them as soon as they're unreferenced
+                with memoryview(raw) as whole, whole[data_pos:end_pos] as view:
+                    if payload_type == _PAYLOAD_TYPE_STR:
+                        payload = str(codecs.decode(view, 'utf_8'))
+                    elif self._zerocopy:
+                        payload = view
+                    else:
+                        payload = bytes(view.tobytes())
+
+                    pos = end_pos
+                    yield payload
+        finally:
+            self._offset += pos
+
+            if raw is self._buf:
+                # Drop consumed octets in place rather than copying what's
+                # left (which could be most of a large payload)
+                del self._buf[:pos]
+            else:
+                with memoryview(raw) as whole, whole[pos:] as rest:
+                    self._buf = bytearray(rest)
+
+    def finish(self):
+        """
+        Signals that no more data will be fed to the decoder.
+
+        :raises: :exc:`PayloadDecodeError` if the data fed so far ends
+            with an incomplete payload
+        """
+        if not self._buf:
+            return
+
+        raw = bytes(self._buf)
+        header = _decbinpayloadheader(raw, 0, self._offset)
+
+        if header is None:
+            raise PayloadDecodeError('payload length field truncated at {}'.format(self._offset + len(raw)))
+
+        _, payload_len, data_pos = header
+
+        raise PayloadDecodeError('payload data truncated (received only {} of {} expected octets) at {}'.format(len(raw) - data_pos, payload_len, self._offset + data_pos))
+
+# ========================================================================
+class RecordPayloadsDecoder(object):
+    """
+    Like :class:`BinPayloadsDecoder`, but for the record-separated payloads
+    used by Engine.IO v4 (see :func:`decrecordpayloadsgen`). Because the
+    last packet is not terminated, it is only returned from
+    :meth:`finish`.
+
+    .. code-block:: python
+        :linenos:
+
+        >>> decoder = RecordPayloadsDecoder()
+        >>> list(decoder.feed(b'4{}\\x1e6'))
+        ['4{}']
+        >>> list(decoder.feed(b'\\x1ebBA=='))
+        ['6']
+        >>> decoder.finish()
+        [b'4\\x04']
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        super().__init__()
+        self._buf = bytearray()
+        self._offset = 0
+
+    # ---- Public methods ------------------------------------------------
+
+    def feed(self, data):
+        """
+        Feeds ``data`` to the decoder. The returned :class:`generator`
+        must be exhausted before the decoder is fed again or finished.
+
+        :param bytes data: the next chunk of the raw Engine.IO message
+
+        :returns: a :class:`generator` that yields each packet completed
+            by ``data`` (see :func:`decrecordpayloadsgen` for their types)
+
+        :raises: :exc:`PayloadDecodeError` if there was a problem decoding
+            ``data``; positions in error messages are relative to the
+            first octet ever fed to the decoder
+        """
+        # Whatever is left over from earlier feeds has already been
+        # searched, so only look for separators in the new data
+        scan_pos = len(self._buf)
+        self._buf.extend(data)
+        pos = 0
+
+        try:
+            while True:
+                end_pos = self._buf.find(_RECORD_SEPARATOR, scan_pos)
+
+                if end_pos < 0:
+                    break
+
+                payload = _decrecord(self._buf[pos:end_pos], self._offset + pos)
+                pos = scan_pos = end_pos + 1
+                yield payload
+        finally:
+            self._offset += pos
+            del self._buf[:pos]
+
+    def finish(self):
+        """
+        Signals that no more data will be fed to the decoder.
+
+        :returns: a :class:`list` containing the last packet (if any)
+
+        :raises: :exc:`PayloadDecodeError` if the last packet could not be
+            decoded
+        """
+        if not self._buf:
+            return []
+
+        buf, self._buf = self._buf, bytearray()
+
+        return [ _decrecord(buf, self._offset) ]
+
+# ========================================================================
+class _PayloadsProtocol(t_protocol.Protocol):
+    """
+    Feeds an HTTP response body to ``decoder`` (a
+    :class:`BinPayloadsDecoder` or :class:`RecordPayloadsDecoder`) as it
+    arrives, calling ``packetreceived`` with each decoded payload. Once the
+    body is complete, ``finished_d``'s callback is fired with `None`. If
+    decoding fails or ``packetreceived`` raises an exception, the
+    connection is aborted and ``finished_d``'s errback is fired with the
+    failure.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, packetreceived, finished_d, decoder):
+        self._decoder = decoder
+        self._failure = None
+        self._finished_d = finished_d
+        self._packetreceived = packetreceived
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionLost(self, reason=t_protocol.connectionDone):
+        if self._failure is not None:
+            self._finished_d.errback(self._failure)
+        elif reason.check(t_client.ResponseDone):
+            try:
+                for payload in self._decoder.finish() or ():
+                    self._packetreceived(payload)
+            except Exception:  # pylint: disable=broad-except
+                self._finished_d.errback()
+            else:
+                self._finished_d.callback(None)
+        else:
+            self._finished_d.errback(reason)
+
+    def dataReceived(self, data):
+        if self._failure is not None:
+            return
+
+        try:
+            for payload in self._decoder.feed(data):
+                self._packetreceived(payload)
+        except Exception:  # pylint: disable=broad-except
+            self._failure = t_failure.Failure()
+            self.abort()
+
+    # ---- Public methods ------------------------------------------------
+
+    def abort(self):
+        abort = getattr(self.transport, 'abortConnection', None)
+
+        if abort is not None:
+            abort()
+
+# ========================================================================
+class _DeflateDecoder(t_client.GzipDecoder):
+    """
+    Like :class:`twisted.web.client.GzipDecoder`, but for responses with a
+    ``Content-Encoding`` of ``deflate`` (for use with
+    :class:`twisted.web.client.ContentDecoderAgent`).
+    """
+
+    # ---- Public hooks --------------------------------------------------
+
+    def deliverBody(self, protocol):
+        self.original.deliverBody(_DeflateProtocol(protocol, self.original))
+
+# ========================================================================
+class _DeflateProtocol(t_components.proxyForInterface(t_interfaces.IProtocol)):
+    """
+    Decompresses ``deflate`` response bodies before passing them along.
+    RFC 7230 calls for a zlib (RFC 1950) stream, but some servers send a
+    raw deflate (RFC 1951) stream instead, so this checks for a zlib header
+    before deciding which to expect.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, protocol, response):
+        self.original = protocol
+        self._response = response
+        self._decompressobj = None
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionLost(self, reason):
+        if self._decompressobj is not None:
+            try:
+                data = self._decompressobj.flush()
+            except zlib.error:
+                raise t_client.ResponseFailed([ reason, t_failure.Failure() ], self._response)
+
+            if data:
+                self.original.dataReceived(data)
+
+        self.original.connectionLost(reason)
+
+    def dataReceived(self, data):
+        if not data:
+            return
+
+        if self._decompressobj is None:
+            header = bytearray(data[:2])
+            # A zlib header specifies method 8 (deflate) and is a multiple
+            # of 31 when read as a big-endian 16-bit integer
+            wrapped = len(header) < 2 \
+                or ( header[0] & 0x0f == 8 and ( header[0] << 8 | header[1] ) % 31 == 0 )
+            self._decompressobj = zlib.decompressobj(zlib.MAX_WBITS if wrapped else -zlib.MAX_WBITS)
+
+        try:
+            data = self._decompressobj.decompress(data)
+        except zlib.error:
+            raise t_client.ResponseFailed([ t_failure.Failure() ], self._response)
+
+        if data:
+            self.original.dataReceived(data)
+
+if _WEBSOCKET_SUPPORTED:
+    # ====================================================================
+    class _WebSocketProtocol(ab_websocket.WebSocketClientProtocol):
+        """
+        Relays WebSocket connection events to the
+        :class:`WebSocketTransport` set as ``eio_transport`` on the
+        factory.
+        """
+
+        # ---- Public hooks ----------------------------------------------
+
+        def onClose(self, wasClean, code, reason):
+            self.factory.eio_transport._connectionclosed(wasClean, code, reason)  # pylint: disable=protected-access
+
+        def onMessage(self, payload, isBinary):
+            self.factory.eio_transport._framereceived(payload, isBinary)  # pylint: disable=protected-access
+
+        def onOpen(self):
+            self.factory.eio_transport._connectionopened()  # pylint: disable=protected-access
+
+# ========================================================================
+class _SendBuffer(object):
+    """
+    Holds outbound packets (along with the
+    :class:`~twisted.internet.defer.Deferred` objects returned for them)
+    while :class:`EngineIo` has no transport over which to send them,
+    subject to optional limits on the number of packets and the total
+    size of their data. Packets are appended in groups (e.g., a Socket.IO
+    binary packet and its attachments), which are only ever held, dropped,
+    or sent whole.
+
+    With :const:`BUFFER_BLOCK`, a group that doesn't fit waits (outside
+    the limits) until one that does is canceled or the buffer is drained.
+    :attr:`full` tells producers when to hold off.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, max_packets=None, max_bytes=None, overflow=BUFFER_DROP_OLDEST):
+        if overflow not in _BUFFER_OVERFLOWS:
+            raise ValueError('overflow must be one of: {}'.format(', '.join(( repr(i) for i in _BUFFER_OVERFLOWS ))))
+
+        self._max_packets = max_packets
+        self._max_bytes = max_bytes
+        self._overflow = overflow
+        # Each group is [ entries, size ], where each entry is (
+        # packet_type, packet_data, d )
+        self._groups = collections.deque()
+        self._npackets = 0
+        self._nbytes = 0
+        # With BUFFER_BLOCK, groups waiting for room (in order)
+        self._waiting = collections.deque()
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def full(self):
+        """
+        Whether a packet appended now would have to wait or displace
+        another (or be dropped).
+        """
+        return bool(self._waiting) \
+            or (self._max_packets is not None
+                and self._npackets >= self._max_packets) \
+            or (self._max_bytes is not None
+                and self._nbytes >= self._max_bytes)
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    @property
+    def waiting(self):
+        """
+        The number of packets waiting for room (not counted by
+        :func:`len`).
+        """
+        return sum(( len(entries) for entries, _ in self._waiting ))
+
+    # ---- Public methods ------------------------------------------------
+
+    def __len__(self):
+        return self._npackets
+
+    def append(self, packets):
+        """
+        Holds ``packets`` (a sequence of ``( packet_type, packet_data )``
+        tuples) as a group. Canceling the
+        :class:`~twisted.internet.defer.Deferred` for any of them before
+        the buffer is drained withdraws the whole group.
+
+        :returns: a :class:`list` of
+            :class:`~twisted.internet.defer.Deferred` objects, one per
+            packet
+        """
+        group = [ [], 0 ]
+
+        def _cancel(_d):
+            self._withdraw(group, _d)
+
+        for packet_type, packet_data in packets:
+            group[0].append(( packet_type, packet_data, t_defer.Deferred(_cancel) ))
+            group[1] += len(packet_data) if packet_data else 0
+
+        ds = [ d for _, _, d in group[0] ]
+
+        if not self._waiting \
+                and self._fits(group):
+            self._push(group)
+        elif (self._max_packets is not None
+                    and len(group[0]) > self._max_packets) \
+                or (self._max_bytes is not None
+                    and group[1] > self._max_bytes):
+            # Don't wait or evict anything for a group that will never fit
+            self._fail(group, BufferOverflowError('packet is larger than send buffer'))
+        elif self._overflow == BUFFER_BLOCK:
+            self._waiting.append(group)
+        elif self._overflow == BUFFER_DROP_NEWEST:
+            self._fail(group, BufferOverflowError('send buffer full'))
+        else:
+            while not self._fits(group):
+                _LOGGER.debug('send buffer full; dropping oldest packet(s)')
+                self._fail(self._pop(), BufferOverflowError('dropped from full send buffer'))
+
+            self._push(group)
+
+        return ds
+
+    def drain(self):
+        """
+        Removes and returns all entries (waiting ones last) as ``(
+        packet_type, packet_data, d )`` tuples.
+        """
+        entries = [ entry for entries, _ in self._groups for entry in entries ]
+        entries.extend(( entry for entries, _ in self._waiting for entry in entries ))
+        self._groups.clear()
+        self._waiting.clear()
+        self._npackets = 0
+        self._nbytes = 0
+
+        return entries
+
+    # ---- Private methods -----------------------------------------------
+
+    def _fail(self, group, exc):
+        for _, _, d in group[0]:
+            d.errback(exc)
+
+    def _fits(self, group):
+        return (self._max_packets is None
+                or self._npackets + len(group[0]) <= self._max_packets) \
+            and (self._max_bytes is None
+                or self._nbytes + group[1] <= self._max_bytes)
+
+    def _pop(self):
+        group = self._groups.popleft()
+        self._npackets -= len(group[0])
+        self._nbytes -= group[1]
+
+        return group
+
+    def _push(self, group):
+        self._groups.append(group)
+        self._npackets += len(group[0])
+        self._nbytes += group[1]
+
+    def _withdraw(self, group, canceled_d):
+        # Groups are found by identity (comparing them would compare
+        # their data)
+        if any(( g is group for g in self._groups )):
+            self._groups = collections.deque(( g for g in self._groups if g is not group ))
+            self._npackets -= len(group[0])
+            self._nbytes -= group[1]
+
+            while self._waiting \
+                    and self._fits(self._waiting[0]):
+                self._push(self._waiting.popleft())
+        elif any(( g is group for g in self._waiting )):
+            self._waiting = collections.deque(( g for g in self._waiting if g is not group ))
+        else:
+            # Already drained
+            return
+
+        for _, _, d in group[0]:
+            if d is not canceled_d:
+                d.cancel()
+
 # ========================================================================
 class TransportContext(object):
     """
@@ -335,10 +998,19 @@ class TransportContext(object):
 
     # ---- Constructor ---------------------------------------------------
 
-    def __init__(self, base_url):
-        ""
+    def __init__(self, base_url, protocol=EIO_PROTOCOL):
+        """
+        :param base_url: see :attr:`base_url`
+
+        :param Integral protocol: see :attr:`protocol`
+        """
         super().__init__()
+
+        if protocol not in _EIO_PROTOCOLS:
+            raise ValueError('protocol must be one of: {}'.format(', '.join(( repr(i) for i in _EIO_PROTOCOLS ))))
+
         self._base_url = base_url
+        self._protocol = protocol
         self.clear()
 
     # ---- Public properties ---------------------------------------------
@@ -370,6 +1042,16 @@ class TransportContext(object):
         """
         return self._ping_timeout
 
+    @property
+    def protocol(self):
+        """
+        The Engine.IO protocol version spoken under the context (one of
+        :const:`EIO_PROTOCOL_3` or :const:`EIO_PROTOCOL_4`), which
+        determines how packets are framed and which side sends ``ping``
+        packets.
+        """
+        return self._protocol
+
     @property
     def session_id(self):
         """
@@ -453,6 +1135,15 @@ class _BaseTransport(Dispatcher):
 
         self._state = value
 
+    @property
+    def queue_depths(self):
+        """
+        A mapping of each send lane (:const:`SEND_LANE_CONTROL` and
+        :const:`SEND_LANE_DATA`) to the number of packets queued in it
+        (always zero for transports that don't queue).
+        """
+        return dict.fromkeys(_SEND_LANES, 0)
+
     @property
     def transport_context(self):
         """
@@ -498,11 +1189,29 @@ class PollingTransport(_BaseTransport):
 
         # ---- Constructor -----------------------------------------------
 
-        def __init__(self, agent=None, pool=None, headers=None):
+        def __init__(self, agent=None, pool=None, headers=None, coalesce=False, coalesce_window=0, compression=None, compression_threshold=1024, compression_stats=None):
             """
             :param agent: passed to :meth:`PollingTransport.__init__`
 
+            :param pool: passed to :meth:`PollingTransport.__init__` (a
+                :class:`SharedConnectionPool` is shared by every transport
+                this builds)
+
             :param headers: passed to :meth:`PollingTransport.__init__`
+
+            :param coalesce: passed to :meth:`PollingTransport.__init__`
+
+            :param coalesce_window: passed to
+                :meth:`PollingTransport.__init__`
+
+            :param compression: passed to :meth:`PollingTransport.__init__`
+
+            :param compression_threshold: passed to
+                :meth:`PollingTransport.__init__`
+
+            :param compression_stats: passed to
+                :meth:`PollingTransport.__init__` (if provided, it is shared
+                by every transport this builds)
             """
             super().__init__()
 
@@ -510,18 +1219,42 @@ class PollingTransport(_BaseTransport):
                 'agent': agent,
                 'pool': pool,
                 'headers': headers,
+                'coalesce': coalesce,
+                'coalesce_window': coalesce_window,
+                'compression': compression,
+                'compression_threshold': compression_threshold,
+                'compression_stats': compression_stats,
             }
 
             self.buildTransport = functools.partial(PollingTransport, **kw)
 
     # ---- Constructor ---------------------------------------------------
 
-    def __init__(self, reactor, agent=None, pool=None, headers=None):
+    def __init__(self, reactor, agent=None, pool=None, headers=None, coalesce=False, coalesce_window=0, compression=None, compression_threshold=1024, compression_stats=None):
         """
         ``reactor`` is typically provided from
         :meth:`ITransportFactory.buildTransport`.
 
-        :param agent: the agent used to establish the connection
+        Packets are sent one at a time, in the order in which they were
+        passed to :meth:`sendpacket`, except that control packets (i.e.,
+        anything other than ``message`` packets, such as ``ping`` and
+        ``pong`` packets) are queued in a separate lane (see
+        :attr:`queue_depths`) that is always sent first, so they don't
+        wait behind a backlog of ``message`` packets. By default, each
+        packet gets its own ``POST`` request. If ``coalesce`` is `True`,
+        every packet queued while a ``POST`` is in flight is instead sent
+        as part of a single multi-packet payload once that ``POST``
+        completes (and control packets don't wait for any
+        ``coalesce_window``).
+
+        :param agent: the agent used to establish the connection (a
+            :class:`~txsocketio.longpoll.LongPollAgent` is a lightweight
+            alternative to the default :class:`twisted.web.client.Agent`
+            stack, and a :class:`~txsocketio.longpoll.H2LongPollAgent`
+            shared by many transports multiplexes their requests over
+            HTTP/2); if it has a ``newsession`` method, that is called
+            for an agent to use instead, whose connections are closed
+            along with the transport
 
         :type agent: :class:`twisted.web.client.Agent`
 
@@ -530,18 +1263,51 @@ class PollingTransport(_BaseTransport):
             is recommended to be 3 or more, but should be at least 2 (one
             for retrieving packets and one for sending them; packets to be
             sent, *including periodic ``ping`` packets*, will be queued
-            until a persistent connection is available)
+            until a persistent connection is available); a
+            :class:`SharedConnectionPool` is leased rather than used
+            directly (and left as configured); if only ``agent`` is
+            provided, connections are left to the agent
 
         :type pool: :class:`twisted.web.client.HTTPConnectionPool`
 
         :param headers: additional headers used for each request
 
         :type headers: :class:`twisted.web.http_headers.Headers`
+
+        :param bool coalesce: if `True`, send all queued packets in one
+            ``POST`` request rather than one request per packet
+
+        :param Real coalesce_window: if ``coalesce`` is `True` and this is
+            positive, wait this many seconds after a packet is queued (and
+            no ``POST`` is in flight) for more packets before sending
+
+        :param compression: if not `None`, ``POST`` bodies of at least
+            ``compression_threshold`` octets are compressed and sent with a
+            ``Content-Encoding`` of ``compression`` (either
+            :const:`COMPRESSION_GZIP` or :const:`COMPRESSION_DEFLATE`),
+            unless compression would not make them any smaller; the server
+            must accept compressed request bodies
+
+        :param Integral compression_threshold: the minimum size (in
+            octets) of ``POST`` bodies to compress
+
+        :param compression_stats: where to record what compression
+            achieves (and costs); defaults to a new instance (see
+            :attr:`compression_stats`)
+
+        :type compression_stats: :class:`CompressionStats`
         """
         super().__init__()
 
+        if compression is not None \
+                and compression not in _COMPRESSION_WBITS:
+            raise ValueError('compression must be None or one of: {}'.format(', '.join(( repr(i) for i in sorted(_COMPRESSION_WBITS) ))))
+
+        self._compression = compression
+        self._compression_threshold = compression_threshold
+        self._compression_stats = compression_stats if compression_stats is not None else CompressionStats()
+
         self._query = {
-            b'EIO': EIO_PROTOCOL,
             b'transport': TRANSPORT_POLLING.encode('ascii'),
         }
 
@@ -555,18 +1321,44 @@ class PollingTransport(_BaseTransport):
         if headers is not None:
             self._headers.update(headers)
 
+        # Built once per session (see _nextrequesturl and _requestheaders)
+        # and treated as immutable thereafter
+        self._url_template = None
+        self._headers_templates = None
         self._reactor = reactor
-        self._pool = pool if pool is not None else self._builddefaultpool()
-        # We need two connections (one for polling for packets and one for
-        # sending them); anything more is a waste, since we only allow one
-        # poll request at a time (because that's all that the server can
-        # handle)
-        self._pool.maxPersistentPerHost = 2
-        self._send_lock = t_defer.DeferredLock()
+
+        if pool is None \
+                and agent is None:
+            pool = self._builddefaultpool()
+
+        if isinstance(pool, SharedConnectionPool):
+            pool = pool.lease()
+        elif pool is not None:
+            # We need two connections (one for polling for packets and one
+            # for sending them); anything more is a waste, since we only
+            # allow one poll request at a time (because that's all that the
+            # server can handle)
+            pool.maxPersistentPerHost = 2
+
+        self._pool = pool
+        self._coalesce = coalesce
+        self._coalesce_window = coalesce_window
+        self._send_queues = dict(( ( lane, collections.deque() ) for lane in _SEND_LANES ))
+        self._sending_d = None
+        self._send_call = None
         self._pending_request_ds = collections.deque()
+        newsession = getattr(agent, 'newsession', None)
+
+        if newsession is not None:
+            # A shared agent keeps our connections and cookies separate
+            # from those of other sessions
+            agent = newsession()
+
         self._agent = agent if agent is not None else self._builddefaultagent()
+        self._agent_is_session = newsession is not None
         self._connecting_d = None
         self._disconnecting_d = None
+        self._draining = False
         self._receiving_d = None
         # Because we're still disconnected at this point, this initializes
         # self._receiving_d without starting the loop
@@ -576,16 +1368,36 @@ class PollingTransport(_BaseTransport):
 
     default_timeout = 3
 
+    @property
+    def compression_stats(self):
+        """
+        The :class:`CompressionStats` recording this transport's request
+        body compression.
+        """
+        return self._compression_stats
+
+    @property
+    def queue_depths(self):
+        """
+        See :attr:`ITransport.queue_depths`.
+        """
+        return dict(( ( lane, len(send_queue) ) for lane, send_queue in iteritems(self._send_queues) ))
+
     # ---- Public hooks --------------------------------------------------
 
     def connect(self, transport_context):
         super().connect(transport_context)
         self.state = TRANSPORT_STATE_CONNECTING
+        self._query[b'EIO'] = self.transport_context.protocol
+        self._url_template = None
+        self._headers_templates = None
 
         if self.transport_context.session_id is not None:
             # Assume that we're "upgrading" our own transport and that a
             # session has already been established; also assume that the
             # session is still good
+            self._query['sid'] = self.transport_context.session_id
+            self._url_template = self._buildurltemplate()
             self.state = TRANSPORT_STATE_RECEIVING
             d = t_defer.succeed(None)
             self._receiveloop()
@@ -621,7 +1433,25 @@ class PollingTransport(_BaseTransport):
 
     def sendpacket(self, packet_type, packet_data=''):
         super().sendpacket(packet_type, packet_data)
-        d = self._send_lock.run(self._sendpacket, packet_type, packet_data)
+
+        try:
+            packet = enceiopacket(packet_type, packet_data)
+        except Exception:  # pylint: disable=broad-except
+            return t_defer.fail()
+
+        send_queue = self._send_queues[_SEND_LANES_BY_TYPE[packet_type]]
+        in_flight = []
+
+        def _cancel(_d):
+            try:
+                send_queue.remove(( packet, _d ))
+            except ValueError:
+                # It's already in flight (possibly along with others), so
+                # let the POST finish; only this caller stops waiting
+                in_flight.append(_d)
+
+        d = t_defer.Deferred(_cancel)
+        send_queue.append(( packet, d ))
         self._pending_request_ds.append(d)
 
         def _done(passthru):
@@ -629,21 +1459,57 @@ class PollingTransport(_BaseTransport):
 
             return passthru
 
+        def _failed(failure):
+            if in_flight \
+                    and failure.check(t_defer.CancelledError):
+                return failure
+
+            _d = self._stopconnecting(failure)
+            _d.addErrback(self._shutitdown, lose_connection=True)
+
+            return _d
+
         d.addBoth(_done)
-        d.addErrback(self._stopconnecting)
-        d.addErrback(self._shutitdown, lose_connection=True)
+        d.addErrback(_failed)
         # handled = ( t_defer.CancelledError, t_client.ResponseFailed, UnknownSessionIdError )
         # d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when sending packet <{}:{!r}>:'.format(EIO_TYPE_NAMES_BY_CODE.get(_packet_type, '[WTF?! UNKNOWN PACKET TYPE?!]'), _packet_data), handled=handled)
+        self._schedulesend()
 
         return d
 
-    def standby(self):
+    def standby(self, drain=False):
+        """
+        See :meth:`ITransport.standby`.
+
+        If ``drain`` is `True`, any in-flight or queued requests are
+        allowed to complete (and any packets they retrieve are
+        dispatched) rather than being canceled. This is used when
+        handing the session off to another transport.
+        """
         super().standby()
         d = self._stopconnecting(None)
-        d.addBoth(self._shutitdown, lose_connection=False)
+        d.addBoth(self._shutitdown, lose_connection=False, drain=drain)
 
         return d
 
+    # ---- Public methods ------------------------------------------------
+
+    def startreceiving(self):
+        """
+        Starts retrieving packets for a session established by
+        :meth:`connect`, moving :attr:`state` from ``connected`` to
+        ``receiving`` without first having to call :meth:`standby` and
+        :meth:`connect` again.
+
+        :raises TransportStateError: if :attr:`state` is not
+            ``connected``
+        """
+        if self.state != TRANSPORT_STATE_CONNECTED:
+            raise TransportStateError('{} state is not {!r}'.format(self.__class__.__name__, TRANSPORT_STATE_CONNECTED))
+
+        self.state = TRANSPORT_STATE_RECEIVING
+        self._receiveloop()
+
     # ---- Private methods -----------------------------------------------
 
     def _builddefaultagent(self):
@@ -651,7 +1517,7 @@ class PollingTransport(_BaseTransport):
         agent = t_client.Agent.usingEndpointFactory(self._reactor, endpoint_factory, pool=self._pool)
         jar = cookiejar.CookieJar()
         agent = t_client.CookieAgent(agent, jar)
-        agent = t_client.ContentDecoderAgent(agent, [ ( b'gzip', t_client.GzipDecoder ) ])
+        agent = t_client.ContentDecoderAgent(agent, [ ( b'gzip', t_client.GzipDecoder ), ( b'deflate', _DeflateDecoder ) ])
 
         return agent
 
@@ -661,16 +1527,28 @@ class PollingTransport(_BaseTransport):
 
         return pool
 
+    def _buildurltemplate(self):
+        query = dict(self._query)
+        # The cache buster goes last, so the marker's last occurrence is
+        # the one we put there (even if it also shows up in the path or
+        # the session ID)
+        query.pop(b't', None)
+        query[b't'] = _URL_TEMPLATE_MARKER
+        url_bytes = self.transport_context.base_url.replace(query=url_parse.urlencode(query).encode('ascii')).unsplit()
+        head, _, tail = url_bytes.rpartition(_URL_TEMPLATE_MARKER)
+
+        return head, tail
+
     def _checkresponse(self, response_with_body):
         content_type = response_with_body.headers.getRawHeaders(b'Content-Type')
         charset = 'latin_1'
 
         if content_type is not None:
-            content_type = content_type[0].split(';')
+            content_type = content_type[0].decode('latin_1').split(';')
             content_type, content_type_params = content_type[0], content_type[1:]
-            content_type = content_type.lower()
-            content_type_params = list(( v.split('=', 1) for v in content_type_params ))
-            content_type_params = dict(( ( k.lower(), v ) for k, v in content_type_params ))
+            content_type = content_type.strip().lower()
+            content_type_params = list(( v.split('=', 1) for v in content_type_params if '=' in v ))
+            content_type_params = dict(( ( k.strip().lower(), v.strip() ) for k, v in content_type_params ))
             charset = content_type_params.setdefault('charset', charset)
         else:
             content_type = 'application/json'
@@ -707,12 +1585,16 @@ class PollingTransport(_BaseTransport):
     def _nextrequesturl(self):
         request_count = self._request_count
         self._request_count += 1
-        query = dict(self._query)
 
-        if self.transport_context.session_id is not None:
-            query[b't'] = '{}-{}'.format(int(time.time() * 1000), request_count).encode('utf_8')
+        if self.transport_context.session_id is None:
+            url_bytes = self.transport_context.base_url.replace(query=url_parse.urlencode(self._query).encode('ascii')).unsplit()
+        else:
+            if self._url_template is None:
+                self._url_template = self._buildurltemplate()
 
-        url_bytes = self.transport_context.base_url.replace(query=url_parse.urlencode(query)).unsplit()
+            # Only the cache buster changes from one request to the next
+            head, tail = self._url_template
+            url_bytes = head + '{}-{}'.format(int(time.time() * 1000), request_count).encode('ascii') + tail
 
         return request_count, url_bytes
 
@@ -720,59 +1602,58 @@ class PollingTransport(_BaseTransport):
         if self.state in ( TRANSPORT_STATE_DISCONNECTED, TRANSPORT_STATE_DISCONNECTING ):
             raise TransportStateError('packets requested when {} state is {!r}'.format(self.__class__.__name__, self.state))
 
-        d = self._sessionrequest()
-        d.addCallback(self._parsepackets)
+        d = self._sessionrequest(packetreceived=self._parsepacket)
+        d.addCallback(self._parsepacketsdone)
 
         return d
 
-    def _parsepackets(self, response_with_body):
-        try:
-            packets = [ deceiopacket(pckt) for pckt in decbinpayloadsgen(response_with_body.body) ]
-        except PayloadDecodeError as exc:
-            new_exc = type(exc)('unparseable response from request[{}]: {!r}'.format(response_with_body.request_count, response_with_body.body), wrapped_exc=exc)
+    def _parsepacket(self, response, payload):
+        if not isinstance(payload, str) \
+                and self.transport_context.protocol == EIO_PROTOCOL_3:
+            packet_type, packet_data = _decbinpacket(payload)
+        else:
+            packet_type, packet_data = deceiopacket(payload)
+
+        i = response.packet_count
+        response.packet_count += 1
+        packet_name = EIO_TYPE_NAMES_BY_CODE[packet_type]
+        _LOGGER.debug('received packet[%d] ("%s") from request[%d]', i, packet_name, response.request_count)
+
+        if packet_type == EIO_TYPE_OPEN \
+                and (i > 0
+                    or response.request_count != 0):
+            raise TransportStateError('received out-of-band "{}" packet'.format(packet_name))
+
+        if response.closing:
+            raise TransportStateError('received out-of-band "{}" packet after close'.format(packet_name))
+
+        if packet_type == EIO_TYPE_OPEN:
+            data = jsonloads(packet_data)
+            ping_interval = data['pingInterval']
+            ping_timeout = data['pingTimeout']
+            session_id = data['sid']
+            upgrades = data.get('upgrades', ())
+            self.transport_context.set(session_id, ping_timeout, ping_interval, upgrades)
+            self._query['sid'] = session_id
+            self._url_template = self._buildurltemplate()
+            _LOGGER.debug('session "%s" opened', session_id)
+
+        dispatch_args = [ packet_name ]
+
+        if packet_type in ( EIO_TYPE_MESSAGE, EIO_TYPE_PING, EIO_TYPE_PONG ):
+            dispatch_args.append(packet_data)
+
+        if packet_type == EIO_TYPE_CLOSE:
+            response.closing = True
+            _LOGGER.debug('session "%s" closed by server', self.transport_context.session_id)
+        else:
+            self.dispatch(*dispatch_args)
 
-            raise new_exc
+    def _parsepacketsdone(self, response):
+        if response.closing:
+            self.transport_context.clear()
 
-        closing = False
-
-        for i, packet in enumerate(packets):
-            packet_type, packet_data = packet
-            packet_name = EIO_TYPE_NAMES_BY_CODE[packet_type]
-            _LOGGER.debug('received packet[%d] ("%s") from request[%d]', i, packet_name, response_with_body.request_count)
-
-            if packet_type == EIO_TYPE_OPEN \
-                    and (i > 0
-                        or response_with_body.request_count != 0):
-                raise TransportStateError('received out-of-band "{}" packet'.format(packet_name))
-
-            if closing:
-                raise TransportStateError('received out-of-band "{}" packet after close'.format(packet_name))
-
-            if packet_type == EIO_TYPE_OPEN:
-                data = jsonloads(packet_data)
-                ping_interval = data['pingInterval']
-                ping_timeout = data['pingTimeout']
-                session_id = data['sid']
-                upgrades = data.get('upgrades', ())
-                self.transport_context.set(session_id, ping_timeout, ping_interval, upgrades)
-                self._query['sid'] = session_id
-                _LOGGER.debug('session "%s" opened', session_id)
-
-            dispatch_args = [ packet_name ]
-
-            if packet_type in ( EIO_TYPE_MESSAGE, EIO_TYPE_PING, EIO_TYPE_PONG ):
-                dispatch_args.append(packet_data)
-
-            if packet_type == EIO_TYPE_CLOSE:
-                closing = True
-                _LOGGER.debug('session "%s" closed by server', self.transport_context.session_id)
-            else:
-                self.dispatch(*dispatch_args)
-
-        if closing:
-            self.transport_context.clear()
-
-            raise ReceivedClosePacket
+            raise ReceivedClosePacket
 
     def _receiveloop(self, _=None):
         if self.state != TRANSPORT_STATE_RECEIVING:
@@ -790,22 +1671,138 @@ class PollingTransport(_BaseTransport):
         handled = ( t_defer.CancelledError, t_client.ResponseFailed, ReceivedClosePacket, UnknownSessionIdError )
         self._receiving_d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when retrieving packets:', handled=handled)
 
+    def _schedulesend(self):
+        if self._send_call is not None \
+                and self._send_queues[SEND_LANE_CONTROL]:
+            # Don't hold control packets for the coalesce window
+            self._send_call.cancel()
+            self._send_call = None
+
+        if self._sending_d is not None \
+                or self._send_call is not None \
+                or not any(itervalues(self._send_queues)):
+            return
+
+        if self._draining:
+            # Flush whatever is left without waiting for more
+            self._sendqueued()
+
+            return
+
+        if self.state not in ( TRANSPORT_STATE_CONNECTED, TRANSPORT_STATE_RECEIVING ):
+            return
+
+        if self._coalesce \
+                and self._coalesce_window > 0 \
+                and not self._send_queues[SEND_LANE_CONTROL]:
+            self._send_call = self._reactor.callLater(self._coalesce_window, self._sendqueued)
+        else:
+            self._sendqueued()
+
     def _sendpacket(self, packet_type, packet_data=''):
-        packet = enceiopacket(packet_type, packet_data)
-        payload = encbinpayload(packet)
+        return self._sendpackets(( enceiopacket(packet_type, packet_data), ))
+
+    def _sendpackets(self, packets):
+        if self.transport_context.protocol == EIO_PROTOCOL_3:
+            payload = encbinpayloads(( _encbinpacket(packet) if isinstance(packet, bytes) else packet for packet in packets ))
+        else:
+            payload = encrecordpayloads(packets)
+
         d = self._sessionrequest(payload)
 
         def _checkbody(request_with_body):
-            if request_with_body.body != 'ok':
+            if request_with_body.body != b'ok':
                 raise UnexpectedServerError('unrecognized response from request[{}]: {!r}'.format(request_with_body.request_count, request_with_body.body))
 
         d.addCallback(_checkbody)
 
         return d
 
-    def _sessionrequest(self, payload=None, req_method=None, timeout=None):
+    def _sendqueued(self):
+        self._send_call = None
+        control_queue = self._send_queues[SEND_LANE_CONTROL]
+        data_queue = self._send_queues[SEND_LANE_DATA]
+
+        if self._coalesce:
+            batch = list(control_queue)
+            batch.extend(data_queue)
+            control_queue.clear()
+            data_queue.clear()
+        elif control_queue:
+            batch = [ control_queue.popleft() ]
+        elif data_queue:
+            batch = [ data_queue.popleft() ]
+        else:
+            batch = []
+
+        if not batch:
+            return
+
+        _LOGGER.debug('sending %d queued packet(s)', len(batch))
+        self._sending_d = t_defer.maybeDeferred(self._sendpackets, [ packet for packet, _ in batch ])
+
+        def _sent(passthru):
+            self._sending_d = None
+
+            if isinstance(passthru, t_failure.Failure) \
+                    and all(_d.called for _, _d in batch):
+                # Every packet was canceled while in flight, so nobody is
+                # left to hear about the failure
+                d = self._stopconnecting(passthru)
+                d.addErrback(self._shutitdown, lose_connection=True)
+                handled = ( t_defer.CancelledError, t_client.ResponseFailed, UnknownSessionIdError )
+                d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when sending packets:', handled=handled)
+
+            for _, _d in batch:
+                if _d.called:
+                    # Canceled while in flight
+                    continue
+
+                if isinstance(passthru, t_failure.Failure):
+                    _d.errback(passthru)
+                else:
+                    _d.callback(None)
+
+            self._schedulesend()
+
+        self._sending_d.addBoth(_sent)
+
+    def _requestheaders(self, has_payload):
+        if self._headers_templates is None:
+            content_type = b'application/octet-stream' if self.transport_context.protocol == EIO_PROTOCOL_3 else b'text/plain; charset=UTF-8'
+            with_payload = t_http_headers.Headers(self._headers)
+            with_payload.addRawHeader(b'Content-Type', content_type)
+            self._headers_templates = ( t_http_headers.Headers(self._headers), with_payload )
+
+        return self._headers_templates[has_payload]
+
+    def _compresspayload(self, payload):
+        stats = self._compression_stats
+
+        if len(payload) < self._compression_threshold:
+            stats.skipped += 1
+
+            return payload, False
+
+        started = _cputime()
+        compressobj = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, _COMPRESSION_WBITS[self._compression])
+        compressed = compressobj.compress(payload) + compressobj.flush()
+        stats.cpu_time += _cputime() - started
+
+        if len(compressed) >= len(payload):
+            stats.incompressible += 1
+
+            return payload, False
+
+        stats.compressed += 1
+        stats.bytes_in += len(payload)
+        stats.bytes_out += len(compressed)
+
+        return compressed, True
+
+    def _sessionrequest(self, payload=None, req_method=None, timeout=None, packetreceived=None):
         request_count, url_bytes = self._nextrequesturl()
-        headers = t_http_headers.Headers(self._headers)
+        headers = self._requestheaders(payload is not None)
 
         if payload is None:
             req_method = req_method if req_method is not None else b'GET'
@@ -813,10 +1810,20 @@ class PollingTransport(_BaseTransport):
             _LOGGER.debug('%s-ing[%d] from <%s>', req_method, request_count, url_bytes.decode('utf_8'))
         else:
             req_method = req_method if req_method is not None else b'POST'
-            headers.addRawHeader(b'Content-Type', b'application/octet-stream')
-            body_producer = t_client.FileBodyProducer(io.BytesIO(payload))
             _LOGGER.debug('%s-ing[%d] %r to <%s>', req_method, request_count, payload, url_bytes.decode('utf_8'))
 
+            if self._compression is not None:
+                payload, compressed = self._compresspayload(payload)
+
+                if compressed:
+                    headers = headers.copy()
+                    headers.addRawHeader(b'Content-Encoding', self._compression.encode('ascii'))
+
+            if getattr(self._agent, 'accepts_bytes_body', False):
+                body_producer = payload
+            else:
+                body_producer = t_client.FileBodyProducer(io.BytesIO(payload))
+
         d = self._agent.request(req_method, url_bytes, headers, body_producer)
 
         if timeout is None:
@@ -834,6 +1841,34 @@ class PollingTransport(_BaseTransport):
             # _LOGGER.debug('response headers from request[%d]:', request_count)
             # _LOGGER.debug(pprint.pformat(list(response.headers.getAllRawHeaders())))
 
+            if packetreceived is not None \
+                    and response.code >= 200 \
+                    and response.code < 300:
+                # Dispatch each packet as soon as its octets arrive rather
+                # than waiting for (and buffering) the whole body
+                response.closing = False
+                response.packet_count = 0
+                _d = t_defer.Deferred(lambda _: protocol.abort())
+                if self.transport_context.protocol == EIO_PROTOCOL_3:
+                    # _parsepacket copies each binary packet's data (minus
+                    # its type) exactly once
+                    decoder = BinPayloadsDecoder(zerocopy=True)
+                else:
+                    decoder = RecordPayloadsDecoder()
+
+                protocol = _PayloadsProtocol(functools.partial(packetreceived, response), _d, decoder)
+                response.deliverBody(protocol)
+
+                def __decodefailed(failure):
+                    failure.trap(PayloadDecodeError)
+                    exc = failure.value
+
+                    raise type(exc)('unparseable response from request[{}]: {}'.format(request_count, exc), wrapped_exc=exc)
+
+                _d.addCallbacks(lambda _: response, __decodefailed)
+
+                return _d
+
             _d = t_client.readBody(response)
 
             def __bodyreceived(body):
@@ -850,7 +1885,7 @@ class PollingTransport(_BaseTransport):
 
         return d
 
-    def _shutitdown(self, passthru, lose_connection, stop_packets_loop=True):
+    def _shutitdown(self, passthru, lose_connection, stop_packets_loop=True, drain=False):
         try:
             self.state = TRANSPORT_STATE_DISCONNECTING
         except TransportStateError:
@@ -858,6 +1893,8 @@ class PollingTransport(_BaseTransport):
 
             return passthru
 
+        self._draining = drain
+
         def _trysendclose(passthru):
             if self.transport_context.session_id is None:
                 return t_defer.execute(lambda: passthru)
@@ -880,8 +1917,17 @@ class PollingTransport(_BaseTransport):
             d = t_defer.execute(lambda: passthru)
 
         def _cancelpendingrequests(passthru):
-            _dl = t_defer.DeferredList(self._pending_request_ds, consumeErrors=True)
-            _dl.cancel()
+            if self._send_call is not None:
+                self._send_call.cancel()
+                self._send_call = None
+
+            _dl = t_defer.DeferredList(list(self._pending_request_ds), consumeErrors=True)
+
+            if self._draining:
+                self._schedulesend()
+            else:
+                _dl.cancel()
+
             _dl.addBoth(lambda _: passthru)
 
             return _dl
@@ -889,7 +1935,10 @@ class PollingTransport(_BaseTransport):
         d.addBoth(_cancelpendingrequests)
 
         def _stopreceiveloop(passthru):
-            self._receiving_d.cancel()
+            if not self._draining:
+                self._receiving_d.cancel()
+
+            # The loop won't go around again now that we're disconnecting
             self._receiving_d.addBoth(lambda _: passthru)
 
             return self._receiving_d
@@ -898,6 +1947,15 @@ class PollingTransport(_BaseTransport):
             d.addBoth(_stopreceiveloop)
 
         def _stoppool(passthru):
+            if self._pool is None:
+                if self._agent_is_session:
+                    # Nobody else will use our session's connections
+                    self._agent.closeconnections()
+
+                # Otherwise, connections belong to the agent (which may be
+                # shared)
+                return passthru
+
             _d = self._pool.closeCachedConnections()
             _d.addErrback(txrc.logging.logerrback, log_lvl=logging.DEBUG, logger=_LOGGER, msg='Failure in shutting down pool:')
             _d.addBoth(lambda _: passthru)
@@ -907,6 +1965,8 @@ class PollingTransport(_BaseTransport):
         d.addBoth(_stoppool)
 
         def _finished(passthru):
+            self._draining = False
+
             if lose_connection:
                 self.transport_context.clear()
 
@@ -934,7 +1994,723 @@ class PollingTransport(_BaseTransport):
         d.addErrback(txrc.logging.logerrback, log_lvl=logging.DEBUG, logger=_LOGGER, msg='Failure raised when canceling pending connection:', handled=handled, suppress_msg_on_handled=False)
         d.addBoth(lambda _: passthru)
 
-        return d
+        return d
+
+# ========================================================================
+@interface.implementer(ITransport)
+class WebSocketTransport(_BaseTransport):
+    """
+    Implements :class:`ITransport` for the Engine.IO ``websocket``
+    protocol and dispatches received packets as events. Each packet is
+    sent and received as a single WebSocket frame over one long-lived
+    connection. This requires `Autobahn|Python
+    <https://autobahn.readthedocs.io/>`_.
+    """
+
+    # ---- Public inner classes ------------------------------------------
+
+    @interface.implementer(ITransportFactory)
+    class Factory(object):
+        """
+        A :class:`WebSocketTransport` factory.
+        """
+
+        # ---- Constructor -----------------------------------------------
+
+        def __init__(self, headers=None, endpoint_factory=None):
+            """
+            :param headers: passed to :meth:`WebSocketTransport.__init__`
+
+            :param endpoint_factory: passed to
+                :meth:`WebSocketTransport.__init__`
+            """
+            super().__init__()
+
+            kw = {
+                'headers': headers,
+                'endpoint_factory': endpoint_factory,
+            }
+
+            self.buildTransport = functools.partial(WebSocketTransport, **kw)
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, reactor, headers=None, endpoint_factory=None):
+        """
+        ``reactor`` is typically provided from
+        :meth:`ITransportFactory.buildTransport`.
+
+        If the :class:`TransportContext` passed to :meth:`connect` has no
+        session, a new one is opened over the WebSocket connection.
+        Otherwise, the connection is probed by exchanging ``ping``/``pong``
+        ``probe`` packets. Either way, :attr:`state` goes straight from
+        ``connecting`` to ``receiving``. After a successful probe, the
+        server keeps using the old transport until it receives an
+        ``upgrade`` packet, which the caller is expected to send (via
+        :meth:`sendpacket`) once it has quiesced the old transport (see
+        :meth:`EngineIo.start`).
+
+        :param headers: additional headers used for the opening handshake
+
+        :type headers: :class:`twisted.web.http_headers.Headers`
+
+        :param endpoint_factory: the factory used to create the endpoint
+            for the connection (defaults to a
+            :class:`~txsocketio.endpoint.ClientEndpointFactory`)
+
+        :type endpoint_factory: provider of
+            :class:`twisted.web.iweb.IAgentEndpointFactory`
+
+        :raises ImportError: if Autobahn|Python is not installed
+        """
+        if not _WEBSOCKET_SUPPORTED:
+            raise ImportError('{} requires autobahn (pip install txsocketio[websocket])'.format(self.__class__.__name__))
+
+        super().__init__()
+        self._reactor = reactor
+        self._headers = {}
+
+        if headers is not None:
+            for k, v in iteritems(headers):
+                self._headers[k.decode('latin_1')] = ', '.join(( i.decode('latin_1') for i in v ))
+
+        self._endpoint_factory = endpoint_factory if endpoint_factory is not None else ClientEndpointFactory(reactor)
+        self._protocol = None
+        self._open = False
+        self._connecting_d = None
+        self._closed_d = None
+        self._probing = False
+
+    # ---- Public properties ---------------------------------------------
+
+    default_timeout = 3
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connect(self, transport_context):
+        super().connect(transport_context)
+        self.state = TRANSPORT_STATE_CONNECTING
+        self._probing = self.transport_context.session_id is not None
+        self._closed_d = t_defer.Deferred()
+
+        query = {
+            b'EIO': self.transport_context.protocol,
+            b'transport': TRANSPORT_WEBSOCKETS.encode('ascii'),
+        }
+
+        if self._probing:
+            query[b'sid'] = self.transport_context.session_id
+
+        url_bytes = self.transport_context.base_url.replace(query=url_parse.urlencode(query).encode('ascii')).unsplit()
+        uri = t_client.URI.fromBytes(url_bytes)
+        endpoint = self._endpoint_factory.endpointForURI(uri)
+        uri.scheme = { b'http': b'ws', b'https': b'wss', b'unix': b'ws' }.get(uri.scheme, uri.scheme)
+        _LOGGER.debug('connecting to <%s>', uri.toBytes().decode('utf_8'))
+        factory = ab_websocket.WebSocketClientFactory(uri.toBytes().decode('ascii'), headers=self._headers, reactor=self._reactor)
+        # We enforce our own timeouts
+        factory.setProtocolOptions(openHandshakeTimeout=0, closeHandshakeTimeout=0)
+        factory.protocol = _WebSocketProtocol
+        factory.eio_transport = self
+
+        def _cancel(_):
+            if self._protocol is not None:
+                self._protocol.dropConnection(abort=True)
+            else:
+                connection_d.cancel()
+
+        connecting_d = self._connecting_d = t_defer.Deferred(_cancel)
+        connection_d = endpoint.connect(factory)
+
+        def _connectionmade(protocol):
+            self._protocol = protocol
+
+        def _connectionfailed(failure):
+            if not connecting_d.called:
+                connecting_d.errback(failure)
+
+        connection_d.addCallbacks(_connectionmade, _connectionfailed)
+
+        if self.transport_context.ping_timeout is not None:
+            timeout = self.transport_context.ping_timeout / 1000
+        else:
+            timeout = self.default_timeout
+
+        d = txrc.deferredtimeout(self._reactor, timeout, connecting_d)
+
+        def _done(passthru):
+            self._connecting_d = None
+
+            return passthru
+
+        d.addBoth(_done)
+        # A failed upgrade shouldn't take the session down with it
+        d.addErrback(self._shutitdown, lose_connection=not self._probing)
+
+        return d
+
+    def disconnect(self):
+        super().disconnect()
+
+        return self._shutitdown(None, lose_connection=True)
+
+    def sendpacket(self, packet_type, packet_data=''):
+        super().sendpacket(packet_type, packet_data)
+
+        return t_defer.execute(self._sendpacket, packet_type, packet_data)
+
+    def standby(self):
+        super().standby()
+
+        return self._shutitdown(None, lose_connection=False)
+
+    # ---- Private methods -----------------------------------------------
+
+    def _connectionclosed(self, was_clean, code, reason):
+        _LOGGER.debug('connection closed (clean: %s, code: %s, reason: %s)', was_clean, code, reason)
+        self._protocol = None
+        self._open = False
+
+        if self._connecting_d is not None:
+            self._connecting_d.errback(t_error.ConnectionLost('connection closed while connecting (code: {}, reason: {})'.format(code, reason)))
+        elif self.state in ( TRANSPORT_STATE_CONNECTED, TRANSPORT_STATE_RECEIVING ):
+            self._shutitdown(None, lose_connection=True)
+
+        if not self._closed_d.called:
+            self._closed_d.callback(None)
+
+    def _connectionopened(self):
+        self._open = True
+
+        if self._probing:
+            self._sendpacket(EIO_TYPE_PING, 'probe')
+
+    def _framereceived(self, payload, is_binary):
+        try:
+            if not is_binary:
+                packet_type, packet_data = deceiopacket(payload.decode('utf_8'))
+            elif self.transport_context.protocol == EIO_PROTOCOL_3:
+                packet_type, packet_data = _decbinpacket(payload)
+            else:
+                # Binary frames are always (untyped) message packets
+                packet_type, packet_data = EIO_TYPE_MESSAGE, bytes(payload)
+
+            self._parsepacket(packet_type, packet_data)
+        except Exception:  # pylint: disable=broad-except
+            failure = t_failure.Failure()
+
+            if self._connecting_d is not None:
+                self._connecting_d.errback(failure)
+            else:
+                txrc.logging.logerrback(failure, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when parsing packet:')
+                self._shutitdown(None, lose_connection=True)
+
+    def _parsepacket(self, packet_type, packet_data):
+        packet_name = EIO_TYPE_NAMES_BY_CODE[packet_type]
+        _LOGGER.debug('received packet ("%s")', packet_name)
+
+        if self.state == TRANSPORT_STATE_CONNECTING:
+            if self._probing:
+                if packet_type != EIO_TYPE_PONG \
+                        or packet_data != 'probe':
+                    raise TransportStateError('received "{}" packet while probing'.format(packet_name))
+
+                self._probing = False
+                self.state = TRANSPORT_STATE_RECEIVING
+                self._connecting_d.callback(None)
+
+                return
+
+            if packet_type != EIO_TYPE_OPEN:
+                raise TransportStateError('received "{}" packet before "open"'.format(packet_name))
+
+            data = jsonloads(packet_data)
+            self.transport_context.set(data['sid'], data['pingTimeout'], data['pingInterval'], data.get('upgrades', ()))
+            _LOGGER.debug('session "%s" opened', data['sid'])
+            self.state = TRANSPORT_STATE_RECEIVING
+            self._connecting_d.callback(None)
+        elif packet_type == EIO_TYPE_OPEN:
+            raise TransportStateError('received out-of-band "{}" packet'.format(packet_name))
+
+        if packet_type == EIO_TYPE_CLOSE:
+            _LOGGER.debug('session "%s" closed by server', self.transport_context.session_id)
+            self.transport_context.clear()
+            self._shutitdown(None, lose_connection=True)
+        elif packet_type in ( EIO_TYPE_MESSAGE, EIO_TYPE_PING, EIO_TYPE_PONG ):
+            self.dispatch(packet_name, packet_data)
+        else:
+            self.dispatch(packet_name)
+
+    def _sendpacket(self, packet_type, packet_data=''):
+        if not self._open:
+            raise TransportStateError('{} has no open connection'.format(self.__class__.__name__))
+
+        packet = enceiopacket(packet_type, packet_data)
+
+        if isinstance(packet, bytes):
+            if self.transport_context.protocol == EIO_PROTOCOL_3:
+                frame = _encbinpacket(packet)
+            elif packet_type == EIO_TYPE_MESSAGE:
+                frame = packet[1:]
+            else:
+                raise PayloadEncodeError('binary packet type {!r} is not {!r}'.format(packet_type, EIO_TYPE_MESSAGE))
+
+            self._protocol.sendMessage(frame, isBinary=True)
+        else:
+            self._protocol.sendMessage(packet.encode('utf_8'), isBinary=False)
+
+    def _shutitdown(self, passthru, lose_connection):
+        try:
+            self.state = TRANSPORT_STATE_DISCONNECTING
+        except TransportStateError:
+            # Someone else is working on this, so we're done
+            return passthru
+
+        protocol = self._protocol
+
+        if self._connecting_d is not None:
+            # This drops any connection
+            self._connecting_d.cancel()
+        elif self._open:
+            if lose_connection \
+                    and self.transport_context.session_id is not None:
+                try:
+                    self._sendpacket(EIO_TYPE_CLOSE)
+                except Exception:  # pylint: disable=broad-except
+                    _LOGGER.debug('unable to send close packet', exc_info=True)
+
+            protocol.sendClose(code=1000)
+
+        if protocol is not None:
+            # Don't wait forever for the server to close its end
+            d = txrc.deferredtimeout(self._reactor, self.default_timeout, self._closed_d)
+
+            def _abort(failure):
+                failure.trap(txrc.DeferredTimeoutError)
+                protocol.dropConnection(abort=True)
+
+            d.addErrback(_abort)
+        else:
+            d = t_defer.succeed(None)
+
+        def _finished(_):
+            if lose_connection:
+                self.transport_context.clear()
+
+            self.state = TRANSPORT_STATE_DISCONNECTED
+
+            if lose_connection:
+                self.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE])
+
+            return passthru
+
+        d.addBoth(_finished)
+
+        return d
+
+# ========================================================================
+class CompressionStats(object):
+    """
+    Counters for tuning :class:`PollingTransport` request body compression
+    (see its ``compression_threshold`` parameter). One instance may be
+    shared by many transports (e.g., via :class:`PollingTransport.Factory`).
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        #: The number of bodies sent compressed
+        self.compressed = 0
+        #: The number of bodies sent as-is because they were smaller than
+        #: the threshold
+        self.skipped = 0
+        #: The number of bodies sent as-is because compressing them didn't
+        #: make them any smaller
+        self.incompressible = 0
+        #: The total size (in octets) of compressed bodies before
+        #: compression
+        self.bytes_in = 0
+        #: The total size (in octets) of compressed bodies after
+        #: compression
+        self.bytes_out = 0
+        #: The CPU time (in seconds) spent compressing (including attempts
+        #: that didn't pay off)
+        self.cpu_time = 0.0
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def ratio(self):
+        """
+        The ratio of :attr:`bytes_out` to :attr:`bytes_in` (``1.0`` if
+        nothing has been compressed).
+        """
+        return self.bytes_out / self.bytes_in if self.bytes_in else 1.0
+
+# ========================================================================
+class HeartbeatWheel(object):
+    """
+    A hashed timer wheel for scheduling periodic work (e.g., ``ping``
+    packets) for many :class:`EngineIo` instances sharing a single
+    reactor, without arming a separate
+    :class:`~twisted.internet.interfaces.IDelayedCall` for each.
+
+    Scheduled calls are hashed into one of ``slots`` buckets by their
+    deadline (rounded up to a whole number of ``tick`` seconds). A single
+    :class:`~twisted.internet.task.LoopingCall` (running only while calls
+    are pending) advances the wheel one bucket per tick and fires all of
+    the calls due in that bucket as a batch. Calls therefore fire up to
+    one ``tick`` *before* their requested delay has elapsed, but never
+    after (unless the reactor is busy).
+
+    :param reactor: the reactor used for scheduling
+
+    :type reactor: provider of
+        :class:`twisted.internet.interfaces.IReactorTime`
+
+    :param Real tick: the resolution of the wheel, in seconds
+
+    :param Integral slots: the number of buckets in the wheel; delays
+        longer than ``tick * slots`` seconds are handled by going around
+        the wheel more than once
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, reactor=None, tick=0.5, slots=512):
+        if tick <= 0:
+            raise ValueError('tick must be positive, not {!r}'.format(tick))
+
+        if slots < 1:
+            raise ValueError('slots must be at least 1, not {!r}'.format(slots))
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self._reactor = reactor
+        self._tick = tick
+        # Each slot maps an entry's key to [ rounds, deferred ]
+        self._slots = [ collections.OrderedDict() for _ in range(slots) ]
+        self._cursor = 0
+        self._len = 0
+        self._next_key = 0
+        self._looping_call = None
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def tick(self):
+        return self._tick
+
+    # ---- Public methods ------------------------------------------------
+
+    def __len__(self):
+        return self._len
+
+    def schedule(self, delay, f, *args, **kw):
+        """
+        Calls ``f(*args, **kw)`` after (roughly) ``delay`` seconds, with
+        the same semantics as :func:`twisted.internet.task.deferLater`.
+
+        :param Real delay: the number of seconds to wait
+
+        :returns: a :class:`twisted.internet.defer.Deferred` whose
+            callback is fired with the result of calling ``f`` (canceling
+            it before then removes the call from the wheel)
+        """
+        ticks = max(1, int(math.ceil(delay / self._tick)))
+        slot_idx = (self._cursor + ticks) % len(self._slots)
+        rounds = (ticks - 1) // len(self._slots)
+        key = self._next_key
+        self._next_key += 1
+
+        def _cancel(_):
+            self._remove(slot_idx, key)
+
+        d = t_defer.Deferred(_cancel)
+        d.addCallback(lambda _: f(*args, **kw))
+        self._slots[slot_idx][key] = [ rounds, d ]
+        self._len += 1
+
+        if self._looping_call is None:
+            self._looping_call = t_task.LoopingCall.withCount(self._advance)
+            self._looping_call.clock = self._reactor
+            d_loop = self._looping_call.start(self._tick, now=False)
+            d_loop.addErrback(txrc.logging.logerrback, logger=_LOGGER, msg='Failure raised advancing heartbeat wheel:')
+
+        return d
+
+    # ---- Private methods -----------------------------------------------
+
+    def _advance(self, count):
+        for _ in range(count):
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            due = []
+
+            for key, entry in list(iteritems(slot)):
+                if entry[0] > 0:
+                    entry[0] -= 1
+                else:
+                    del slot[key]
+                    due.append(entry[1])
+
+            self._len -= len(due)
+
+            for d in due:
+                d.callback(None)
+
+        if not self._len \
+                and self._looping_call is not None:
+            looping_call, self._looping_call = self._looping_call, None
+            looping_call.stop()
+
+    def _remove(self, slot_idx, key):
+        if self._slots[slot_idx].pop(key, None) is not None:
+            self._len -= 1
+
+# ========================================================================
+class ReconnectPolicy(object):
+    """
+    Governs how :class:`EngineIo` re-establishes sessions that close
+    unexpectedly. Delays grow exponentially with each failed attempt up
+    to a cap, and are drawn uniformly between zero and that amount
+    ("full jitter"), so that many clients that lose their sessions at
+    the same time don't all come back at the same time.
+
+    :param Real base_delay: the upper bound, in seconds, of the delay
+        before the first attempt
+
+    :param Real max_delay: the cap, in seconds, on the upper bound of any
+        delay
+
+    :param Real factor: the amount by which the upper bound is multiplied
+        for each failed attempt
+
+    :param Integral max_attempts: the number of attempts after which to
+        give up, or `None` to keep trying indefinitely
+
+    :param callable rand: a function returning a random
+        :class:`float` in ``[0.0, 1.0)`` (defaults to
+        :func:`random.random`)
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, base_delay=0.5, max_delay=30, factor=2, max_attempts=None, rand=None):
+        if base_delay < 0 \
+                or max_delay < 0:
+            raise ValueError('delays must not be negative')
+
+        if factor < 1:
+            raise ValueError('factor must be at least 1, not {!r}'.format(factor))
+
+        if max_attempts is not None \
+                and max_attempts < 1:
+            raise ValueError('max_attempts must be at least 1, not {!r}'.format(max_attempts))
+
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._factor = factor
+        self._max_attempts = max_attempts
+        self._rand = random.random if rand is None else rand
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def max_attempts(self):
+        return self._max_attempts
+
+    # ---- Public methods ------------------------------------------------
+
+    def delay(self, attempt):
+        """
+        :param Integral attempt: the number of attempts that have already
+            failed
+
+        :returns: the number of seconds to wait before the next attempt
+        """
+        # Bound the exponent so huge attempt counts don't overflow
+        ceiling = self._max_delay
+
+        if attempt < 64:
+            ceiling = min(ceiling, self._base_delay * self._factor ** attempt)
+
+        return self._rand() * ceiling
+
+    def exhausted(self, attempt):
+        """
+        :param Integral attempt: the number of attempts that have already
+            failed
+
+        :returns: `True` if no more attempts are allowed
+        """
+        return self._max_attempts is not None \
+            and attempt >= self._max_attempts
+
+# ========================================================================
+class SharedConnectionPool(t_client.HTTPConnectionPool):
+    """
+    A :class:`twisted.web.client.HTTPConnectionPool` meant to be shared by
+    many :class:`PollingTransport` sessions (e.g., via
+    ``PollingTransport.Factory(pool=pool)``), so warm (e.g., TLS)
+    connections to the same server can be reused across sessions.
+
+    Each transport takes out a lease (see :meth:`lease`) rather than using
+    the pool directly. Leases leave :attr:`maxPersistentPerHost` alone,
+    and closing a lease (which a transport does when it shuts down) only
+    releases it, leaving idle connections for other sessions. Checkouts
+    through a lease prefer the idle connection that lease last used, if
+    it is still available. Call :meth:`closeCachedConnections` on the pool
+    itself when no session needs it anymore.
+
+    :param reactor: passed to
+        :class:`~twisted.web.client.HTTPConnectionPool`
+
+    :param bool persistent: passed to
+        :class:`~twisted.web.client.HTTPConnectionPool`
+
+    :param Integral max_persistent_per_host: the maximum number of idle
+        connections kept per server
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, reactor, persistent=True, max_persistent_per_host=32):
+        super().__init__(reactor, persistent)
+        self.maxPersistentPerHost = max_persistent_per_host
+        self.retryAutomatically = True
+        self._checkouts = 0
+        self._reused = 0
+        self._leases = 0
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def checkouts(self):
+        """
+        The number of connections checked out (new or reused).
+        """
+        return self._checkouts
+
+    @property
+    def idle(self):
+        """
+        The number of idle connections in the pool.
+        """
+        return sum(( len(connections) for connections in itervalues(self._connections) ))
+
+    @property
+    def leases(self):
+        """
+        The number of open leases.
+        """
+        return self._leases
+
+    @property
+    def reuse_rate(self):
+        """
+        The fraction of checkouts satisfied by idle connections (``0.0``
+        if there have been none).
+        """
+        return self._reused / self._checkouts if self._checkouts else 0.0
+
+    @property
+    def reused(self):
+        """
+        The number of checkouts satisfied by idle connections.
+        """
+        return self._reused
+
+    # ---- Public hooks --------------------------------------------------
+
+    def getConnection(self, key, endpoint):  # noqa: N802 # pylint: disable=invalid-name
+        self._checkouts += 1
+
+        if any(( connection.state == 'QUIESCENT' for connection in self._connections.get(key, ()) )):
+            self._reused += 1
+
+        return super().getConnection(key, endpoint)
+
+    # ---- Public methods ------------------------------------------------
+
+    def lease(self):
+        """
+        :returns: an object to be passed as the ``pool`` to a single
+            :class:`twisted.web.client.Agent` (which :class:`PollingTransport`
+            does for itself if it is given this pool)
+        """
+        self._acquire()
+
+        return _PoolLease(self)
+
+    # ---- Private methods -----------------------------------------------
+
+    def _acquire(self):
+        self._leases += 1
+
+    def _checkout(self, lease, key, endpoint):
+        preferred = lease.affinity.get(key)
+        connections = self._connections.get(key)
+
+        if preferred is not None \
+                and connections \
+                and preferred in connections:
+            connections.remove(preferred)
+            connections.insert(0, preferred)
+
+        reused = self._reused
+        d = self.getConnection(key, endpoint)
+        lease.checkouts += 1
+        lease.reused += self._reused - reused
+
+        def _checkedout(connection):
+            # Unwrap any _RetryingHTTP11ClientProtocol
+            lease.affinity[key] = getattr(connection, '_clientProtocol', connection)
+
+            return connection
+
+        d.addCallback(_checkedout)
+
+        return d
+
+    def _release(self, lease):
+        lease.affinity.clear()
+        self._leases -= 1
+
+# ========================================================================
+class _PoolLease(object):
+    """
+    One session's handle on a :class:`SharedConnectionPool`.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, pool):
+        self.affinity = {}
+        self.checkouts = 0
+        self.reused = 0
+        self._pool = pool
+        self._released = False
+
+    # ---- Public hooks --------------------------------------------------
+
+    def closeCachedConnections(self):  # noqa: N802 # pylint: disable=invalid-name
+        """
+        Releases the lease without closing any connections.
+        """
+        if not self._released:
+            self._released = True
+            self._pool._release(self)  # pylint: disable=protected-access
+
+        return t_defer.succeed(None)
+
+    def getConnection(self, key, endpoint):  # noqa: N802 # pylint: disable=invalid-name
+        if self._released:
+            # The session is being reused (e.g., after reconnecting)
+            self._released = False
+            self._pool._acquire()  # pylint: disable=protected-access
+
+        return self._pool._checkout(self, key, endpoint)  # pylint: disable=protected-access
 
 # ========================================================================
 class EngineIo(Dispatcher):
@@ -956,7 +2732,8 @@ class EngineIo(Dispatcher):
 
     :param DictType transport_factories: a mapping of transport names to
         :class:`ITransportFactory` providers; if provided, this must
-        provide at least one entry for `TRANSPORT_POLLING`
+        provide at least one entry for `TRANSPORT_POLLING` (unless
+        ``direct_transport`` is also provided)
 
     :param reactor: the reactor used for scheduling, making connections,
         etc.
@@ -967,11 +2744,64 @@ class EngineIo(Dispatcher):
         :class:`twisted.internet.interfaces.IReactorSocket`,
         :class:`twisted.internet.interfaces.IReactorTCP`, and
         :class:`twisted.internet.interfaces.IReactorUNIX` (as necessary)
+
+    :param str direct_transport: if provided, the name of a transport from
+        ``transport_factories`` (e.g., `TRANSPORT_WEBSOCKETS`) over which
+        to open sessions directly, skipping the ``polling`` handshake;
+        ``polling`` (if available) is only used if that fails
+
+    :param Integral protocol: the Engine.IO protocol version to speak,
+        one of :const:`EIO_PROTOCOL_3` (where the client sends ``ping``
+        packets every ``pingInterval`` milliseconds) or
+        :const:`EIO_PROTOCOL_4` (where the server sends them and the
+        client only answers)
+
+    :param HeartbeatWheel heartbeat: if provided, ``ping`` packets (and
+        liveness deadlines) are scheduled on this (usually shared) wheel
+        rather than with separate delayed calls for each connection
+
+    :param ReconnectPolicy reconnect: if provided, sessions that close
+        for any reason other than a call to :meth:`stop` are
+        re-established (from scratch) according to this policy
+
+    The server is presumed dead if (under :const:`EIO_PROTOCOL_3`) a
+    ``pong`` does not arrive within ``pingTimeout`` milliseconds of
+    sending a ``ping``, or if (under :const:`EIO_PROTOCOL_4`) a ``ping``
+    does not arrive within ``pingInterval + pingTimeout`` milliseconds of
+    the last one. In that case, the underlying transport is torn down
+    without trying to say goodbye, :attr:`close_reason` is set to a
+    :exc:`PingTimeoutError`, and a ``close`` event is dispatched as
+    usual.
+
+    :param Integral max_buffered_packets: the maximum number of packets
+        to hold while there is no transport over which to send them (see
+        :meth:`sendeiopacket`), or `None` for no limit
+
+    :param Integral max_buffered_bytes: the maximum total size of the
+        data of packets held, or `None` for no limit
+
+    :param str buffer_overflow: what to do with a packet that would
+        exceed either limit, one of :const:`BUFFER_DROP_OLDEST` (make
+        room by dropping the oldest held packets), :const:`BUFFER_DROP_NEWEST`
+        (drop the packet), or :const:`BUFFER_BLOCK` (have the packet
+        wait, outside the limits, until it fits or everything held is
+        sent; callers should hold off while :attr:`buffer_full` is
+        `True`); the :class:`~twisted.internet.defer.Deferred` for a
+        dropped packet fires its errback with a
+        :exc:`BufferOverflowError`, as does that for a packet that could
+        never fit; a Socket.IO binary packet and its attachments are
+        held, dropped, or sent together
+
+    When reconnecting, a ``reconnect`` event is dispatched with the
+    number of the successful attempt once the new session is receiving
+    packets. If ``reconnect.max_attempts`` are exhausted, a
+    ``reconnect_failed`` event is dispatched with the number of attempts
+    instead.
     """
 
     # ---- Constructor ---------------------------------------------------
 
-    def __init__(self, base_url, transport_factories=None, reactor=None):
+    def __init__(self, base_url, transport_factories=None, reactor=None, direct_transport=None, protocol=EIO_PROTOCOL, heartbeat=None, reconnect=None, max_buffered_packets=None, max_buffered_bytes=None, buffer_overflow=BUFFER_DROP_OLDEST):
         super().__init__()
 
         if isinstance(base_url, t_client.URI):
@@ -986,26 +2816,55 @@ class EngineIo(Dispatcher):
         else:
             raise TypeError('base_url type must be one of bytes, str, URI, URLPath, not {}'.format(type(base_url).__name__))
 
-        self._transport_context = TransportContext(base_url)
+        self._transport_context = TransportContext(base_url, protocol)
 
         if reactor is None:
             from twisted.internet import reactor
 
         self._reactor = reactor
 
-        self._transport_factories = transport_factories if transport_factories is not None else {
-            TRANSPORT_POLLING: PollingTransport.Factory(),
-        }
+        if transport_factories is None:
+            transport_factories = {
+                TRANSPORT_POLLING: PollingTransport.Factory(),
+            }
+
+            if _WEBSOCKET_SUPPORTED:
+                transport_factories[TRANSPORT_WEBSOCKETS] = WebSocketTransport.Factory()
+
+        self._transport_factories = transport_factories
 
         for k, v in iteritems(self._transport_factories):
             if not ITransportFactory.providedBy(v):
                 raise TypeError('transport_factories["{}"] must provide ITransportFactory'.format(k))
 
-        if TRANSPORT_POLLING not in self._transport_factories:
-            raise ValueError('transport_factories missing entry for "{}"'.format(TRANSPORT_POLLING))
+        if direct_transport is None:
+            if TRANSPORT_POLLING not in self._transport_factories:
+                raise ValueError('transport_factories missing entry for "{}"'.format(TRANSPORT_POLLING))
+        elif direct_transport not in self._transport_factories:
+            raise ValueError('transport_factories missing entry for "{}"'.format(direct_transport))
+
+        self._direct_transport = direct_transport
+        self._heartbeat = heartbeat
+        self._reconnect_policy = reconnect
+
+        if buffer_overflow not in _BUFFER_OVERFLOWS:
+            raise ValueError('buffer_overflow must be one of: {}'.format(', '.join(( repr(i) for i in _BUFFER_OVERFLOWS ))))
+
+        self._send_buffer_args = ( max_buffered_packets, max_buffered_bytes, buffer_overflow )
 
         self._transport = None
-        self._tmp_event_queue = collections.deque()
+        self._upgrade_d = None
+        # While not None, outbound packets are held here until a
+        # transport (e.g., an upgraded or reconnected one) takes over
+        self._send_buffer = None
+        self._close_reason = None
+        self._session_open = False
+        self._stopping = False
+        self._reconnect_call = None
+        self._reconnect_attempt = None
+        self._liveness_d = None
+        self._ping_sent_at = None
+        self._rtt = None
         self._pingloop_d = t_defer.Deferred()
         # Suppress any :exc:``twisted.internet.defer.CancelledError`` in
         # case we try to cancel it before we start the loop
@@ -1013,10 +2872,82 @@ class EngineIo(Dispatcher):
 
     # ---- Public properties ---------------------------------------------
 
+    @property
+    def close_reason(self):
+        """
+        The exception (e.g., a :exc:`PingTimeoutError`) that caused the
+        most recent session to be torn down, or `None` if it wasn't
+        (e.g., it was closed by :meth:`stop` or by the server).
+        """
+        return self._close_reason
+
+    @property
+    def rtt(self):
+        """
+        The most recently measured ``ping``/``pong`` round trip time in
+        seconds, or `None` if none has been measured (which is always the
+        case under :const:`EIO_PROTOCOL_4`, where the server sends the
+        ``ping`` packets).
+        """
+        return self._rtt
+
+    @property
+    def reconnecting(self):
+        """
+        Whether a reconnection attempt is pending or in progress.
+        """
+        return self._reconnect_call is not None \
+            or self._reconnect_attempt is not None
+
+    @property
+    def buffered(self):
+        """
+        The number of outbound packets being held until a transport is
+        available.
+        """
+        return 0 if self._send_buffer is None else len(self._send_buffer)
+
+    @property
+    def buffer_full(self):
+        """
+        Whether outbound packets sent now would exceed
+        ``max_buffered_packets`` or ``max_buffered_bytes`` (see
+        :class:`EngineIo`), and so wait or displace (or be dropped in
+        favor of) those already held. Producers that don't want to lose
+        packets should wait for the
+        :class:`~twisted.internet.defer.Deferred` objects of those already
+        sent while this is `True`.
+        """
+        return self._send_buffer is not None \
+            and self._send_buffer.full
+
     @property
     def running(self):
         return self._transport is not None \
-            and self._transport.state == TRANSPORT_STATE_RECEIVING
+            and (self._transport.state == TRANSPORT_STATE_RECEIVING
+                or (self._upgrade_d is not None
+                    and self._send_buffer is not None))
+
+    @property
+    def send_queue_depths(self):
+        """
+        The :attr:`~ITransport.queue_depths` of the underlying
+        :class:`ITransport` provider (all zeros if there isn't one).
+        Packets held while there is no transport are counted by
+        :attr:`buffered` instead.
+        """
+        if self._transport is None:
+            return dict.fromkeys(_SEND_LANES, 0)
+
+        return self._transport.queue_depths
+
+    @property
+    def upgrading(self):
+        """
+        Whether an upgrade of the underlying :class:`ITransport` provider
+        is in progress.
+        """
+        return self._upgrade_d is not None
 
     # ---- Public methods ------------------------------------------------
 
@@ -1024,8 +2955,18 @@ class EngineIo(Dispatcher):
         """
         Sends an Engine.IO packet using the underlying :class:`ITransport`
         provider with the same semantics as with
-        :meth:`ITransport.sendpacket`.
+        :meth:`ITransport.sendpacket`. While a session is being opened
+        (including when reconnecting) or switching to an upgraded
+        transport, packets are held (subject to ``max_buffered_packets``,
+        ``max_buffered_bytes``, and ``buffer_overflow``; see
+        :class:`EngineIo`) and sent in order, all at once, when a
+        transport is ready. (With a coalescing ``polling`` transport, that
+        means in a single request.) If the session can't be opened (and
+        won't be retried), their errbacks are fired instead.
         """
+        if self._send_buffer is not None:
+            return self._send_buffer.append(( ( packet_type, packet_data ), ))[0]
+
         if self._transport is None:
             raise TransportStateError('no transport')
 
@@ -1033,80 +2974,177 @@ class EngineIo(Dispatcher):
 
     def start(self):
         """
-        Starts (and possibly upgrades) the underlying :class:`ITransport`
-        provider.
+        Starts the underlying ``polling`` :class:`ITransport` provider
+        and, if the server offers an upgrade for which there is a
+        factory, probes the upgraded transport in the background. If a
+        ``direct_transport`` was provided, the session is first opened
+        over that instead, falling back to ``polling`` (if available) on
+        failure.
+
+        Packets keep flowing over ``polling`` until the probe succeeds.
+        Then ``polling`` is allowed to finish any in-flight requests
+        (rather than having them canceled), the ``upgrade`` packet is
+        sent, and any packets sent in the meantime are flushed (in order)
+        over the upgraded transport, after which an ``upgrade`` event is
+        dispatched. If the probe fails, ``polling`` just carries on.
+
+        :returns: a :class:`twisted.internet.defer.Deferred` whose
+            callback is fired with `None` once packets are being received
+            (i.e., without waiting for any upgrade), or whose errback is
+            fired if the connection could not be established
+        """
+        if self._transport is not None \
+                or self.reconnecting:
+            raise TransportStateError('already started')
+
+        self._stopping = False
+        self._send_buffer = self._newsendbuffer()
+        d = self._startsession()
+        d.addCallbacks(lambda _: self._flushsendbuffer(), self._flushsendbuffer)
+
+        return d
+
+    def stop(self):
+        """
+        Disconnects the underlying :class:`ITransport` provider, first
+        abandoning any upgrade in progress. Any pending reconnection
+        attempt is also abandoned, and no more are made.
 
-        :returns: a :class:`twisted.internet.defer.Deferred` akin to the
-            return value from the :meth:`~ITransport.connect` method of
-            the underlying :class:`ITransport` provider
+        :returns: a :class:`twisted.internet.defer.Deferred` from the
+            :meth:`~ITransport.disconnect` method of the underlying
+            :class:`ITransport` provider
         """
-        if self._transport is not None:
+        if self._reconnect_call is not None:
+            self._reconnect_call.cancel()
+            self._reconnect_call = None
+            self._stopping = True
+            self._flushsendbuffer(t_failure.Failure(TransportStateError('stopped while reconnecting')))
+
+            return t_defer.succeed(None)
+
+        if self._transport is None:
             raise TransportStateError('no transport')
 
-        transport_factory = self._transport_factories[TRANSPORT_POLLING]
-        self._transport = transport_factory.buildTransport(self._reactor)
-        self._registerstarttransport(self._transport)
-        d = self._transport.connect(self._transport_context)
+        self._stopping = True
 
-        def _startconnected(_):
-            _d = self._transport.standby()
+        return self._teardown()
 
-            def __upgradetransport(_):
-                self._unregisterstarttransport(self._transport)
-                upgrades = [ t for t in self._transport_context.upgrades if t in self._transport_factories ]
+    # ---- Private methods -----------------------------------------------
+
+    def _armliveness(self, timeout):
+        if self._liveness_d is not None:
+            return
 
-                if upgrades:
-                    transport_factory = self._transport_factories[upgrades[0]]
-                    self._transport = transport_factory.buildTransport(self._reactor)
+        self._liveness_d = self._schedule(timeout, self._livenessexpired, timeout)
+        self._liveness_d.addErrback(lambda failure: failure.trap(t_defer.CancelledError))
 
-                self._registertransport(self._transport)
+    def _disarmliveness(self):
+        self._ping_sent_at = None
 
-                return self._transport.connect(self._transport_context)
+        if self._liveness_d is not None:
+            d, self._liveness_d = self._liveness_d, None
+            d.cancel()
 
-            _d.addCallback(__upgradetransport)
+    def _flushsendbuffer(self, failure=None, send_buffer=None):
+        if send_buffer is None:
+            send_buffer, self._send_buffer = self._send_buffer, None
 
-            return _d
+        if send_buffer is None:
+            return failure
 
-        d.addCallback(_startconnected)
+        for packet_type, packet_data, d in send_buffer.drain():
+            if failure is not None:
+                d.errback(failure)
+            else:
+                t_defer.maybeDeferred(self.sendeiopacket, packet_type, packet_data).chainDeferred(d)
+
+        return failure
+
+    def _startsession(self):
+        self._close_reason = None
+
+        if self._direct_transport is not None:
+            d = self._startdirect()
+        else:
+            d = self._startpolling()
 
-        def _cleanup(passthru):
-            self._dispatchqueuedevents()
+        def _started(passthru):
+            self._session_open = True
 
             return passthru
 
-        d.addBoth(_cleanup)
+        d.addCallback(_started)
 
         return d
 
-    def stop(self):
-        """
-        Disconnects the underlying :class:`ITransport` provider.
+    def _startdirect(self):
+        transport_factory = self._transport_factories[self._direct_transport]
+        transport = self._transport = transport_factory.buildTransport(self._reactor)
+        self._registertransport(transport)
+        # A failed attempt doesn't close the session if we can fall back
+        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclose)
+        _LOGGER.debug('connecting directly over %s transport', self._direct_transport)
+        d = transport.connect(self._transport_context)
 
-        :returns: a :class:`twisted.internet.defer.Deferred` from the
-            :meth:`~ITransport.disconnect` method of the underlying
-            :class:`ITransport` provider
-        """
-        if self._transport is None:
-            raise TransportStateError('no transport')
+        def _connected(_):
+            transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclose)
+            self._pingloop()
 
-        return self._transport.disconnect()
+        def _connectfailed(failure):
+            self._unregistertransport(transport)
+            self._transport = None
 
-    # ---- Private methods -----------------------------------------------
+            if TRANSPORT_POLLING not in self._transport_factories:
+                return failure
 
-    def _dispatchqueuedevents(self):
-        while self._tmp_event_queue:
-            event, args, kw = self._tmp_event_queue.popleft()
-            if self._transport is not None:
-                _LOGGER.debug('dispatching queued %s event to transport', event)
-                self._transport.dispatch(event, *args, **kw)
-            else:
-                _LOGGER.debug('dropping queued %s event', event)
+            handled = ( t_defer.CancelledError, t_error.ConnectError, t_error.ConnectionLost, txrc.DeferredTimeoutError )
+            txrc.logging.logerrback(failure, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when connecting directly over {} transport (falling back to {}):'.format(self._direct_transport, TRANSPORT_POLLING), handled=handled, suppress_msg_on_handled=False)
+            self._transport_context.clear()
+
+            return self._startpolling()
+
+        d.addCallbacks(_connected, _connectfailed)
+
+        return d
+
+    def _startpolling(self):
+        transport_factory = self._transport_factories[TRANSPORT_POLLING]
+        self._transport = transport_factory.buildTransport(self._reactor)
+        self._registertransport(self._transport)
+        d = self._transport.connect(self._transport_context)
+
+        def _connected(_):
+            transport = self._transport
+
+            if transport.state == TRANSPORT_STATE_CONNECTED:
+                transport.startreceiving()
+
+            self._pingloop()
+            self._upgradetransport(transport)
+
+        d.addCallback(_connected)
+
+        return d
 
     @t_defer.inlineCallbacks
     def _handleclose(self, event):
         _LOGGER.debug('received %s event from transport', event)
         self._unregistertransport(self._transport)
         self._transport = None
+        was_open, self._session_open = self._session_open, False
+        self._disarmliveness()
+        reconnect = was_open \
+            and not self._stopping \
+            and self._reconnect_policy is not None
+
+        if reconnect:
+            # Hold anything sent until we're back
+            if self._send_buffer is None:
+                self._send_buffer = self._newsendbuffer()
+        elif self._reconnect_attempt is None \
+                or self._stopping:
+            self._flushsendbuffer(t_failure.Failure(t_error.ConnectionDone('session closed')))
+
         self._pingloop_d.cancel()
 
         try:
@@ -1121,22 +3159,53 @@ class EngineIo(Dispatcher):
 
         self.dispatch(event)
 
-    def _handleclosestart(self, event):
-        _LOGGER.debug('received %s event from transport', event)
-        self._unregisterstarttransport(self._transport)
-        self._transport = None
-        self._queueevent(event)
+        if reconnect:
+            self._schedulereconnect(0)
 
     def _handleopen(self, event):
         _LOGGER.debug('received %s event from transport', event)
-        self._pingloop()
         self.dispatch(event)
 
     def _handleping(self, event, payload):
         _LOGGER.debug('received %s => %r event from transport', event, payload)
+
+        if self._transport_context.protocol == EIO_PROTOCOL_4:
+            self._disarmliveness()
+            self._armliveness((self._transport_context.ping_interval + self._transport_context.ping_timeout) / 1000)
+
         self.sendeiopacket(EIO_TYPE_PONG, '')
         self.dispatch(event, payload)
 
+    def _handlepong(self, event, payload):
+        _LOGGER.debug('received %s => %r event from transport', event, payload)
+
+        if self._ping_sent_at is not None:
+            self._rtt = self._reactor.seconds() - self._ping_sent_at
+            _LOGGER.debug('ping round trip time: %f', self._rtt)
+
+        self._disarmliveness()
+        self.dispatch(event, payload)
+
+    def _livenessexpired(self, timeout):
+        self._liveness_d = None
+        self._ping_sent_at = None
+        transport = self._transport
+
+        if transport is None \
+                or transport.state not in ( TRANSPORT_STATE_CONNECTED, TRANSPORT_STATE_RECEIVING ):
+            return
+
+        awaited = EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG if self._transport_context.protocol == EIO_PROTOCOL_3 else EIO_TYPE_PING]
+        self._close_reason = PingTimeoutError('no {} received within {} seconds'.format(awaited, timeout))
+        _LOGGER.warning('%s; closing transport', self._close_reason)
+        # Don't wait on a dead server to acknowledge a close packet
+        self._transport_context.clear()
+        d = self._teardown()
+        d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when closing unresponsive transport:', handled=( t_defer.CancelledError, TransportStateError ))
+
+    def _newsendbuffer(self):
+        return _SendBuffer(*self._send_buffer_args)
+
     def _onerror(self, event, exception):
         _LOGGER.debug('received %s event from transport', event)
         _LOGGER.debug(exception)
@@ -1154,12 +3223,18 @@ class EngineIo(Dispatcher):
         _LOGGER.debug('received %s event from transport', event)
         self.dispatch(event)
 
-    def _queueevent(self, event, *args, **kw):
-        _LOGGER.debug('queuing %s event from transport', event)
-        self._tmp_event_queue.append(( event, args, kw ))
-
     def _pingloop(self):
+        if self._transport_context.protocol != EIO_PROTOCOL_3:
+            # The server pings us (see _handleping)
+            self._armliveness((self._transport_context.ping_interval + self._transport_context.ping_timeout) / 1000)
+
+            return
+
         def _sendping():
+            if self._liveness_d is None:
+                self._ping_sent_at = self._reactor.seconds()
+                self._armliveness(self._transport_context.ping_timeout / 1000)
+
             _d = self.sendeiopacket(EIO_TYPE_PING, 'probe')
             _d.addCallback(_loop)
             handled = ( t_defer.CancelledError, t_client.ResponseFailed, ReceivedClosePacket, UnknownSessionIdError )
@@ -1173,20 +3248,38 @@ class EngineIo(Dispatcher):
 
                 return
 
-            self._pingloop_d = t_task.deferLater(self._reactor, self._transport_context.ping_interval / 1000, _sendping)
+            interval = self._transport_context.ping_interval / 1000
+
+            self._pingloop_d = self._schedule(interval, _sendping)
 
             return passthru
 
         _loop()
 
-    def _registerstarttransport(self, transport):
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclosestart)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_OPEN], self._queueevent)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], self._queueevent)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_NOOP], self._queueevent)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PING], self._queueevent)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._queueevent)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_UPGRADE], self._queueevent)
+    def _reconnect(self, attempt):
+        self._reconnect_call = None
+        self._reconnect_attempt = attempt
+        _LOGGER.debug('reconnecting (attempt %d)', attempt)
+        d = self._startsession()
+
+        def _reconnected(_):
+            self._reconnect_attempt = None
+            _LOGGER.info('reconnected after %d attempt(s)', attempt)
+            # Anything sent from reconnect handlers (e.g., to rejoin
+            # namespaces) goes ahead of what was held in the meantime
+            send_buffer, self._send_buffer = self._send_buffer, None
+            self.dispatch('reconnect', attempt)
+            self._flushsendbuffer(send_buffer=send_buffer)
+
+        def _reconnectfailed(failure):
+            handled = ( t_defer.CancelledError, t_error.ConnectError, t_error.ConnectionLost, t_client.ResponseFailed, txrc.DeferredTimeoutError, EngineIoServerError )
+            txrc.logging.logerrback(failure, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when reconnecting (attempt {}):'.format(attempt), handled=handled, suppress_msg_on_handled=False)
+            self._reconnect_attempt = None
+
+            if not self._stopping:
+                self._schedulereconnect(attempt)
+
+        d.addCallbacks(_reconnected, _reconnectfailed)
 
     def _registertransport(self, transport):
         transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclose)
@@ -1194,17 +3287,115 @@ class EngineIo(Dispatcher):
         transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], self._onpayload)
         transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_NOOP], self._onnopayload)
         transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PING], self._handleping)
-        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._onpayload)
+        transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._handlepong)
         transport.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_UPGRADE], self._onnopayload)
 
-    def _unregisterstarttransport(self, transport):
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclosestart)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_OPEN], self._queueevent)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], self._queueevent)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_NOOP], self._queueevent)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PING], self._queueevent)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._queueevent)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_UPGRADE], self._queueevent)
+    def _schedulereconnect(self, attempt):
+        if self._reconnect_policy.exhausted(attempt):
+            _LOGGER.warning('giving up reconnecting after %d attempt(s)', attempt)
+            self._flushsendbuffer(t_failure.Failure(TransportStateError('gave up reconnecting after {} attempt(s)'.format(attempt))))
+            self.dispatch('reconnect_failed', attempt)
+
+            return
+
+        delay = self._reconnect_policy.delay(attempt)
+        _LOGGER.debug('reconnecting in %f seconds', delay)
+        self._reconnect_call = self._reactor.callLater(delay, self._reconnect, attempt + 1)
+
+    def _schedule(self, delay, f, *args):
+        if self._heartbeat is not None:
+            return self._heartbeat.schedule(delay, f, *args)
+
+        return t_task.deferLater(self._reactor, delay, f, *args)
+
+    def _sendeiopackets(self, packets):
+        # Like sendeiopacket, but for ( packet_type, packet_data ) tuples
+        # that must be held (or dropped) together; returns a list of
+        # Deferreds
+        if self._send_buffer is not None:
+            return self._send_buffer.append(packets)
+
+        return [ self.sendeiopacket(packet_type, packet_data) for packet_type, packet_data in packets ]
+
+    def _upgradetransport(self, transport):
+        upgrades = [ t for t in self._transport_context.upgrades or () if t != TRANSPORT_POLLING and t in self._transport_factories ]
+
+        if not upgrades:
+            return
+
+        transport_factory = self._transport_factories[upgrades[0]]
+        upgraded = transport_factory.buildTransport(self._reactor)
+        _LOGGER.debug('probing %s transport', upgrades[0])
+        d = self._upgrade_d = upgraded.connect(self._transport_context)
+
+        def _probed(_):
+            if self._transport is not transport:
+                raise TransportStateError('session closed while probing')
+
+            # Hold outbound packets while the old transport winds down;
+            # anything it has already retrieved (or is retrieving) is
+            # still dispatched
+            self._send_buffer = self._newsendbuffer()
+            _d = transport.standby(drain=True)
+            handled = ( t_defer.CancelledError, t_client.ResponseFailed )
+            _d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when draining transport:', handled=handled)
+
+            return _d
+
+        d.addCallback(_probed)
+
+        def _switch(_):
+            if upgraded.state != TRANSPORT_STATE_RECEIVING:
+                raise TransportStateError('upgraded transport lost while switching')
+
+            self._unregistertransport(transport)
+            self._transport = upgraded
+            self._registertransport(upgraded)
+            _d = upgraded.sendpacket(EIO_TYPE_UPGRADE)
+            _d.addErrback(txrc.logging.logerrback, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when sending upgrade packet:')
+            self._flushsendbuffer()
+            _LOGGER.debug('upgraded to %s transport', upgrades[0])
+            self.dispatch(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_UPGRADE])
+
+        d.addCallback(_switch)
+
+        def _upgradefailed(failure):
+            handled = ( t_defer.CancelledError, TransportStateError, txrc.DeferredTimeoutError )
+            txrc.logging.logerrback(failure, log_lvl=logging.WARNING, logger=_LOGGER, msg='Failure raised when upgrading transport:', handled=handled)
+
+            if upgraded.state in ( TRANSPORT_STATE_CONNECTED, TRANSPORT_STATE_RECEIVING ):
+                upgraded.standby()
+
+            if self._transport is not transport:
+                # The session closed out from under us (and any held
+                # packets were dealt with then)
+                pass
+            elif transport.state == TRANSPORT_STATE_RECEIVING:
+                self._flushsendbuffer()
+            else:
+                # We've already let go of the old transport
+                self._transport_context.clear()
+
+                return self._handleclose(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE])
+
+        d.addErrback(_upgradefailed)
+
+        def _done(_):
+            self._upgrade_d = None
+
+        d.addBoth(_done)
+
+    def _teardown(self):
+        self._disarmliveness()
+
+        if self._upgrade_d is not None:
+            d = self._upgrade_d
+            d.cancel()
+            d.addCallback(lambda _: self._transport.disconnect() if self._transport is not None else None)
+
+            return d
+
+        return self._transport.disconnect()
 
     def _unregistertransport(self, transport):
         transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._handleclose)
@@ -1212,13 +3403,13 @@ class EngineIo(Dispatcher):
         transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], self._onpayload)
         transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_NOOP], self._onnopayload)
         transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PING], self._handleping)
-        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._onpayload)
+        transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_PONG], self._handlepong)
         transport.unregister(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_UPGRADE], self._onnopayload)
 
 # ---- Functions ---------------------------------------------------------
 
 # ========================================================================
-def decbinpayloadsgen(raw):
+def decbinpayloadsgen(raw, zerocopy=False):
     """
     Decodes a binary Engine.IO message containing zero or more payloads
     and yields their respective packets. String packets are returned as
@@ -1227,59 +3418,48 @@ def decbinpayloadsgen(raw):
     either as :class:`~future.types.newbytes.newbytes` in Python 2 or
     :class:`bytes` in Python 3.
 
+    If ``zerocopy`` is `True`, ``raw`` is never copied. String packets
+    are decoded directly from the underlying buffer, and binary packets
+    are returned as :class:`memoryview` slices of ``raw`` that are only
+    copied if the caller materializes them (e.g., via
+    :meth:`memoryview.tobytes`). Note that holding on to any such slice
+    keeps all of ``raw`` alive.
+
     :param bytes raw: the raw Engine.IO message containing zero or more
         payloads
 
+    :param bool zerocopy: if `True`, yield :class:`memoryview` slices
+        rather than copies for binary packets
+
     :returns: a :class:`generator` that yeilds each packet
 
     :raises: :exc:`PayloadDecodeError` if there was a problem decoding
         `raw`
     """
-    raw = bytes(raw)
+    if zerocopy:
+        view = memoryview(raw)
+    else:
+        raw = view = bytes(raw)
+
     pos = 0
 
     while True:
-        try:
-            payload_type = raw[pos]
-        except IndexError:
-            return
-
-        if payload_type not in _PAYLOAD_TYPES:
-            raise PayloadDecodeError('unrecognized payload type {} at {}'.format(payload_type, pos))
-
-        pos += 1
-        payload_len_pos = pos
-        payload_len_str = ''
-
-        while True:
-            try:
-                byte_int = raw[pos]
-            except IndexError:
-                raise PayloadDecodeError('payload length field truncated at {}'.format(pos))
-
-            if byte_int == 255:
-                pos += 1
-                break
+        header = _decbinpayloadheader(raw, pos)
 
-            if byte_int < 0 \
-                    or byte_int > 9:
-                raise PayloadDecodeError('unrecognized length byte {} at {}'.format(byte_int, pos))
-
-            pos += 1
-            payload_len_str += str(byte_int)
+        if header is None:
+            if pos >= len(raw):
+                return
 
-        # Number.MAX_VALUE ~ 1 * 10 ** 308 or 310 characters
-        if len(payload_len_str) > 310:
-            raise PayloadDecodeError('{} exceeds max bytes for length field at {}'.format(payload_len_str, payload_len_pos))
+            raise PayloadDecodeError('payload length field truncated at {}'.format(len(raw)))
 
-        payload_len = int(payload_len_str, 10)
-        payload = raw[pos:pos + payload_len]
+        payload_type, payload_len, pos = header
+        payload = view[pos:pos + payload_len]
 
         if len(payload) != payload_len:
             raise PayloadDecodeError('payload data truncated (received only {} of {} expected octets) at {}'.format(len(payload), payload_len, pos))
 
         if payload_type == _PAYLOAD_TYPE_STR:
-            payload = payload.decode('utf_8')
+            payload = str(codecs.decode(payload, 'utf_8'))
 
         pos += payload_len
         yield payload
@@ -1291,11 +3471,14 @@ def deceiopacket(packet):
     unicode, either as :class:`~future.types.newstr.newstr` in Python 2
     or :class:`str` in Python 3. Binary packets are returned as raw bytes,
     either as :class:`~future.types.newbytes.newbytes` in Python 2 or
-    :class:`bytes` in Python 3.
+    :class:`bytes` in Python 3. :class:`memoryview` packets (e.g., from
+    :func:`decbinpayloadsgen` with ``zerocopy`` set) are treated as
+    binary, and their data are returned as :class:`memoryview` slices
+    without copying.
 
     :param packet: the packet to decode
 
-    :type packet: `bytes` or `str` (`unicode`)
+    :type packet: `bytes`, `memoryview`, or `str` (`unicode`)
 
     :returns: a tuple ( ``packet_type``, ``packet_data`` ), where
         ``packet_type`` is one of the values from
@@ -1312,6 +3495,9 @@ def deceiopacket(packet):
     elif isinstance(packet, bytes):
         packet_type = bytes(packet[0:1])
         packet_data = bytes(packet[1:])
+    elif isinstance(packet, memoryview):
+        packet_type = bytes(packet[0:1].tobytes())
+        packet_data = packet[1:]
     else:
         raise TypeError('packet type must be one of bytes or str, not {}'.format(type(packet).__name__))
 
@@ -1334,6 +3520,31 @@ def deceiopacketsgen(packets):
     """
     return map(deceiopacket, packets)
 
+# ========================================================================
+def decrecordpayloadsgen(raw):
+    """
+    Decodes an Engine.IO v4 polling message, whose packets are separated
+    by ``\\x1e`` (with binary packets encoded as ``b`` followed by their
+    base64-encoded data), and yields its packets, which have the same
+    types as with :func:`decbinpayloadsgen`. Binary packets are always
+    ``message`` packets.
+
+    :param bytes raw: the raw Engine.IO message containing zero or more
+        packets
+
+    :returns: a :class:`generator` that yeilds each packet
+
+    :raises: :exc:`PayloadDecodeError` if there was a problem decoding
+        `raw`
+    """
+    decoder = RecordPayloadsDecoder()
+
+    for payload in decoder.feed(raw):
+        yield payload
+
+    for payload in decoder.finish():
+        yield payload
+
 # ========================================================================
 def encbinpayload(packet):
     """
@@ -1356,10 +3567,9 @@ def encbinpayload(packet):
     else:
         raise TypeError('packet type must be one of bytes or str, not {}'.format(type(packet).__name__))
 
-    packet_len_str = str(len(packet))
-    payload_len_bytes = bytes([ ord(c) - ord('0') for c in packet_len_str ])
+    payload_len_octets = str(len(packet)).encode('ascii').translate(_DIGITS_TO_LEN_OCTETS)
 
-    return bytes(( payload_type, )) + payload_len_bytes + bytes(( 255, )) + packet
+    return bytes(b''.join(( _PAYLOAD_TYPE_OCTETS[payload_type], payload_len_octets, _LEN_TERMINATOR, packet )))
 
 # ========================================================================
 def encbinpayloads(packets):
@@ -1425,6 +3635,57 @@ def enceiopacket(packet_type, packet_data=''):
 
     return packet_type + packet_data
 
+# ========================================================================
+def encrecordpayloads(packets):
+    """
+    Encodes zero or more Engine.IO packets as an Engine.IO v4 polling
+    message (see :func:`decrecordpayloadsgen`). Unicode packets are
+    encoded as UTF-8. Bytes packets must be ``message`` packets.
+
+    :param iterable packets: the packets to encode
+
+    :returns: the message
+
+    :raises: :exc:`PayloadEncodeError` if a bytes packet is not a
+        ``message`` packet
+
+    :raises: :exc:`TypeError` if a packet is neither bytes nor str
+    """
+    records = []
+
+    for i, packet in enumerate(packets):
+        if isinstance(packet, str):
+            records.append(str(packet).encode('utf_8'))
+        elif isinstance(packet, bytes):
+            if packet[0:1] != EIO_TYPE_MESSAGE:
+                raise PayloadEncodeError('binary packet type {!r} is not {!r} for packet[{}]'.format(bytes(packet[0:1]), EIO_TYPE_MESSAGE, i))
+
+            records.append(_RECORD_BIN_PREFIX + base64.b64encode(packet[1:]))
+        else:
+            raise TypeError('packet type must be one of bytes or str, not {} for packet[{}]'.format(type(packet).__name__, i))
+
+    return bytes(_RECORD_SEPARATOR.join(records))
+
+# ========================================================================
+def jsoncodec(name):
+    """
+    Looks up a registered JSON codec. :const:`JSON_CODEC_DECIMAL`,
+    :const:`JSON_CODEC_JSON`, and :const:`JSON_CODEC_SIMPLEJSON` are
+    always available. :const:`JSON_CODEC_ORJSON` and
+    :const:`JSON_CODEC_UJSON` are available if the corresponding module
+    is installed.
+
+    :param str name: the name of the codec
+
+    :returns: the :class:`JsonCodec` registered as ``name``
+
+    :raises: :class:`ValueError` if no codec is registered as ``name``
+    """
+    try:
+        return _JSON_CODECS[name]
+    except KeyError:
+        raise ValueError('unrecognized JSON codec "{}" (available: {})'.format(name, ', '.join(sorted(_JSON_CODECS))))
+
 # ========================================================================
 def jsondumps(*args, **kw):
     kw.setdefault('use_decimal', True)
@@ -1437,3 +3698,147 @@ def jsonloads(*args, **kw):
     kw.setdefault('use_decimal', True)
 
     return simplejson.loads(*args, **kw)
+
+# ========================================================================
+def registerjsoncodec(name, dumps, loads):
+    """
+    Registers (or replaces) a JSON codec for use with :func:`jsoncodec`.
+
+    :param str name: the name of the codec
+
+    :param callable dumps: called with an object; returns its JSON
+        encoding as `bytes` or `str` (`unicode`)
+
+    :param callable loads: called with a `str` (`unicode`); returns the
+        decoded object, or raises :class:`ValueError`
+
+    :returns: the registered :class:`JsonCodec`
+    """
+    codec = _JSON_CODECS[name] = JsonCodec(dumps, loads)
+
+    return codec
+
+# ========================================================================
+def _decbinpayloadheader(raw, pos, offset=0):
+    """
+    Decodes the header of the binary Engine.IO payload starting at
+    ``raw[pos]``.
+
+    :returns: a tuple ``( payload_type, payload_len, data_pos )``, or
+        `None` if ``raw`` ends before the header does
+
+    :raises: :exc:`PayloadDecodeError` if the header is invalid;
+        ``offset`` is added to any positions in the error message
+    """
+    try:
+        payload_type = raw[pos]
+    except IndexError:
+        return None
+
+    if payload_type not in _PAYLOAD_TYPES:
+        raise PayloadDecodeError('unrecognized payload type {} at {}'.format(payload_type, offset + pos))
+
+    pos += 1
+
+    try:
+        # Single-digit lengths are common enough (and cheap enough to
+        # check directly) to skip the bulk path below
+        if raw[pos + 1] == 0xff \
+                and raw[pos] < 10:
+            return payload_type, raw[pos], pos + 2
+    except IndexError:
+        pass
+
+    # Only the longest valid field (plus its terminator) is searched, and
+    # memoryviews (which can't be searched) only have that much copied
+    window = raw[pos:pos + _MAX_LEN_DIGITS + 1]
+
+    if isinstance(window, memoryview):
+        window = window.tobytes()
+
+    len_end = window.find(_LEN_TERMINATOR)
+
+    if len_end < 0:
+        # Either the field is incomplete or it's already too long
+        _checkbinpayloadlen(window, pos + offset, terminated=len(window) > _MAX_LEN_DIGITS)
+
+        return None
+
+    payload_len_octets = window[:len_end]
+    end_pos = pos + len_end
+
+    try:
+        # Invalid octets translate to b'x', which int() rejects
+        payload_len = int(payload_len_octets.translate(_LEN_OCTETS_TO_DIGITS), 10)
+    except ValueError:
+        payload_len = None
+
+    if payload_len is None:
+        _checkbinpayloadlen(payload_len_octets, pos + offset)
+
+    return payload_type, payload_len, end_pos + 1
+
+# ========================================================================
+def _decbinpacket(packet):
+    """
+    Like :func:`deceiopacket`, but for binary packets as Engine.IO v3
+    sends them in binary payloads and WebSocket frames, whose types are
+    numbers (e.g., ``b'\\x04'``) rather than ASCII digits.
+    """
+    if len(packet) == 0:
+        raise PayloadDecodeError('packet truncated')
+
+    packet_type = bytes(packet[0:1]).translate(_LEN_OCTETS_TO_DIGITS)
+
+    if packet_type not in EIO_TYPE_NAMES_BY_CODE:
+        raise PayloadDecodeError('unrecognized binary packet type {!r}'.format(bytes(packet[0:1])))
+
+    # Slicing a view avoids copying the data twice
+    return packet_type, bytes(memoryview(packet)[1:])
+
+# ========================================================================
+def _decrecord(record, pos):
+    """
+    Decodes a single packet from an Engine.IO v4 polling message found at
+    ``pos`` (see :func:`decrecordpayloadsgen`).
+    """
+    if record[0:1] == _RECORD_BIN_PREFIX:
+        try:
+            return bytes(EIO_TYPE_MESSAGE + base64.b64decode(bytes(record[1:])))
+        except ( binascii.Error, ValueError ) as exc:
+            raise PayloadDecodeError('invalid base64 data at {}: {}'.format(pos + 1, exc), wrapped_exc=exc)
+
+    try:
+        return str(codecs.decode(record, 'utf_8'))
+    except UnicodeDecodeError as exc:
+        raise PayloadDecodeError('invalid UTF-8 data at {}: {}'.format(pos + exc.start, exc.reason), wrapped_exc=exc)
+
+# ========================================================================
+def _encbinpacket(packet):
+    """
+    Converts the type of a binary packet (as returned by
+    :func:`enceiopacket`) to the number Engine.IO v3 expects (see
+    :func:`_decbinpacket`).
+    """
+    return bytes(packet[0:1].translate(_DIGITS_TO_LEN_OCTETS) + packet[1:])
+
+# ========================================================================
+def _checkbinpayloadlen(payload_len_octets, pos, terminated=True):
+    """
+    Raises :exc:`PayloadDecodeError` describing the first problem with
+    the length field ``payload_len_octets`` found at ``pos``, if any. If
+    ``terminated`` is `False`, the field is assumed to be incomplete, so
+    only its octets are checked.
+    """
+    for i, byte_int in enumerate(bytearray(payload_len_octets)):
+        if byte_int > 9:
+            raise PayloadDecodeError('unrecognized length byte {} at {}'.format(byte_int, pos + i))
+
+    if not terminated:
+        return
+
+    if not payload_len_octets:
+        raise PayloadDecodeError('empty length field at {}'.format(pos))
+
+    if len(payload_len_octets) > _MAX_LEN_DIGITS:
+        raise PayloadDecodeError('{} exceeds max bytes for length field at {}'.format(bytes(payload_len_octets.translate(_LEN_OCTETS_TO_DIGITS)).decode('ascii'), pos))
@@ -0,0 +1,1247 @@
+# -*- encoding: utf-8; grammar-ext: py; mode: python; test-case-name: test.test_longpoll -*-
+
+# ========================================================================
+"""
+Copyright and other protections apply. Please see the accompanying
+:doc:`LICENSE <LICENSE>` and :doc:`CREDITS <CREDITS>` file(s) for rights
+and restrictions governing use of this software. All rights not expressly
+waived or licensed are reserved. If those files are missing or appear to
+be modified from their originals, then please contact the author before
+viewing or using this software in any capacity.
+"""
+# ========================================================================
+
+from __future__ import (
+    absolute_import, division, print_function, unicode_literals,
+)
+from builtins import *  # noqa: F401,F403 # pylint: disable=redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+from future.builtins.disabled import *  # noqa: F401,F403 # pylint: disable=no-name-in-module,redefined-builtin,unused-wildcard-import,useless-suppression,wildcard-import
+from future.utils import (
+    iteritems,
+    itervalues,
+)
+
+# ---- Imports -----------------------------------------------------------
+
+import collections
+import logging
+import weakref
+from twisted.internet import (
+    defer as t_defer,
+    error as t_error,
+    protocol as t_protocol,
+)
+from twisted.python import failure as t_failure
+from twisted.web import (
+    client as t_client,
+    http as t_http,
+    http_headers as t_http_headers,
+    iweb as t_iweb,
+)
+from zope import interface
+
+from .endpoint import ClientEndpointFactory
+
+try:
+    import h2.config
+    import h2.connection
+    import h2.errors
+    import h2.events
+    import h2.exceptions
+except ImportError:
+    _H2_SUPPORTED = False
+else:
+    _H2_SUPPORTED = True
+
+# ---- Constants ---------------------------------------------------------
+
+__all__ = (
+    'H2LongPollAgent',
+    'LongPollAgent',
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Responses with heads longer than this are rejected
+_MAX_HEAD_LEN = 65536
+
+_BODY_LENGTH = 0
+_BODY_CHUNKED = 1
+_BODY_EOF = 2
+
+_CHUNK_SIZE = 0
+_CHUNK_DATA = 1
+_CHUNK_CRLF = 2
+_CHUNK_TRAILER = 3
+
+# These are forbidden in HTTP/2 requests (see RFC 7540, section 8.1.2.2)
+_H2_CONNECTION_HEADERS = frozenset((
+    b'connection',
+    b'host',
+    b'keep-alive',
+    b'proxy-connection',
+    b'transfer-encoding',
+    b'upgrade',
+))
+
+# Indexes into request entries (see _Lane.request)
+_ENTRY_DATA = 0
+_ENTRY_D = 1
+_ENTRY_METHOD = 2
+_ENTRY_RETRIED = 3
+_ENTRY_ONHEADERS = 4
+
+# ---- Classes -----------------------------------------------------------
+
+# ========================================================================
+@interface.implementer(t_iweb.IAgent)
+class LongPollAgent(object):
+    """
+    A minimal HTTP/1.1 client suitable for the Engine.IO ``polling``
+    transport, and a drop-in replacement for the
+    :class:`twisted.web.client.Agent` stack otherwise built by
+    :class:`~txsocketio.engineio.PollingTransport` (e.g.,
+    ``PollingTransport.Factory(agent=LongPollAgent())``).
+
+    For each server, ``GET`` requests share one persistent connection and
+    all other requests share another, which is all Engine.IO polling
+    needs (one outstanding long-poll and one outstanding send). Requests
+    on the same connection are queued and sent one at a time (there is no
+    pipelining). Responses are parsed directly off the wire, with body
+    octets handed to the protocol passed to
+    :meth:`~twisted.web.iweb.IResponse.deliverBody` as they arrive.
+
+    An agent shared by several transports (e.g.,
+    ``PollingTransport.Factory(agent=LongPollAgent())``) gives each its
+    own session (see :meth:`newsession`), so one session's long-poll
+    never waits behind another's.
+
+    In exchange, a great deal is left out: there are no redirects, no
+    content decoding, no proxies, and cookies are only remembered by
+    name and value (per session and network location, without regard to
+    any attributes), which is enough for sticky load balancing.
+
+    In addition to :class:`~twisted.web.iweb.IBodyProducer` providers,
+    :meth:`request` accepts a :class:`bytes` body (see
+    :attr:`accepts_bytes_body`) to avoid the overhead of a producer.
+
+    :param reactor: the reactor used to make connections (ignored if
+        ``endpoint_factory`` is provided)
+
+    :param endpoint_factory: a
+        :class:`twisted.web.iweb.IAgentEndpointFactory` provider (defaults
+        to a :class:`~txsocketio.endpoint.ClientEndpointFactory`)
+    """
+
+    # ---- Public properties ---------------------------------------------
+
+    #: Signals to :class:`~txsocketio.engineio.PollingTransport` that
+    #: request bodies may be passed as :class:`bytes`
+    accepts_bytes_body = True
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, reactor=None, endpoint_factory=None):
+        if endpoint_factory is None:
+            if reactor is None:
+                from twisted.internet import reactor
+
+            endpoint_factory = ClientEndpointFactory(reactor)
+
+        self._endpoint_factory = endpoint_factory
+        # Maps ( scheme, netloc, is_get ) to _Lane objects
+        self._lanes = {}
+        self._cookies = _Cookies()
+        self._sessions = weakref.WeakSet()
+
+    # ---- Public hooks --------------------------------------------------
+
+    def request(self, method, uri, headers=None, bodyProducer=None):  # noqa: N803 # pylint: disable=invalid-name
+        """
+        See :meth:`twisted.web.iweb.IAgent.request`.
+        """
+        parsed = t_client.URI.fromBytes(uri)
+        key = ( parsed.scheme, parsed.netloc, method == b'GET' )
+        lane = self._lanes.get(key)
+
+        if lane is None:
+            lane = self._lanes[key] = _Lane(self._endpoint_factory, parsed)
+
+        if bodyProducer is None \
+                or isinstance(bodyProducer, bytes):
+            return lane.request(method, self._encoderequest(method, parsed, headers, bodyProducer))
+
+        consumer = _BytesConsumer()
+        d = bodyProducer.startProducing(consumer)
+        d.addCallback(lambda _: lane.request(method, self._encoderequest(method, parsed, headers, b''.join(consumer.chunks))))
+
+        return d
+
+    # ---- Public methods ------------------------------------------------
+
+    def closeconnections(self):
+        """
+        Closes all connections (aborting any requests in progress).
+
+        :returns: a :class:`twisted.internet.defer.Deferred` whose
+            callback is fired with `None`
+        """
+        for session in list(self._sessions):
+            session.closeconnections()
+
+        for lane in itervalues(self._lanes):
+            lane.close()
+
+        self._lanes.clear()
+
+        return t_defer.succeed(None)
+
+    def newsession(self):
+        """
+        Creates an agent for a single Engine.IO session.
+        :class:`~txsocketio.engineio.PollingTransport` calls this on any
+        agent that has it, and uses the result for its requests.
+
+        :returns: a :class:`LongPollAgent` with its own connections and
+            cookies (e.g., for sticky load balancing) that shares this
+            one's endpoint factory (its connections are also closed by
+            :meth:`closeconnections`)
+        """
+        session = LongPollAgent(endpoint_factory=self._endpoint_factory)
+        self._sessions.add(session)
+
+        return session
+
+    # ---- Private methods -----------------------------------------------
+
+    def _encoderequest(self, method, uri, headers, body):
+        parts = [ method, b' ', uri.originForm, b' HTTP/1.1\r\nHost: ', uri.netloc, b'\r\n' ]
+
+        if headers is not None:
+            for name, values in headers.getAllRawHeaders():
+                for value in values:
+                    parts.extend(( name, b': ', value, b'\r\n' ))
+
+        cookie = self._cookies.header(uri.netloc)
+
+        if cookie:
+            parts.extend(( b'Cookie: ', cookie, b'\r\n' ))
+
+        if body is not None:
+            parts.extend(( b'Content-Length: ', str(len(body)).encode('ascii'), b'\r\n\r\n', body ))
+        else:
+            parts.append(b'\r\n')
+
+        return b''.join(parts), lambda headers: self._cookies.received(uri.netloc, headers)
+
+# ========================================================================
+@interface.implementer(t_iweb.IAgent)
+class H2LongPollAgent(object):
+    """
+    Like :class:`LongPollAgent`, but speaks HTTP/2 (via `h2
+    <https://python-hyper.org/projects/h2/>`_) and multiplexes requests
+    as streams over a few connections shared by every
+    :class:`~txsocketio.engineio.PollingTransport` using it. Sharing one
+    agent across sessions (e.g., ``PollingTransport.Factory(agent=agent)``)
+    means many sessions to the same server need only
+    ``max_connections_per_host`` connections (rather than two apiece).
+
+    Each session (see :meth:`newsession`) keeps its own cookies (e.g.,
+    for sticky load balancing), even though its requests share
+    connections with those of other sessions. Requests go out on the
+    first connection to a server with a free stream, and a new
+    connection is only made when all existing ones are at their stream
+    limits. Once ``max_connections_per_host`` is reached,
+    requests are queued until a stream frees up. Canceling a request (or
+    aborting its response body) resets its stream, not its connection.
+
+    ``https://`` servers must negotiate ``h2`` via ALPN; plain
+    ``http://`` servers must accept HTTP/2 with prior knowledge (there is
+    no ``Upgrade`` from HTTP/1.1).
+
+    :param reactor: the reactor used to make connections (ignored if
+        ``endpoint_factory`` is provided)
+
+    :param endpoint_factory: a
+        :class:`twisted.web.iweb.IAgentEndpointFactory` provider (defaults
+        to a :class:`~txsocketio.endpoint.ClientEndpointFactory` offering
+        ``h2`` via ALPN)
+
+    :param int max_connections_per_host: the maximum number of connections
+        to each server
+
+    :param max_streams_per_connection: if not `None`, the maximum number of
+        concurrent streams per connection (otherwise, limited only by the
+        server's ``SETTINGS_MAX_CONCURRENT_STREAMS``)
+
+    :raises ImportError: if h2 is not installed
+    """
+
+    # ---- Public properties ---------------------------------------------
+
+    #: Signals to :class:`~txsocketio.engineio.PollingTransport` that
+    #: request bodies may be passed as :class:`bytes`
+    accepts_bytes_body = True
+
+    @property
+    def connections(self):
+        """
+        The number of open connections (to all servers).
+        """
+        return sum(( len(pool.protocols) for pool in itervalues(self._pools) ))
+
+    @property
+    def streams(self):
+        """
+        The number of requests in progress (across all connections).
+        """
+        return sum(( protocol.streams for pool in itervalues(self._pools) for protocol in pool.protocols ))
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, reactor=None, endpoint_factory=None, max_connections_per_host=1, max_streams_per_connection=None):
+        if not _H2_SUPPORTED:
+            raise ImportError('{} requires h2 (pip install txsocketio[http2])'.format(self.__class__.__name__))
+
+        if endpoint_factory is None:
+            if reactor is None:
+                from twisted.internet import reactor
+
+            endpoint_factory = ClientEndpointFactory(reactor, acceptable_protocols=( b'h2', ))
+
+        self._endpoint_factory = endpoint_factory
+        self._max_connections_per_host = max_connections_per_host
+        self._max_streams_per_connection = max_streams_per_connection
+        # Maps ( scheme, netloc ) to _H2HostPool objects
+        self._pools = {}
+        self._cookies = _Cookies()
+
+    # ---- Public hooks --------------------------------------------------
+
+    def request(self, method, uri, headers=None, bodyProducer=None):  # noqa: N803 # pylint: disable=invalid-name
+        """
+        See :meth:`twisted.web.iweb.IAgent.request`.
+        """
+        return self._request(method, uri, headers, bodyProducer, self._cookies)
+
+    # ---- Public methods ------------------------------------------------
+
+    def closeconnections(self):
+        """
+        Closes all connections (aborting any requests in progress).
+
+        :returns: a :class:`twisted.internet.defer.Deferred` whose
+            callback is fired with `None`
+        """
+        for pool in itervalues(self._pools):
+            pool.close()
+
+        self._pools.clear()
+
+        return t_defer.succeed(None)
+
+    def newsession(self):
+        """
+        Creates an agent for a single Engine.IO session.
+        :class:`~txsocketio.engineio.PollingTransport` calls this on any
+        agent that has it, and uses the result for its requests.
+
+        :returns: a :class:`twisted.web.iweb.IAgent` provider with its own
+            cookies whose requests share this agent's connections (its
+            ``closeconnections`` method leaves them open for other
+            sessions)
+        """
+        return _H2Session(self)
+
+    # ---- Private methods -----------------------------------------------
+
+    def _request(self, method, uri, headers, body_producer, cookies):
+        parsed = t_client.URI.fromBytes(uri)
+        key = ( parsed.scheme, parsed.netloc )
+        pool = self._pools.get(key)
+
+        if pool is None:
+            pool = self._pools[key] = _H2HostPool(self._endpoint_factory, parsed, self._max_connections_per_host, self._max_streams_per_connection)
+
+        if body_producer is None \
+                or isinstance(body_producer, bytes):
+            return pool.request(self._buildrequest(method, parsed, headers, body_producer, cookies))
+
+        consumer = _BytesConsumer()
+        d = body_producer.startProducing(consumer)
+        d.addCallback(lambda _: pool.request(self._buildrequest(method, parsed, headers, b''.join(consumer.chunks), cookies)))
+
+        return d
+
+    def _buildrequest(self, method, uri, headers, body, cookies):
+        scheme = b'https' if uri.scheme in ( b'https', b'wss' ) else b'http'
+        h2_headers = [
+            ( b':method', method ),
+            ( b':scheme', scheme ),
+            ( b':authority', uri.netloc ),
+            ( b':path', uri.originForm ),
+        ]
+
+        if headers is not None:
+            for name, values in headers.getAllRawHeaders():
+                name = name.lower()
+
+                if name not in _H2_CONNECTION_HEADERS:
+                    h2_headers.extend(( ( name, value ) for value in values ))
+
+        cookie = cookies.header(uri.netloc)
+
+        if cookie:
+            h2_headers.append(( b'cookie', cookie ))
+
+        if body is not None:
+            h2_headers.append(( b'content-length', str(len(body)).encode('ascii') ))
+
+        return _H2Request(h2_headers, body, lambda headers: cookies.received(uri.netloc, headers))
+
+# ========================================================================
+class _BytesConsumer(object):
+    """
+    Collects what an :class:`~twisted.web.iweb.IBodyProducer` writes.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        self.chunks = []
+
+    # ---- Public hooks --------------------------------------------------
+
+    def registerProducer(self, producer, streaming):  # noqa: N802 # pylint: disable=invalid-name
+        pass
+
+    def unregisterProducer(self):  # noqa: N802 # pylint: disable=invalid-name
+        pass
+
+    def write(self, data):
+        self.chunks.append(data)
+
+# ========================================================================
+class _Cookies(object):
+    """
+    Remembers cookies by name and value (per network location, without
+    regard to any attributes).
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self):
+        # Maps netlocs to ordered mappings of cookie names to values
+        self._cookies = {}
+
+    # ---- Public methods ------------------------------------------------
+
+    def header(self, netloc):
+        cookies = self._cookies.get(netloc)
+
+        if not cookies:
+            return None
+
+        return b'; '.join(( name + b'=' + value for name, value in iteritems(cookies) ))
+
+    def received(self, netloc, headers):
+        set_cookies = headers.getRawHeaders(b'set-cookie')
+
+        if not set_cookies:
+            return
+
+        cookies = self._cookies.setdefault(netloc, collections.OrderedDict())
+
+        for set_cookie in set_cookies:
+            name, sep, value = set_cookie.split(b';', 1)[0].partition(b'=')
+
+            if sep:
+                cookies[name.strip()] = value.strip()
+
+# ========================================================================
+class _H2Factory(t_protocol.Factory):
+    ""
+
+    noisy = False
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    # ---- Public hooks --------------------------------------------------
+
+    def buildProtocol(self, addr):  # noqa: N802 # pylint: disable=invalid-name
+        return _H2Protocol(self._pool)
+
+# ========================================================================
+class _H2HostPool(object):
+    """
+    Spreads requests to one server across the streams of up to
+    ``max_connections`` connections, (re)connecting as necessary.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, endpoint_factory, uri, max_connections, max_streams):
+        self.protocols = []
+        self._endpoint_factory = endpoint_factory
+        self._uri = uri
+        self._max_connections = max_connections
+        self._max_streams = max_streams
+        self._connecting_d = None
+        self._queue = collections.deque()
+
+    # ---- Public methods ------------------------------------------------
+
+    def close(self):
+        if self._connecting_d is not None:
+            self._connecting_d.cancel()
+
+        for protocol in list(self.protocols):
+            protocol.transport.abortConnection()
+
+    def connectionlost(self, protocol):
+        try:
+            self.protocols.remove(protocol)
+        except ValueError:
+            pass
+
+        self.dispatch()
+
+    def dispatch(self):
+        while self._queue:
+            for protocol in self.protocols:
+                if protocol.available(self._max_streams) > 0:
+                    break
+            else:
+                if self._connecting_d is None \
+                        and len(self.protocols) < self._max_connections:
+                    self._connect()
+
+                return
+
+            protocol.sendrequest(self._queue.popleft())
+
+    def request(self, request):
+        def _cancel(_):
+            if request.protocol is None:
+                try:
+                    self._queue.remove(request)
+                except ValueError:
+                    pass
+            else:
+                request.protocol.resetstream(request.stream_id)
+
+        request.d = t_defer.Deferred(_cancel)
+        self._queue.append(request)
+        self.dispatch()
+
+        return request.d
+
+    # ---- Private methods -----------------------------------------------
+
+    def _connect(self):
+        endpoint = self._endpoint_factory.endpointForURI(self._uri)
+        d = self._connecting_d = endpoint.connect(_H2Factory(self))
+
+        def _connected(protocol):
+            self._connecting_d = None
+            self.protocols.append(protocol)
+            self.dispatch()
+
+        def _connectfailed(failure):
+            self._connecting_d = None
+
+            if self.protocols:
+                # Whatever is queued can wait for a free stream
+                return
+
+            queue = list(self._queue)
+            self._queue.clear()
+
+            for request in queue:
+                if not request.d.called:
+                    request.d.errback(failure)
+
+        d.addCallbacks(_connected, _connectfailed)
+
+# ========================================================================
+class _H2Protocol(t_protocol.Protocol):
+    """
+    Sends requests as streams over one HTTP/2 connection.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=True, header_encoding=None))
+        # Maps stream IDs to _H2Request objects
+        self._requests = {}
+        # Maps stream IDs to request body octets awaiting flow control
+        # window updates
+        self._blocked = collections.OrderedDict()
+        self._closing = False
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def streams(self):
+        return len(self._requests)
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionLost(self, reason=t_protocol.connectionDone):  # noqa: N802 # pylint: disable=invalid-name
+        self._closing = True
+        requests = list(itervalues(self._requests))
+        self._requests.clear()
+        self._blocked.clear()
+
+        for request in requests:
+            self._failrequest(request, reason)
+
+        self._pool.connectionlost(self)
+
+    def connectionMade(self):  # noqa: N802 # pylint: disable=invalid-name
+        self._conn.initiate_connection()
+        self._flush()
+
+    def dataReceived(self, data):  # noqa: N802 # pylint: disable=invalid-name
+        try:
+            events = self._conn.receive_data(data)
+        except h2.exceptions.ProtocolError:
+            _LOGGER.debug('HTTP/2 protocol error; dropping connection', exc_info=True)
+            self._closing = True
+            self.transport.abortConnection()
+
+            return
+
+        for event in events:
+            if isinstance(event, h2.events.ResponseReceived):
+                self._responsereceived(event)
+            elif isinstance(event, h2.events.DataReceived):
+                self._conn.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                request = self._requests.get(event.stream_id)
+
+                if request is not None \
+                        and request.response is not None:
+                    request.response.deliver(event.data)
+            elif isinstance(event, h2.events.StreamEnded):
+                self._blocked.pop(event.stream_id, None)
+                request = self._requests.pop(event.stream_id, None)
+
+                if request is not None:
+                    if request.response is not None:
+                        request.response.finish(t_failure.Failure(t_client.ResponseDone()))
+                    else:
+                        self._failrequest(request, t_failure.Failure(t_error.ConnectionLost('stream {} ended without a response'.format(event.stream_id))))
+
+                    self._pool.dispatch()
+            elif isinstance(event, h2.events.StreamReset):
+                self._blocked.pop(event.stream_id, None)
+                request = self._requests.pop(event.stream_id, None)
+
+                if request is not None:
+                    self._failrequest(request, t_failure.Failure(t_error.ConnectionLost('stream {} reset (error code {})'.format(event.stream_id, event.error_code))))
+                    self._pool.dispatch()
+            elif isinstance(event, h2.events.WindowUpdated):
+                self._sendblocked()
+            elif isinstance(event, h2.events.RemoteSettingsChanged):
+                self._pool.dispatch()
+            elif isinstance(event, h2.events.ConnectionTerminated):
+                # Streams still in progress fail when the connection is lost
+                _LOGGER.debug('received GOAWAY (error code %s)', event.error_code)
+                self._closing = True
+                self.transport.loseConnection()
+
+        self._flush()
+
+    # ---- Public methods ------------------------------------------------
+
+    def available(self, max_streams=None):
+        if self._closing:
+            return 0
+
+        limit = self._conn.remote_settings.max_concurrent_streams
+
+        if max_streams is not None:
+            limit = min(limit, max_streams)
+
+        return limit - len(self._requests)
+
+    def resetstream(self, stream_id):
+        self._blocked.pop(stream_id, None)
+        request = self._requests.pop(stream_id, None)
+
+        if request is None:
+            return
+
+        try:
+            self._conn.reset_stream(stream_id, h2.errors.ErrorCodes.CANCEL)
+        except h2.exceptions.StreamClosedError:
+            pass
+
+        self._flush()
+
+        if request.response is not None:
+            request.response.finish(t_failure.Failure(t_client.ResponseFailed([ t_failure.Failure(t_error.ConnectionAborted()) ])))
+
+        self._pool.dispatch()
+
+    def sendrequest(self, request):
+        stream_id = self._conn.get_next_available_stream_id()
+        request.protocol = self
+        request.stream_id = stream_id
+        self._requests[stream_id] = request
+        self._conn.send_headers(stream_id, request.headers, end_stream=not request.body)
+
+        if request.body:
+            self._senddata(stream_id, request.body)
+
+        self._flush()
+
+    # ---- Private methods -----------------------------------------------
+
+    def _failrequest(self, request, reason):
+        if request.response is not None:
+            request.response.finish(t_failure.Failure(t_client.ResponseFailed([ reason ])))
+        elif not request.d.called:
+            request.d.errback(t_client.ResponseNeverReceived([ reason ]))
+
+    def _flush(self):
+        data = self._conn.data_to_send()
+
+        if data:
+            self.transport.write(data)
+
+    def _responsereceived(self, event):
+        request = self._requests.get(event.stream_id)
+
+        if request is None:
+            return
+
+        headers = t_http_headers.Headers()
+        code = None
+
+        for name, value in event.headers:
+            if name == b':status':
+                code = int(value)
+            elif not name.startswith(b':'):
+                headers.addRawHeader(name, value)
+
+        request.onheaders(headers)
+        content_length = headers.getRawHeaders(b'content-length')
+        length = int(content_length[0]) if content_length else t_iweb.UNKNOWN_LENGTH
+        request.response = _LongPollResponse(( b'HTTP', 2, 0 ), code, t_http.RESPONSES.get(code, b''), headers, length, _H2StreamTransport(self, event.stream_id))
+        request.d.callback(request.response)
+
+    def _sendblocked(self):
+        blocked = list(iteritems(self._blocked))
+        self._blocked.clear()
+
+        for stream_id, data in blocked:
+            self._senddata(stream_id, data)
+
+    def _senddata(self, stream_id, data):
+        while data:
+            n = min(len(data), self._conn.local_flow_control_window(stream_id), self._conn.max_outbound_frame_size)
+
+            if n <= 0:
+                self._blocked[stream_id] = data
+
+                return
+
+            self._conn.send_data(stream_id, data[:n], end_stream=n == len(data))
+            data = data[n:]
+
+# ========================================================================
+class _H2Request(object):
+    ""
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, headers, body, onheaders):
+        self.headers = headers
+        self.body = body
+        self.onheaders = onheaders
+        self.d = None
+        self.protocol = None
+        self.stream_id = None
+        self.response = None
+
+# ========================================================================
+@interface.implementer(t_iweb.IAgent)
+class _H2Session(object):
+    """
+    An Engine.IO session's view of an :class:`H2LongPollAgent` (see
+    :meth:`H2LongPollAgent.newsession`).
+    """
+
+    # ---- Public properties ---------------------------------------------
+
+    accepts_bytes_body = True
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, agent):
+        self._agent = agent
+        self._cookies = _Cookies()
+
+    # ---- Public hooks --------------------------------------------------
+
+    def request(self, method, uri, headers=None, bodyProducer=None):  # noqa: N803 # pylint: disable=invalid-name
+        """
+        See :meth:`twisted.web.iweb.IAgent.request`.
+        """
+        return self._agent._request(method, uri, headers, bodyProducer, self._cookies)  # pylint: disable=protected-access
+
+    # ---- Public methods ------------------------------------------------
+
+    def closeconnections(self):
+        # Connections are shared with other sessions
+        return t_defer.succeed(None)
+
+# ========================================================================
+class _H2StreamTransport(object):
+    """
+    Handed to response body protocols in place of the (shared) connection
+    transport, so aborting a response body only resets its stream.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, protocol, stream_id):
+        self._protocol = protocol
+        self._stream_id = stream_id
+
+    # ---- Public hooks --------------------------------------------------
+
+    def abortConnection(self):  # noqa: N802 # pylint: disable=invalid-name
+        self._protocol.resetstream(self._stream_id)
+
+    def getHost(self):  # noqa: N802 # pylint: disable=invalid-name
+        return self._protocol.transport.getHost()
+
+    def getPeer(self):  # noqa: N802 # pylint: disable=invalid-name
+        return self._protocol.transport.getPeer()
+
+    def loseConnection(self):  # noqa: N802 # pylint: disable=invalid-name
+        self._protocol.resetstream(self._stream_id)
+
+# ========================================================================
+class _Lane(object):
+    """
+    Sends requests one at a time over a single persistent connection,
+    (re)connecting as necessary.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, endpoint_factory, uri):
+        self._endpoint_factory = endpoint_factory
+        self._uri = uri
+        self._protocol = None
+        self._connecting_d = None
+        self._active = None
+        self._queue = collections.deque()
+
+    # ---- Public methods ------------------------------------------------
+
+    def close(self):
+        if self._connecting_d is not None:
+            self._connecting_d.cancel()
+
+        if self._protocol is not None:
+            self._protocol.transport.abortConnection()
+
+    def connectionlost(self, protocol, entry, reason, retry):
+        if protocol is self._protocol:
+            self._protocol = None
+
+        if entry is not None \
+                and entry is self._active:
+            self._active = None
+            d = entry[_ENTRY_D]
+
+            if not d.called:
+                if retry \
+                        and entry[_ENTRY_METHOD] == b'GET' \
+                        and not entry[_ENTRY_RETRIED]:
+                    # The server probably closed an idle connection just
+                    # as we reused it
+                    _LOGGER.debug('retrying request on new connection')
+                    entry[_ENTRY_RETRIED] = True
+                    self._queue.appendleft(entry)
+                else:
+                    d.errback(t_client.ResponseNeverReceived([ reason ]))
+
+        self._pump()
+
+    def request(self, method, encoded):
+        data, onheaders = encoded
+        entry = [ data, None, method, False, onheaders ]
+
+        def _cancel(_):
+            if entry is self._active:
+                # The connection is in an unknown state, so drop it
+                self._protocol.transport.abortConnection()
+            else:
+                try:
+                    self._queue.remove(entry)
+                except ValueError:
+                    pass
+
+        d = entry[_ENTRY_D] = t_defer.Deferred(_cancel)
+        self._queue.append(entry)
+        self._pump()
+
+        return d
+
+    def responsedone(self, protocol, keep_alive):
+        self._active = None
+
+        if not keep_alive:
+            if protocol is self._protocol:
+                self._protocol = None
+
+            protocol.transport.loseConnection()
+
+        self._pump()
+
+    # ---- Private methods -----------------------------------------------
+
+    def _connect(self):
+        endpoint = self._endpoint_factory.endpointForURI(self._uri)
+        d = self._connecting_d = endpoint.connect(_LongPollFactory(self))
+
+        def _connected(protocol):
+            self._connecting_d = None
+            self._protocol = protocol
+            self._pump()
+
+        def _connectfailed(failure):
+            self._connecting_d = None
+            queue = list(self._queue)
+            self._queue.clear()
+
+            for entry in queue:
+                if not entry[_ENTRY_D].called:
+                    entry[_ENTRY_D].errback(failure)
+
+        d.addCallbacks(_connected, _connectfailed)
+
+    def _pump(self):
+        if self._active is not None \
+                or not self._queue:
+            return
+
+        if self._protocol is None:
+            if self._connecting_d is None:
+                self._connect()
+
+            return
+
+        entry = self._active = self._queue.popleft()
+        self._protocol.sendrequest(entry)
+
+# ========================================================================
+class _LongPollFactory(t_protocol.Factory):
+    ""
+
+    noisy = False
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, lane):
+        self._lane = lane
+
+    # ---- Public hooks --------------------------------------------------
+
+    def buildProtocol(self, addr):  # noqa: N802 # pylint: disable=invalid-name
+        return _LongPollProtocol(self._lane)
+
+# ========================================================================
+class _LongPollProtocol(t_protocol.Protocol):
+    """
+    Parses responses to requests sent (one at a time) by a :class:`_Lane`.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, lane):
+        self._lane = lane
+        self._buf = b''
+        self._entry = None
+        self._response = None
+        self._received = False
+        self._served = 0
+        self._keep_alive = True
+        self._body_mode = None
+        self._chunk_state = None
+        self._remaining = 0
+
+    # ---- Public hooks --------------------------------------------------
+
+    def connectionLost(self, reason=t_protocol.connectionDone):  # noqa: N802 # pylint: disable=invalid-name
+        entry, response = self._entry, self._response
+        self._entry = self._response = None
+
+        if response is not None:
+            if self._body_mode == _BODY_EOF:
+                response.finish(t_failure.Failure(t_client.ResponseDone()))
+            else:
+                response.finish(t_failure.Failure(t_client.ResponseFailed([ reason ])))
+
+        retry = response is None \
+            and not self._received \
+            and self._served > 0
+        self._lane.connectionlost(self, entry, reason, retry)
+
+    def dataReceived(self, data):  # noqa: N802 # pylint: disable=invalid-name
+        if self._entry is None:
+            _LOGGER.debug('unsolicited data received; dropping connection')
+            self.transport.abortConnection()
+
+            return
+
+        self._received = True
+        self._buf = self._buf + data if self._buf else data
+
+        try:
+            self._parse()
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.debug('unable to parse response', exc_info=True)
+            failure = t_failure.Failure()
+            entry, response = self._entry, self._response
+            self._entry = self._response = None
+
+            if response is not None:
+                response.finish(t_failure.Failure(t_client.ResponseFailed([ failure ])))
+            elif not entry[_ENTRY_D].called:
+                entry[_ENTRY_D].errback(t_client.ResponseFailed([ failure ]))
+
+            self._lane.connectionlost(self, entry, failure, False)
+            self.transport.abortConnection()
+
+    # ---- Public methods ------------------------------------------------
+
+    def sendrequest(self, entry):
+        self._entry = entry
+        self._response = None
+        self._received = False
+        self._buf = b''
+        self.transport.write(entry[_ENTRY_DATA])
+
+    # ---- Private methods -----------------------------------------------
+
+    def _deliver(self, n=None):
+        if n is None:
+            data, self._buf = self._buf, b''
+        else:
+            data, self._buf = self._buf[:n], self._buf[n:]
+
+        if data:
+            self._response.deliver(data)
+
+    def _parse(self):
+        if self._response is None:
+            while True:
+                end = self._buf.find(b'\r\n\r\n')
+
+                if end < 0:
+                    if len(self._buf) > _MAX_HEAD_LEN:
+                        raise ValueError('response head exceeds {} octets'.format(_MAX_HEAD_LEN))
+
+                    return
+
+                head, self._buf = self._buf[:end], self._buf[end + 4:]
+
+                if self._parsehead(head):
+                    break
+
+            if self._entry is None:
+                # The request was canceled
+                return
+
+        if self._parsebody():
+            response = self._response
+            self._response = self._entry = None
+            self._served += 1
+            response.finish(t_failure.Failure(t_client.ResponseDone()))
+            self._lane.responsedone(self, self._keep_alive)
+
+    def _parsebody(self):
+        if self._body_mode == _BODY_LENGTH:
+            n = min(self._remaining, len(self._buf))
+            self._remaining -= n
+            self._deliver(n)
+
+            return self._remaining == 0
+
+        if self._body_mode == _BODY_EOF:
+            self._deliver()
+
+            return False
+
+        while True:
+            if self._chunk_state == _CHUNK_SIZE:
+                i = self._buf.find(b'\r\n')
+
+                if i < 0:
+                    return False
+
+                self._remaining = int(self._buf[:i].split(b';', 1)[0].strip(), 16)
+                self._buf = self._buf[i + 2:]
+                self._chunk_state = _CHUNK_DATA if self._remaining else _CHUNK_TRAILER
+            elif self._chunk_state == _CHUNK_DATA:
+                n = min(self._remaining, len(self._buf))
+                self._remaining -= n
+                self._deliver(n)
+
+                if self._remaining:
+                    return False
+
+                self._chunk_state = _CHUNK_CRLF
+            elif self._chunk_state == _CHUNK_CRLF:
+                if len(self._buf) < 2:
+                    return False
+
+                if self._buf[:2] != b'\r\n':
+                    raise ValueError('malformed chunk')
+
+                self._buf = self._buf[2:]
+                self._chunk_state = _CHUNK_SIZE
+            else:
+                i = self._buf.find(b'\r\n')
+
+                if i < 0:
+                    return False
+
+                trailer, self._buf = self._buf[:i], self._buf[i + 2:]
+
+                if not trailer:
+                    return True
+
+    def _parsehead(self, head):
+        lines = head.split(b'\r\n')
+        status = lines[0].split(b' ', 2)
+        version = status[0]
+
+        if not version.startswith(b'HTTP/') \
+                or len(status) < 2:
+            raise ValueError('malformed status line {!r}'.format(lines[0]))
+
+        major, _, minor = version[5:].partition(b'.')
+        code = int(status[1])
+        phrase = status[2] if len(status) > 2 else b''
+
+        if 100 <= code < 200:
+            # Informational (e.g., 100 Continue); the real one follows
+            return False
+
+        headers = t_http_headers.Headers()
+
+        for line in lines[1:]:
+            name, sep, value = line.partition(b':')
+
+            if not sep:
+                raise ValueError('malformed header {!r}'.format(line))
+
+            headers.addRawHeader(name.strip(), value.strip())
+
+        entry = self._entry
+        entry[_ENTRY_ONHEADERS](headers)
+        connection = b','.join(headers.getRawHeaders(b'connection', ())).lower()
+
+        if version == b'HTTP/1.1':
+            self._keep_alive = b'close' not in connection
+        else:
+            self._keep_alive = b'keep-alive' in connection
+
+        transfer_encoding = b','.join(headers.getRawHeaders(b'transfer-encoding', ())).lower()
+        content_length = headers.getRawHeaders(b'content-length')
+        length = t_iweb.UNKNOWN_LENGTH
+
+        if entry[_ENTRY_METHOD] == b'HEAD' \
+                or code in ( 204, 304 ):
+            self._body_mode = _BODY_LENGTH
+            self._remaining = length = 0
+        elif b'chunked' in transfer_encoding:
+            self._body_mode = _BODY_CHUNKED
+            self._chunk_state = _CHUNK_SIZE
+        elif content_length:
+            self._body_mode = _BODY_LENGTH
+            self._remaining = length = int(content_length[0])
+        else:
+            self._body_mode = _BODY_EOF
+            self._keep_alive = False
+
+        response = self._response = _LongPollResponse(( b'HTTP', int(major), int(minor) ), code, phrase, headers, length, self.transport)
+        d = entry[_ENTRY_D]
+
+        if d.called:
+            # Canceled (the connection is being aborted)
+            self._entry = self._response = None
+        else:
+            d.callback(response)
+
+        return True
+
+# ========================================================================
+@interface.implementer(t_iweb.IResponse)
+class _LongPollResponse(object):
+    """
+    Implements just enough of :class:`twisted.web.iweb.IResponse` for
+    :class:`~txsocketio.engineio.PollingTransport` and
+    :func:`twisted.web.client.readBody`. Body octets received before
+    :meth:`deliverBody` is called are held until it is.
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, version, code, phrase, headers, length, transport):
+        self.version = version
+        self.code = code
+        self.phrase = phrase
+        self.headers = headers
+        self.length = length
+        self.request = None
+        self.previousResponse = None  # pylint: disable=invalid-name
+        self._transport = transport
+        self._body_protocol = None
+        self._pending = []
+        self._reason = None
+
+    # ---- Public hooks --------------------------------------------------
+
+    def deliverBody(self, protocol):  # noqa: N802 # pylint: disable=invalid-name
+        if self._body_protocol is not None:
+            raise RuntimeError('body already delivered')
+
+        self._body_protocol = protocol
+        protocol.makeConnection(self._transport)
+        pending, self._pending = self._pending, None
+
+        for data in pending:
+            protocol.dataReceived(data)
+
+        if self._reason is not None:
+            protocol.connectionLost(self._reason)
+
+    def setPreviousResponse(self, response):  # noqa: N802 # pylint: disable=invalid-name
+        self.previousResponse = response
+
+    # ---- Public methods ------------------------------------------------
+
+    def deliver(self, data):
+        if self._body_protocol is None:
+            self._pending.append(data)
+        else:
+            self._body_protocol.dataReceived(data)
+
+    def finish(self, reason):
+        if self._body_protocol is None:
+            self._reason = reason
+        else:
+            self._body_protocol.connectionLost(reason)
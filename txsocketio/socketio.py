@@ -21,15 +21,28 @@ from future.utils import iterkeys
 
 # ---- Imports -----------------------------------------------------------
 
+import collections
+import heapq
 import logging
-import re
+from twisted.internet import (
+    defer as t_defer,
+    error as t_error,
+)
 
+from .dispatcher import Dispatcher
 from .engineio import (
+    BUFFER_DROP_OLDEST,
+    EIO_PROTOCOL,
+    EIO_TYPE_CLOSE,
     EIO_TYPE_MESSAGE,
     EIO_TYPE_NAMES_BY_CODE,
     EngineIo,
+    EngineIoException,
+    JSON_CODEC_SIMPLEJSON,
+    JsonCodec,
     PayloadDecodeError,
     PayloadEncodeError,
+    jsoncodec,
     jsondumps,
     jsonloads,
 )
@@ -37,6 +50,8 @@ from .engineio import (
 # ---- Constants ---------------------------------------------------------
 
 __all__ = (
+    'AckTimeoutError',
+    'LazyEvent',
     'SIO_TYPE_ACK',
     'SIO_TYPE_BIN_ACK',
     'SIO_TYPE_BIN_EVENT',
@@ -46,7 +61,10 @@ __all__ = (
     'SIO_TYPE_ERROR',
     'SIO_TYPE_EVENT',
     'SIO_TYPE_NAMES_BY_CODE',
+    'SioPacketsDecoder',
     'SocketIo',
+    'deconstructsiopacket',
+    'reconstructsiopacket',
 )
 
 SIO_TYPE_CONNECT = bytes(b'0')
@@ -74,19 +92,223 @@ _SIO_ACK_TYPES_BY_TYPE = {
     SIO_TYPE_BIN_EVENT: SIO_TYPE_BIN_ACK,
 }
 
-_PACKET_RES = (
-    r'^ (?P<path>/[^,]*) (?:, (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)?)? $',
-    r'^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))  (?P<data>[^0-9].*)?   $',
-    r'^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)    $',
-    r'^ (?P<path>)            (?P<id>)                   (?P<data>)            $',
-)
+_SIO_BIN_TYPES = ( SIO_TYPE_BIN_EVENT, SIO_TYPE_BIN_ACK )
+
+_SIO_BIN_TYPES_BY_TYPE = {
+    SIO_TYPE_EVENT: SIO_TYPE_BIN_EVENT,
+    SIO_TYPE_ACK: SIO_TYPE_BIN_ACK,
+}
+
+_PLACEHOLDER_KEY = '_placeholder'
+_PLACEHOLDER_NUM_KEY = 'num'
 
-_PACKET_RE_FLAGS = re.DOTALL | re.VERBOSE
+_DEFAULT_ACK_TIMEOUT = 60  # seconds
+
+# Pending acks are expired in bulk, so timeouts are only enforced to
+# within this many seconds
+_ACK_EXPIRY_RESOLUTION = 1  # seconds
+
+_JSON_WHITESPACE = ' \t\n\r'
 
 _LOGGER = logging.getLogger(__name__)
 
+# ---- Exceptions --------------------------------------------------------
+
+# ========================================================================
+class AckTimeoutError(EngineIoException):
+    ""
+
 # ---- Classes -----------------------------------------------------------
 
+# ========================================================================
+class LazyEvent(object):
+    """
+    A lazily-decoded ``event`` packet object, dispatched by
+    :class:`SocketIo` in place of the ``[ event_name, arg, ... ]`` list
+    when ``lazy_events`` is `True`. It indexes, iterates, and compares
+    like that list, but only :attr:`name` is decoded up front (and
+    cheaply, without a full JSON parse). The rest of the packet data is
+    decoded the first time anything else is read, which raises
+    :class:`~txsocketio.engineio.PayloadDecodeError` if the data is
+    unparsable.
+
+    :param str packet_json: the packet data, which must be a JSON array
+
+    :param callable loads: the function used to decode ``packet_json``
+    """
+
+    __slots__ = ( '_loads', '_name', '_obj', '_packet_json' )
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, packet_json, loads=jsonloads):
+        self._packet_json = packet_json
+        self._loads = loads
+        self._name = _scaneventname(packet_json, loads)
+        self._obj = None
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def args(self):
+        """
+        The event arguments as a :class:`list` (decodes the packet data).
+        """
+        return self.obj[1:]
+
+    @property
+    def decoded(self):
+        """
+        `True` if the packet data has been decoded, `False` otherwise.
+        """
+        return self._obj is not None
+
+    @property
+    def name(self):
+        """
+        The event name. This only decodes the packet data if the name is
+        not a JSON string.
+        """
+        if self._name is None:
+            obj = self.obj
+
+            return obj[0] if obj else None
+
+        return self._name
+
+    @property
+    def obj(self):
+        """
+        The decoded packet data.
+        """
+        if self._obj is None:
+            try:
+                self._obj = self._loads(self._packet_json)
+            except ValueError:
+                raise PayloadDecodeError('unparsable JSON data')
+
+        return self._obj
+
+    # ---- Public hooks --------------------------------------------------
+
+    def __eq__(self, other):
+        if isinstance(other, LazyEvent):
+            other = other.obj
+
+        return self.obj == other
+
+    def __getitem__(self, key):
+        if key == 0 \
+                and self._name is not None:
+            return self._name
+
+        return self.obj[key]
+
+    def __iter__(self):
+        return iter(self.obj)
+
+    def __len__(self):
+        return len(self.obj)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self._packet_json if self._obj is None else self._obj)
+
+    __hash__ = None
+
+# ========================================================================
+class SioPacketsDecoder(object):
+    """
+    A push-style counterpart to :func:`decsiopacket` that is fed the data
+    of successive Engine.IO ``message`` packets. A ``binary_event`` or
+    ``binary_ack`` packet is only returned once all of the binary
+    attachments that follow it have been fed, at which point they are
+    substituted (without being copied) for their placeholders (see
+    :func:`reconstructsiopacket`).
+
+    :param json_codec: passed to :func:`decsiopacket`
+
+    :param bool lazy: passed to :func:`decsiopacket`
+    """
+
+    # ---- Constructor ---------------------------------------------------
+
+    def __init__(self, json_codec=None, lazy=False):
+        super().__init__()
+        self._json_codec = json_codec
+        self._lazy = lazy
+        self.reset()
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def pending_attachments(self):
+        """
+        The number of binary attachments still expected for the pending
+        packet (``0`` if there is none).
+        """
+        if self._pending is None:
+            return 0
+
+        return self._pending[-1] - len(self._attachments)
+
+    # ---- Public methods ------------------------------------------------
+
+    def feed(self, packet):
+        """
+        Feeds the data of the next Engine.IO ``message`` packet to the
+        decoder.
+
+        :param packet: a string Socket.IO packet, or a binary attachment
+
+        :type packet: `bytes`, `memoryview`, or `str` (`unicode`)
+
+        :returns: the same as :func:`decsiopacket` if ``packet`` completes
+            a Socket.IO packet, `None` otherwise
+
+        :raises: :exc:`~txsocketio.engineio.PayloadDecodeError` if
+            ``packet`` cannot be decoded or is unexpected (in which case
+            any pending packet is discarded)
+        """
+        if isinstance(packet, ( bytes, memoryview )):
+            if self._pending is None:
+                raise PayloadDecodeError('received unexpected binary attachment')
+
+            self._attachments.append(packet)
+
+            if len(self._attachments) < self._pending[-1]:
+                return None
+
+            packet_type, packet_obj, packet_path, packet_id, _ = self._pending
+            attachments = self._attachments
+            self.reset()
+
+            return packet_type, reconstructsiopacket(packet_obj, attachments), packet_path, packet_id
+
+        if self._pending is not None:
+            pending_attachments = self.pending_attachments
+            self.reset()
+
+            raise PayloadDecodeError('received packet while still expecting {} binary attachment(s)'.format(pending_attachments))
+
+        decoded = _decsiopacket(packet, self._json_codec, self._lazy)
+
+        if decoded[-1]:
+            self._pending = decoded
+
+            return None
+
+        return decoded[:-1]
+
+    def reset(self):
+        """
+        Discards any pending packet along with its attachments.
+        """
+        self._pending = None
+        self._attachments = []
+
 # ========================================================================
 class SocketIo(EngineIo):
     """
@@ -94,26 +316,84 @@ class SocketIo(EngineIo):
     upgrades, and dispatching received packets as events with ``event``
     set to one of one of the keys from :const:`SIO_TYPE_CODES_BY_NAME`.
 
-    Arguments are the same as with :class:`EngineIo`.
+    Arguments are the same as with :class:`EngineIo`, plus:
+
+    :param json_codec: the codec used to encode and decode packet data,
+        either a name accepted by
+        :func:`~txsocketio.engineio.jsoncodec` or a
+        :class:`~txsocketio.engineio.JsonCodec`; the default parses
+        non-integral numbers as floats (pass
+        :const:`~txsocketio.engineio.JSON_CODEC_DECIMAL` to parse them
+        as :class:`~decimal.Decimal` objects instead)
+
+    :param bool lazy_events: if `True`, ``event`` packets are dispatched
+        with a :class:`LazyEvent` instead of a :class:`list`, so that the
+        arguments of events no handler is interested in are never decoded
+
+    :param ack_timeout: the default number of seconds to wait for an
+        ``ack`` packet in response to an ``event`` packet before giving up
+        on it (see :meth:`emit` and :meth:`deferredemit`), or `None` to
+        wait indefinitely
+
+    In addition to being dispatched as ``event``, each ``event`` packet is
+    routed to any handlers registered for its path and event name via
+    :meth:`on_event`. The same goes for ``binary_event`` packets, which
+    are dispatched with their binary attachments already substituted for
+    their placeholders. Packets sent with :class:`bytes` anywhere in their
+    data are sent as ``binary_event`` or ``binary_ack`` packets (see
+    :meth:`sendsiopacket`).
     """
 
     # ---- Constructor ---------------------------------------------------
 
-    def __init__(self, base_url, transport_factories=None, reactor=None):
-        super().__init__(base_url, transport_factories, reactor)
+    def __init__(self, base_url, transport_factories=None, reactor=None, json_codec=JSON_CODEC_SIMPLEJSON, lazy_events=False, ack_timeout=_DEFAULT_ACK_TIMEOUT, direct_transport=None, protocol=EIO_PROTOCOL, heartbeat=None, reconnect=None, max_buffered_packets=None, max_buffered_bytes=None, buffer_overflow=BUFFER_DROP_OLDEST):
+        super().__init__(base_url, transport_factories, reactor, direct_transport, protocol, heartbeat, reconnect, max_buffered_packets, max_buffered_bytes, buffer_overflow)
+        self._json_codec = json_codec if isinstance(json_codec, JsonCodec) else jsoncodec(json_codec)
+        self._lazy_events = lazy_events
+        self._event_router = _EventRouter()
+        self._ack_timeout = ack_timeout
         self._ack_serial = 1
+        # Maps ack ids to ( callback, deferred ) tuples for acks that are
+        # still expected
+        self._acks = {}
+        # A heap of ( deadline, ack_id ) tuples (entries for acks that
+        # have already arrived are skipped when their deadlines pass)
+        self._ack_deadlines = []
+        self._ack_expiry_call = None
+        self._packets_decoder = SioPacketsDecoder(self._json_codec, self._lazy_events)
+        # Paths passed to connect (and not since disconnected), in order,
+        # to be rejoined after reconnecting
+        self._paths = collections.OrderedDict()
         self.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_MESSAGE], self._onmessage)
+        self.register(EIO_TYPE_NAMES_BY_CODE[EIO_TYPE_CLOSE], self._onclose)
+        self.register('reconnect', self._onreconnect)
+
+    # ---- Public properties ---------------------------------------------
+
+    @property
+    def pending_acks(self):
+        """
+        The number of ``ack`` packets that are still expected.
+        """
+        return len(self._acks)
 
     # ---- Public methods ------------------------------------------------
 
     def connect(self, path):
         """
-        Sends a Socket.IO ``connect`` packet for ``path``.
+        Sends a Socket.IO ``connect`` packet for ``path``. If the session
+        is later re-established (see the ``reconnect`` parameter of
+        :class:`~txsocketio.engineio.EngineIo`), ``path`` is rejoined
+        automatically (unless :meth:`disconnect` is called for it, or the
+        server disconnects it, first). Handlers registered via
+        :meth:`on_event` and the like survive reconnecting as is.
 
         :returns: a :class:`twisted.internet.defer.Deferred` whose
             callback is fired with a `None` argument after the packet is
             sent
         """
+        self._paths[path] = None
+
         return self.sendsiopacket(SIO_TYPE_CONNECT, packet_path=path)
 
     def disconnect(self, path):
@@ -124,6 +404,8 @@ class SocketIo(EngineIo):
             callback is fired with a `None` argument after the packet is
             sent
         """
+        self._paths.pop(path, None)
+
         return self.sendsiopacket(SIO_TYPE_DISCONNECT, packet_path=path)
 
     def emit(self, event, *args, **kw):
@@ -145,7 +427,7 @@ class SocketIo(EngineIo):
             transmitted ``event`` packet (note: whether or not ``acks``
             are sent in response to ``event`` packets is application-
             specific; if no ``ack`` is sent, ``callback`` will never be
-            called)
+            called, and will be forgotten after ``ack_timeout`` seconds)
 
         :returns: a :class:`twisted.internet.defer.Deferred` whose
             callback is fired with a `None` argument after the packet is
@@ -161,6 +443,82 @@ class SocketIo(EngineIo):
 
         return self.sendsiopacket(SIO_TYPE_EVENT, args_obj, packet_path=path, ack_callback=callback)
 
+    def deferredemit(self, event, *args, **kw):
+        """
+        Like :meth:`emit`, but requests an ``ack`` and returns a
+        :class:`~twisted.internet.defer.Deferred` for it instead of
+        taking a ``callback``.
+
+        :param str path: this parameter can only be provided as a keyword
+            argument; if provided it will set the path for the ``event``
+            packet
+
+        :param timeout: this parameter can only be provided as a keyword
+            argument; if provided it overrides ``ack_timeout`` (see
+            :class:`SocketIo`) for this ``event`` packet
+
+        :returns: a :class:`twisted.internet.defer.Deferred` whose
+            callback is fired with the data of the ``ack`` packet (usually
+            a :class:`list` of arguments) when it is received; its errback
+            is fired with an :class:`AckTimeoutError` if the ``ack``
+            doesn't arrive in time, or with the failure from sending the
+            ``event`` packet or from the connection closing; canceling it
+            forgets the ``ack``
+        """
+        if set(kw).difference(( 'path', 'timeout' )):
+            raise TypeError('unexpected keyword argument(s): {}'.format(', '.join(iterkeys(kw))))
+
+        path = kw.get('path', '/')
+        timeout = kw.get('timeout', self._ack_timeout)
+        args_obj = [ event ]
+        args_obj.extend(args)
+
+        def _cancel(_):
+            self._acks.pop(ack_id, None)
+
+        ack_d = t_defer.Deferred(_cancel)
+        ack_id = self._registerack(lambda packet_path, packet_obj: ack_d.callback(packet_obj), timeout, ack_d)
+        # Any failure is passed on to ack_d
+        self._sendsiopacket(SIO_TYPE_EVENT, args_obj, path, ack_id).addErrback(lambda _: None)
+
+        return ack_d
+
+    def off_event(self, path, name, handler, once=False):
+        """
+        Unregisters a ``handler`` previously registered with
+        :meth:`on_event` (or :meth:`once_event` if ``once`` is `True`).
+
+        :returns: `True` if ``handler`` was found, `False` if it wasn't
+        """
+        return self._event_router.unregister(( path, name ), handler, once)
+
+    def on_event(self, path, name, handler):
+        """
+        Registers ``handler`` to be called as ``handler(*args)`` whenever
+        an ``event`` packet for ``path`` whose data is ``[ name ] + args``
+        is received. Handlers are looked up by ``( path, name )``, so
+        those for other paths or event names are never called (and, with
+        ``lazy_events``, the arguments of events without any matching
+        handlers are never decoded). Otherwise, handlers behave as with
+        :meth:`~txsocketio.dispatcher.Dispatcher.register`.
+
+        :param str path: the Socket.IO path (e.g., ``'/'``)
+
+        :param str name: the event name
+
+        :param callable handler: the handler to be registered
+
+        :returns: `True`
+        """
+        return self._event_router.register(( path, name ), handler)
+
+    def once_event(self, path, name, handler):
+        """
+        Like :meth:`on_event`, but ``handler`` is unregistered just before
+        it is called.
+        """
+        return self._event_router.register(( path, name ), handler, once=True)
+
     def sendsiopacket(self, packet_type, packet_obj=None, packet_path='/', ack_callback=None):
         """
         Sends a Socket.IO packet via a
@@ -169,117 +527,298 @@ class SocketIo(EngineIo):
         :param bytes packet_type: the packet type, one of the values from
             :const:`SIO_TYPE_CODES_BY_NAME`
 
-        :param packet_obj: JSON-encodeable packet data
+        :param packet_obj: JSON-encodeable packet data, which may contain
+            :class:`bytes` (see :func:`deconstructsiopacket`); if it does,
+            an ``event`` or ``ack`` packet is sent as a ``binary_event``
+            or ``binary_ack`` packet followed by one binary Engine.IO
+            ``message`` packet per attachment
 
         :param str packet_path: the Socket.IO path
 
         :returns: a :class:`twisted.internet.defer.Deferred` whose
-            callback is fired with a `None` argument after the packet is
-            sent
+            callback is fired with a `None` argument after the packet (and
+            any attachments) are sent
         """
-        if packet_type in ( SIO_TYPE_BIN_EVENT, SIO_TYPE_BIN_ACK ):
-            raise NotImplementedError('binary Socket.IO packets are currently unsupported')
-
         if ack_callback is not None:
-            try:
-                ack_type = _SIO_ACK_TYPES_BY_TYPE[packet_type]
-            except KeyError:
+            if packet_type not in _SIO_ACK_TYPES_BY_TYPE:
                 raise ValueError('ack callback set, but packet type is "{}"'.format(SIO_TYPE_NAMES_BY_CODE[packet_type]))
 
-            ack_serial = self._ack_serial
-            self._ack_serial += 1
-            ack_id_event = '{}-{}'.format(SIO_TYPE_NAMES_BY_CODE[ack_type], ack_serial)
-            self.once(ack_id_event, lambda event, *args, **kw: ack_callback(*args, **kw))
+            ack_id = self._registerack(ack_callback, self._ack_timeout)
         else:
-            ack_serial = None
+            ack_id = None
 
-        return self.sendeiopacket(EIO_TYPE_MESSAGE, encsiopacket(packet_type, packet_obj, packet_path, ack_serial))
+        return self._sendsiopacket(packet_type, packet_obj, packet_path, ack_id)
 
-    # ---- Public methods ------------------------------------------------
+    # ---- Private methods -----------------------------------------------
+
+    def _expireacks(self):
+        self._ack_expiry_call = None
+        now = self._reactor.seconds()
+        ack_deadlines = self._ack_deadlines
+
+        while ack_deadlines \
+                and ack_deadlines[0][0] <= now:
+            _, ack_id = heapq.heappop(ack_deadlines)
+
+            try:
+                _, ack_d = self._acks.pop(ack_id)
+            except KeyError:
+                continue
+
+            _LOGGER.debug('gave up waiting for ack %d', ack_id)
+
+            if ack_d is not None:
+                ack_d.errback(AckTimeoutError('timed out waiting for ack {}'.format(ack_id)))
+
+        self._scheduleackexpiry()
+
+    def _onclose(self, _):
+        self._packets_decoder.reset()
+
+        if self._ack_expiry_call is not None:
+            self._ack_expiry_call.cancel()
+            self._ack_expiry_call = None
+
+        acks = self._acks
+        self._acks = {}
+        self._ack_deadlines = []
+
+        for ack_id, ( _, ack_d ) in sorted(iteritems(acks)):
+            if ack_d is not None:
+                ack_d.errback(t_error.ConnectionDone('connection closed while waiting for ack {}'.format(ack_id)))
 
     def _onmessage(self, _, payload):
-        packet_type, packet_obj, packet_path, packet_id = decsiopacket(payload)
+        decoded = self._packets_decoder.feed(payload)
+
+        if decoded is None:
+            # Waiting on binary attachments
+            return
+
+        packet_type, packet_obj, packet_path, packet_id = decoded
         packet_name = SIO_TYPE_NAMES_BY_CODE[packet_type]
+
+        if packet_type == SIO_TYPE_DISCONNECT:
+            self._paths.pop(packet_path, None)
+
         self.dispatch(packet_name, packet_path, packet_obj)
 
+        if packet_type in ( SIO_TYPE_EVENT, SIO_TYPE_BIN_EVENT ):
+            self._event_router.route(packet_path, packet_obj)
+
         if packet_id is not None \
                 and packet_type in ( SIO_TYPE_ACK, SIO_TYPE_BIN_ACK ):
-            ack_id_event = '{}-{}'.format(SIO_TYPE_NAMES_BY_CODE[packet_type], packet_id)
-            self.dispatch(ack_id_event, packet_path, packet_obj)
+            try:
+                ack_callback, _ = self._acks.pop(packet_id)
+            except KeyError:
+                _LOGGER.debug('ignoring unexpected (or expired) ack %d', packet_id)
+
+                return
+
+            try:
+                retval = ack_callback(packet_path, packet_obj)
+
+                if isinstance(retval, t_defer.Deferred):
+                    retval.addErrback(self._logerror, 'failure raised from deferred ack callback {!r} (ignored)'.format(ack_callback))
+            except Exception as exc:  # pylint: disable=broad-except
+                self._logerror(exc, 'exception raised from ack callback {!r} (ignored)'.format(ack_callback))
+
+    def _onreconnect(self, _, attempt):  # pylint: disable=unused-argument
+        for path in list(self._paths):
+            _LOGGER.debug('rejoining %s', path)
+            d = self.sendsiopacket(SIO_TYPE_CONNECT, packet_path=path)
+            d.addErrback(self._logerror, 'failure raised when rejoining {} (ignored)'.format(path))
+
+    def _registerack(self, callback, timeout, ack_d=None):
+        ack_id = self._ack_serial
+        self._ack_serial += 1
+        self._acks[ack_id] = ( callback, ack_d )
+
+        if timeout is not None:
+            heapq.heappush(self._ack_deadlines, ( self._reactor.seconds() + timeout, ack_id ))
+            self._scheduleackexpiry()
+
+        return ack_id
+
+    def _scheduleackexpiry(self):
+        if not self._ack_deadlines:
+            return
+
+        expire_at = self._ack_deadlines[0][0] + _ACK_EXPIRY_RESOLUTION
+        ack_expiry_call = self._ack_expiry_call
+
+        if ack_expiry_call is not None:
+            # Let an earlier (or only slightly later) call handle it
+            if ack_expiry_call.getTime() <= expire_at:
+                return
+
+            ack_expiry_call.cancel()
+
+        self._ack_expiry_call = self._reactor.callLater(max(0, expire_at - self._reactor.seconds()), self._expireacks)
+
+    def _sendsiopacket(self, packet_type, packet_obj, packet_path, ack_id):
+        try:
+            packet_obj, attachments = deconstructsiopacket(packet_obj)
+
+            if attachments:
+                packet_type = _SIO_BIN_TYPES_BY_TYPE.get(packet_type, packet_type)
+
+            packet = encsiopacket(packet_type, packet_obj, packet_path, ack_id, self._json_codec, len(attachments))
+            # Attachments must immediately follow their packet, so they're
+            # all handed off (and buffered, if need be) at once
+            ds = self._sendeiopackets([ ( EIO_TYPE_MESSAGE, packet ) ] + [ ( EIO_TYPE_MESSAGE, attachment ) for attachment in attachments ])
+        except Exception:
+            if ack_id is not None:
+                self._acks.pop(ack_id, None)
+
+            raise
+
+        if len(ds) == 1:
+            d = ds[0]
+        else:
+            d = t_defer.gatherResults(ds, consumeErrors=True)
+            d.addCallbacks(lambda _: None, lambda failure: failure.value.subFailure)
+
+        if ack_id is not None:
+            def _sendfailed(failure):
+                try:
+                    _, ack_d = self._acks.pop(ack_id)
+                except KeyError:
+                    pass
+                else:
+                    if ack_d is not None:
+                        ack_d.errback(failure)
+
+                return failure
+
+            d.addErrback(_sendfailed)
+
+        return d
+
+# ========================================================================
+class _EventRouter(Dispatcher):
+    """
+    Dispatches ``event`` packet objects to callbacks registered for
+    ``( path, event_name )``, calling each with only the event arguments.
+    """
+
+    # ---- Public methods ------------------------------------------------
+
+    def route(self, path, packet_obj):
+        if isinstance(packet_obj, LazyEvent):
+            name = packet_obj.name
+        elif isinstance(packet_obj, list) \
+                and packet_obj:
+            name = packet_obj[0]
+        else:
+            return
+
+        if not isinstance(name, str):
+            return
+
+        event = ( path, name )
+
+        # Don't bother with (potentially lazy) arguments if no one is
+        # listening
+        if self._callbacks.get(event):
+            self.dispatch(event, *packet_obj[1:])
+
+    # ---- Private methods -----------------------------------------------
+
+    def _callcallback(self, callback, event, args, kw):
+        return callback(*args, **kw)
 
 # ---- Functions ---------------------------------------------------------
 
 # ========================================================================
-def decsiopacket(packet):
+def decsiopacket(packet, json_codec=None, lazy=False, attachments=()):
     """
     Decodes a single Socket.IO packet. String packets are returned as
     unicode, either as :class:`~future.types.newstr.newstr` in Python 2
-    or :class:`str` in Python 3. Binary packets are returned as raw bytes,
-    either as :class:`~future.types.newbytes.newbytes` in Python 2 or
-    :class:`bytes` in Python 3.
+    or :class:`str` in Python 3. The binary attachments of
+    ``binary_event`` and ``binary_ack`` packets (which are sent as
+    separate Engine.IO packets; see :class:`SioPacketsDecoder`) are
+    substituted for their placeholders.
+
+    :param str packet: the packet to decode
 
-    :param packet: the packet to decode
+    :param json_codec: the :class:`~txsocketio.engineio.JsonCodec` used
+        to decode the packet data (defaults to
+        :func:`~txsocketio.engineio.jsonloads`)
 
-    :type packet: `bytes` or `str` (`unicode`)
+    :param bool lazy: if `True`, and ``packet`` is an ``event`` packet
+        whose data is a JSON array, ``packet_obj`` is a
+        :class:`LazyEvent` (and decoding errors are deferred until its
+        arguments are read)
+
+    :param sequence attachments: the binary attachments of a
+        ``binary_event`` or ``binary_ack`` packet
 
     :returns: a tuple ``( packet_type, packet_obj, packet_path, packet_id
         )``, where ``packet_type`` is one of the values from
         :const:`SIO_TYPE_CODES_BY_NAME`, ``packet_obj`` contains the data,
         ``packet_path`` is the Socket.IO path, and ``packet_id`` is the
         packet identifier (or `None` if not set)
+
+    :raises: :exc:`~txsocketio.engineio.PayloadDecodeError` if ``packet``
+        cannot be decoded, or if it calls for a different number of
+        attachments than were provided
     """
-    if isinstance(packet, str):
-        try:
-            packet_type = bytes(packet[0:1].encode('ascii'))
-            packet_data = str(packet[1:])
-        except UnicodeEncodeError:
-            packet_type = bytes(b'\xff')
-            packet_data = None
+    packet_type, packet_obj, packet_path, packet_id, attachment_count = _decsiopacket(packet, json_codec, lazy)
 
-        if packet_type in ( SIO_TYPE_BIN_EVENT, SIO_TYPE_BIN_ACK ):
-            raise PayloadDecodeError('packet type is "{}", but payload is not binary'.format(SIO_TYPE_NAMES_BY_CODE[packet_type]))
-    elif isinstance(packet, bytes):
-        packet_type = bytes(packet[0:1])
-        packet_data = bytes(packet[1:])
+    if attachment_count != len(attachments):
+        raise PayloadDecodeError('packet has {} binary attachment(s), but {} were provided'.format(attachment_count, len(attachments)))
 
-        if packet_type in SIO_TYPE_NAMES_BY_CODE \
-                and packet_type not in ( SIO_TYPE_BIN_EVENT, SIO_TYPE_BIN_ACK ):
-            raise PayloadDecodeError('packet type is "{}", but payload is binary'.format(SIO_TYPE_NAMES_BY_CODE[packet_type]))
+    if attachment_count:
+        packet_obj = reconstructsiopacket(packet_obj, attachments)
 
-        raise NotImplementedError('binary Socket.IO packets are currently unsupported')
-    else:
-        raise TypeError('packet type must be one of bytes or str, not {}'.format(type(packet).__name__))
+    return packet_type, packet_obj, packet_path, packet_id
 
-    if len(packet) == 0:
-        raise PayloadDecodeError('packet truncated')
+# ========================================================================
+def deconstructsiopacket(packet_obj):
+    """
+    Replaces any binary data in ``packet_obj`` with placeholders (i.e.,
+    ``{ "_placeholder": true, "num": <index> }``) in preparation for
+    sending it as a ``binary_event`` or ``binary_ack`` packet. Lists,
+    tuples, and dicts are only copied where they contain binary data
+    (tuples become lists), and the binary data are not copied at all.
+
+    :param packet_obj: JSON-encodeable packet data, which may contain
+        :class:`bytes`, :class:`bytearray`, or :class:`memoryview` objects
+
+    :returns: a tuple ``( packet_obj, attachments )``, where
+        ``attachments`` is a :class:`list` of the :class:`bytes` objects
+        replaced, in placeholder order
+    """
+    attachments = []
 
-    if packet_type not in SIO_TYPE_NAMES_BY_CODE:
-        raise PayloadDecodeError('unrecognized packet type "{!r}"'.format(packet_type))
+    def _deconstruct(obj):
+        if isinstance(obj, bytes):
+            attachments.append(obj)
+        elif isinstance(obj, ( bytearray, memoryview )):
+            attachments.append(bytes(obj))
+        elif isinstance(obj, ( list, tuple )):
+            items = [ _deconstruct(item) for item in obj ]
 
-    for packet_re in _PACKET_RES:
-        matches = re.search(packet_re, packet_data, _PACKET_RE_FLAGS)
+            if any(( new is not old for new, old in zip(items, obj) )):
+                return items
 
-        if matches:
-            break
+            return obj
+        elif isinstance(obj, dict):
+            items = dict(( ( k, _deconstruct(v) ) for k, v in iteritems(obj) ))
 
-    if matches:
-        packet_path = matches.group('path')
-        packet_path = packet_path if packet_path else '/'
-        packet_id = matches.group('id')
-        packet_id = int(packet_id, 10) if packet_id else None
-        packet_json = matches.group('data')
+            if any(( items[k] is not v for k, v in iteritems(obj) )):
+                return items
 
-        try:
-            packet_obj = jsonloads(packet_json) if packet_json else ''
-        except ValueError:
-            raise PayloadDecodeError('unparsable JSON data')
-    else:
-        raise PayloadDecodeError('unrecognized Socket.IO packet format')
+            return obj
+        else:
+            return obj
 
-    return packet_type, packet_obj, packet_path, packet_id
+        return { _PLACEHOLDER_KEY: True, _PLACEHOLDER_NUM_KEY: len(attachments) - 1 }
+
+    return _deconstruct(packet_obj), attachments
 
 # ========================================================================
-def encsiopacket(packet_type, packet_obj, packet_path='/', packet_id=None):
+def encsiopacket(packet_type, packet_obj, packet_path='/', packet_id=None, json_codec=None, attachments=0):
     """
     Encodes a single Socket.IO packet.
 
@@ -293,18 +832,226 @@ def encsiopacket(packet_type, packet_obj, packet_path='/', packet_id=None):
     :param Integral packet_id: a packet identifier (used for matching
         ``ack`` packets with ``event`` packets)
 
+    :param json_codec: the :class:`~txsocketio.engineio.JsonCodec` used
+        to encode ``packet_obj`` (defaults to
+        :func:`~txsocketio.engineio.jsondumps`)
+
+    :param Integral attachments: for ``binary_event`` and ``binary_ack``
+        packets, the number of binary attachments (which must be sent
+        separately) whose placeholders are in ``packet_obj`` (see
+        :func:`deconstructsiopacket`)
+
     :returns: the packet
 
     :raises: :class:`PayloadEncodeError` if `packet_type` is not a
-        recognized value
+        recognized value, or if ``attachments`` is nonzero and
+        ``packet_type`` is not a binary type
     """
     if packet_type not in SIO_TYPE_NAMES_BY_CODE:
         raise PayloadEncodeError('unrecognized packet type "{!r}"'.format(packet_type))
 
-    packet_type = packet_type.decode('ascii')
+    if packet_type in _SIO_BIN_TYPES:
+        packet_prefix = '{}{:d}-'.format(packet_type.decode('ascii'), attachments)
+    elif attachments:
+        raise PayloadEncodeError('packet type "{}" cannot have binary attachments'.format(SIO_TYPE_NAMES_BY_CODE[packet_type]))
+    else:
+        packet_prefix = packet_type.decode('ascii')
+
     packet_path = packet_path if packet_path else '/'
-    packet_json = '' if packet_obj in ( None, '' ) else jsondumps(packet_obj)
+    dumps = jsondumps if json_codec is None else json_codec.dumps
+    packet_json = '' if packet_obj in ( None, '' ) else dumps(packet_obj)
     packet_json = packet_json.decode('utf_8') if isinstance(packet_json, bytes) else packet_json
     packet_tail = '{:d}{}'.format(packet_id, packet_json) if packet_id is not None else packet_json
 
-    return '{}{},{}'.format(packet_type[0], packet_path, packet_tail)
+    return '{}{},{}'.format(packet_prefix, packet_path, packet_tail)
+
+# ========================================================================
+def reconstructsiopacket(packet_obj, attachments):
+    """
+    The inverse of :func:`deconstructsiopacket`, substituting
+    ``attachments`` for their placeholders in ``packet_obj``. Lists and
+    dicts are modified in place, and the attachments are not copied.
+
+    :param packet_obj: decoded packet data
+
+    :param sequence attachments: the binary attachments
+
+    :returns: ``packet_obj`` with its placeholders replaced
+
+    :raises: :exc:`~txsocketio.engineio.PayloadDecodeError` if a
+        placeholder refers to a nonexistent attachment
+    """
+    def _reconstruct(obj):
+        if isinstance(obj, list):
+            for i, item in enumerate(obj):
+                obj[i] = _reconstruct(item)
+        elif isinstance(obj, dict):
+            if obj.get(_PLACEHOLDER_KEY) is True:
+                num = obj.get(_PLACEHOLDER_NUM_KEY)
+
+                if not isinstance(num, int) \
+                        or isinstance(num, bool) \
+                        or not 0 <= num < len(attachments):
+                    raise PayloadDecodeError('placeholder refers to nonexistent attachment {!r}'.format(num))
+
+                return attachments[num]
+
+            for k, v in iteritems(obj):
+                obj[k] = _reconstruct(v)
+
+        return obj
+
+    return _reconstruct(packet_obj)
+
+# ========================================================================
+def _decsiopacket(packet, json_codec, lazy):
+    """
+    Does the work of :func:`decsiopacket`, but leaves any placeholders in
+    place.
+
+    :returns: the same as :func:`decsiopacket`, plus the number of
+        binary attachments called for by the packet
+    """
+    if isinstance(packet, str):
+        try:
+            packet_type = bytes(packet[0:1].encode('ascii'))
+            packet_data = str(packet[1:])
+        except UnicodeEncodeError:
+            packet_type = bytes(b'\xff')
+            packet_data = None
+    elif isinstance(packet, ( bytes, memoryview )):
+        raise PayloadDecodeError('payload is binary, but only binary attachments are sent as binary')
+    else:
+        raise TypeError('packet type must be one of bytes or str, not {}'.format(type(packet).__name__))
+
+    if len(packet) == 0:
+        raise PayloadDecodeError('packet truncated')
+
+    if packet_type not in SIO_TYPE_NAMES_BY_CODE:
+        raise PayloadDecodeError('unrecognized packet type "{!r}"'.format(packet_type))
+
+    attachment_count = 0
+
+    if packet_type in _SIO_BIN_TYPES:
+        count_end = _scansiopacketid(packet_data, 0)
+
+        if count_end <= 0 \
+                or packet_data[count_end:count_end + 1] != '-':
+            raise PayloadDecodeError('packet type is "{}", but attachment count is missing'.format(SIO_TYPE_NAMES_BY_CODE[packet_type]))
+
+        attachment_count = int(packet_data[:count_end], 10)
+        packet_data = packet_data[count_end + 1:]
+
+    # This is equivalent to trying each of the following (verbose)
+    # patterns in order, but in one pass and without regexes:
+    #
+    #   ^ (?P<path>/[^,]*) (?:, (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)?)? $
+    #   ^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))  (?P<data>[^0-9].*)?   $
+    #   ^ (?P<path>)            (?P<id>(?:0|[1-9][0-9]*))? (?P<data>[^0-9].*)    $
+    #   ^ (?P<path>)            (?P<id>)                   (?P<data>)            $
+    packet_path = '/'
+    id_pos = id_end = 0
+
+    if packet_data[0:1] == '/':
+        comma_pos = packet_data.find(',')
+
+        if comma_pos < 0:
+            packet_path = packet_data
+            id_pos = id_end = len(packet_data)
+        else:
+            id_end = _scansiopacketid(packet_data, comma_pos + 1)
+
+            if id_end < 0:
+                # An id with a leading zero can't follow the path, so the
+                # whole thing is (bogus) data
+                id_end = 0
+            else:
+                packet_path = packet_data[:comma_pos]
+                id_pos = comma_pos + 1
+    else:
+        id_end = _scansiopacketid(packet_data, 0)
+
+        if id_end < 0:
+            raise PayloadDecodeError('unrecognized Socket.IO packet format')
+
+    packet_id = int(packet_data[id_pos:id_end], 10) if id_end > id_pos else None
+    packet_json = packet_data[id_end:]
+    loads = jsonloads if json_codec is None else json_codec.loads
+
+    if lazy \
+            and packet_type == SIO_TYPE_EVENT \
+            and packet_json.lstrip(_JSON_WHITESPACE)[0:1] == '[':
+        return packet_type, LazyEvent(packet_json, loads), packet_path, packet_id, attachment_count
+
+    try:
+        packet_obj = loads(packet_json) if packet_json else ''
+    except ValueError:
+        raise PayloadDecodeError('unparsable JSON data')
+
+    return packet_type, packet_obj, packet_path, packet_id, attachment_count
+
+# ========================================================================
+def _scansiopacketid(packet_data, pos):
+    """
+    Scans the (possibly empty) run of ASCII digits starting at
+    ``packet_data[pos]``.
+
+    :returns: the position just past the digits, or ``-1`` if they have
+        a leading zero (i.e., are not a valid packet identifier)
+    """
+    end = pos
+    packet_data_len = len(packet_data)
+
+    while end < packet_data_len and '0' <= packet_data[end] <= '9':
+        end += 1
+
+    if end - pos > 1 \
+            and packet_data[pos] == '0':
+        return -1
+
+    return end
+
+# ========================================================================
+def _scaneventname(packet_json, loads):
+    """
+    Finds the first element of the JSON array ``packet_json`` without
+    decoding the rest of it.
+
+    :returns: the first element if it is a string, or `None` otherwise
+        (including if the string cannot be found cheaply)
+    """
+    packet_json_len = len(packet_json)
+    start = packet_json.find('[') + 1
+
+    while start < packet_json_len \
+            and packet_json[start] in _JSON_WHITESPACE:
+        start += 1
+
+    if packet_json[start:start + 1] != '"':
+        return None
+
+    end = start
+
+    while True:
+        end = packet_json.find('"', end + 1)
+
+        if end < 0:
+            return None
+
+        escape_pos = end - 1
+
+        while packet_json[escape_pos] == '\\':
+            escape_pos -= 1
+
+        if (end - escape_pos) % 2:
+            break
+
+    name = packet_json[start + 1:end]
+
+    if '\\' in name:
+        try:
+            name = loads(packet_json[start:end + 1])
+        except ValueError:
+            return None
+
+    return name